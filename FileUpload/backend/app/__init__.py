@@ -1,15 +1,19 @@
 # Flask app factory and main entry point
 import os
+import urllib3
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from minio import Minio
 from dotenv import load_dotenv
+from .metrics import InstrumentedStorage, init_metrics
+from .queries import init_queries
+from .storage import LocalStorage, MinioStorage
 
 db = SQLAlchemy()
 jwt = JWTManager()
-minio_client = None
+storage = None
 
 def create_app():
     load_dotenv()
@@ -18,18 +22,113 @@ def create_app():
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Set for gunicorn by gunicorn.conf.py; sync workers serve one request each
+    gevent_workers = os.getenv('GUNICORN_WORKER_CLASS', 'sync') == 'gevent'
+    if not (app.config['SQLALCHEMY_DATABASE_URI'] or '').startswith('sqlite'):
+        # Per worker process; under gevent every concurrent request shares it
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+            'pool_pre_ping': True
+        }
+    app.config['MINIO_POOL_SIZE'] = int(os.getenv('MINIO_POOL_SIZE', 10))
+    app.config['STORAGE_BACKEND'] = os.getenv('STORAGE_BACKEND', 'minio')  # minio or local
+    app.config['STORAGE_LOCAL_ROOT'] = os.getenv('STORAGE_LOCAL_ROOT', '/app/data/objects')
+    app.config['STORAGE_FSYNC_BYTES'] = int(os.getenv('STORAGE_FSYNC_BYTES', 64 * 1024 * 1024))
+    app.config['DOWNLOAD_CHUNK_SIZE'] = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 256 * 1024))
+    app.config['UPLOAD_PART_SIZE'] = int(os.getenv('UPLOAD_PART_SIZE', 8 * 1024 * 1024))
+    app.config['UPLOAD_BATCH_MAX_FILES'] = int(os.getenv('UPLOAD_BATCH_MAX_FILES', 500))
+    app.config['UPLOAD_BATCH_CONCURRENCY'] = int(os.getenv('UPLOAD_BATCH_CONCURRENCY', 8))
+    app.config['DOWNLOAD_CACHE_DIR'] = os.getenv('DOWNLOAD_CACHE_DIR', '')  # empty disables the cache
+    app.config['DOWNLOAD_CACHE_MAX_BYTES'] = int(os.getenv('DOWNLOAD_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+    app.config['DOWNLOAD_CACHE_MAX_OBJECT_BYTES'] = int(os.getenv('DOWNLOAD_CACHE_MAX_OBJECT_BYTES', 256 * 1024 * 1024))
+    app.config['FILES_PAGE_SIZE'] = int(os.getenv('FILES_PAGE_SIZE', 50))
+    app.config['FILES_MAX_PAGE_SIZE'] = int(os.getenv('FILES_MAX_PAGE_SIZE', 200))
+    app.config['CHANGES_PAGE_SIZE'] = int(os.getenv('CHANGES_PAGE_SIZE', 500))
+    app.config['CHANGES_MAX_PAGE_SIZE'] = int(os.getenv('CHANGES_MAX_PAGE_SIZE', 1000))
+    # A long poll holds its worker, so only gevent workers allow them by default
+    app.config['CHANGES_MAX_WAIT'] = float(os.getenv('CHANGES_MAX_WAIT', 25 if gevent_workers else 0))
+    app.config['CHANGES_POLL_INTERVAL'] = float(os.getenv('CHANGES_POLL_INTERVAL', 1.0))
+    app.config['ARCHIVE_MAX_FILES'] = int(os.getenv('ARCHIVE_MAX_FILES', 10000))
+    app.config['ARCHIVE_LINK_EXPIRY'] = int(os.getenv('ARCHIVE_LINK_EXPIRY', 60))
+    app.config['STORAGE_COMPRESSION'] = os.getenv('STORAGE_COMPRESSION', 'off')  # off or zstd
+    app.config['STORAGE_COMPRESSION_LEVEL'] = int(os.getenv('STORAGE_COMPRESSION_LEVEL', 3))
+    app.config['STORAGE_COMPRESSION_MIN_RATIO'] = float(os.getenv('STORAGE_COMPRESSION_MIN_RATIO', 1.5))
+    app.config['STORAGE_COMPRESSION_MIN_BYTES'] = int(os.getenv('STORAGE_COMPRESSION_MIN_BYTES', 4096))
+    app.config['CONTENT_ADDRESSED_STORAGE'] = os.getenv('CONTENT_ADDRESSED_STORAGE', 'true').lower() == 'true'
+    app.config['PRESIGNED_TRANSFERS'] = os.getenv('PRESIGNED_TRANSFERS', 'false').lower() == 'true'
+    app.config['PRESIGNED_URL_EXPIRY'] = int(os.getenv('PRESIGNED_URL_EXPIRY', 900))
+    app.config['ACTIVITY_ASYNC'] = os.getenv('ACTIVITY_ASYNC', 'true').lower() == 'true'
+    app.config['ACTIVITY_QUEUE_SIZE'] = int(os.getenv('ACTIVITY_QUEUE_SIZE', 10000))
+    app.config['ACTIVITY_BATCH_SIZE'] = int(os.getenv('ACTIVITY_BATCH_SIZE', 500))
+    app.config['ACTIVITY_FLUSH_INTERVAL'] = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 1.0))
+    app.config['ACTIVITY_OVERFLOW'] = os.getenv('ACTIVITY_OVERFLOW', 'sync')
+    app.config['ACTIVITY_PAGE_SIZE'] = int(os.getenv('ACTIVITY_PAGE_SIZE', 20))
+    app.config['ACTIVITY_MAX_PAGE_SIZE'] = int(os.getenv('ACTIVITY_MAX_PAGE_SIZE', 100))
+    app.config['ACTIVITY_RETENTION_DAYS'] = int(os.getenv('ACTIVITY_RETENTION_DAYS', 90))
+    app.config['THUMBNAILS_ENABLED'] = os.getenv('THUMBNAILS_ENABLED', 'true').lower() == 'true'
+    app.config['THUMBNAIL_SIZE'] = int(os.getenv('THUMBNAIL_SIZE', 256))
+    app.config['THUMBNAIL_WORKERS'] = int(os.getenv('THUMBNAIL_WORKERS', 2))  # 0 renders inline
+    app.config['THUMBNAIL_BATCH_SIZE'] = int(os.getenv('THUMBNAIL_BATCH_SIZE', 8))
+    app.config['THUMBNAIL_MAX_SOURCE_BYTES'] = int(os.getenv('THUMBNAIL_MAX_SOURCE_BYTES', 64 * 1024 * 1024))
+    app.config['THUMBNAIL_MAX_ATTEMPTS'] = int(os.getenv('THUMBNAIL_MAX_ATTEMPTS', 5))
+    app.config['THUMBNAIL_MAX_AGE'] = int(os.getenv('THUMBNAIL_MAX_AGE', 365 * 24 * 3600))
+    app.config['PURGE_GRACE_DAYS'] = int(os.getenv('PURGE_GRACE_DAYS', 7))
+    app.config['PURGE_BATCH_SIZE'] = int(os.getenv('PURGE_BATCH_SIZE', 1000))
+    app.config['PURGE_STALE_UPLOAD_HOURS'] = int(os.getenv('PURGE_STALE_UPLOAD_HOURS', 24))
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    app.config['AUTHZ_CACHE_SIZE'] = int(os.getenv('AUTHZ_CACHE_SIZE', 10000))
+    app.config['AUTHZ_CACHE_TTL'] = float(os.getenv('AUTHZ_CACHE_TTL', 30))
+    app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    # 0 hashes inline; a pool only helps workers that serve others meanwhile
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2 if gevent_workers else 0))
+    app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 16))
+    app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+    app.config['SQL_DEBUG_HEADERS'] = os.getenv('SQL_DEBUG_HEADERS', 'false').lower() == 'true'
+    app.config['SQL_QUERY_BUDGET_STRICT'] = os.getenv('SQL_QUERY_BUDGET_STRICT', 'false').lower() == 'true'
 
     db.init_app(app)
     jwt.init_app(app)
     CORS(app)
+    init_queries(app, db)
 
-    global minio_client
-    minio_client = Minio(
-        os.getenv('MINIO_ENDPOINT'),
-        access_key=os.getenv('MINIO_ACCESS_KEY'),
-        secret_key=os.getenv('MINIO_SECRET_KEY'),
-        secure=False
-    )
+    global storage
+    if app.config['STORAGE_BACKEND'] == 'local':
+        storage = LocalStorage(app.config['STORAGE_LOCAL_ROOT'], app.config['STORAGE_FSYNC_BYTES'])
+    else:
+        minio_client = Minio(
+            os.getenv('MINIO_ENDPOINT'),
+            access_key=os.getenv('MINIO_ACCESS_KEY'),
+            secret_key=os.getenv('MINIO_SECRET_KEY'),
+            secure=False,
+            # minio's default pool keeps 10 connections per host; concurrent
+            # transfers beyond that open and discard a connection each
+            http_client=urllib3.PoolManager(
+                maxsize=app.config['MINIO_POOL_SIZE'],
+                timeout=urllib3.Timeout(connect=10, read=300),
+                retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+            )
+        )
+
+        # Presigned URLs are signed for the host clients will connect to, which
+        # is usually not the internal docker hostname used by minio_client
+        minio_presign_client = None
+        if os.getenv('MINIO_PUBLIC_ENDPOINT'):
+            minio_presign_client = Minio(
+                os.getenv('MINIO_PUBLIC_ENDPOINT'),
+                access_key=os.getenv('MINIO_ACCESS_KEY'),
+                secret_key=os.getenv('MINIO_SECRET_KEY'),
+                secure=os.getenv('MINIO_PUBLIC_SECURE', 'false').lower() == 'true',
+                region=os.getenv('MINIO_REGION', 'us-east-1')
+            )
+
+        storage = MinioStorage(minio_client, os.getenv('MINIO_BUCKET'), presign_client=minio_presign_client,
+                               part_size=app.config['UPLOAD_PART_SIZE'])
+
+    if app.config['METRICS_ENABLED']:
+        storage = InstrumentedStorage(storage)
+        init_metrics(app)
 
     from .routes.auth import auth_bp
     from .routes.groups import groups_bp
@@ -38,4 +137,43 @@ def create_app():
     app.register_blueprint(groups_bp, url_prefix='/api/groups')
     app.register_blueprint(files_bp, url_prefix='/api/files')
 
+    from .authz import membership_cache
+    membership_cache.configure(app.config['AUTHZ_CACHE_SIZE'], app.config['AUTHZ_CACHE_TTL'])
+
+    from .passwords import password_hasher
+    password_hasher.configure(
+        app.config['PASSWORD_HASH_METHOD'],
+        app.config['PASSWORD_HASH_WORKERS'],
+        app.config['PASSWORD_HASH_MAX_PENDING'],
+        app.config['PASSWORD_HASH_TIMEOUT']
+    )
+
+    from .compression import compression_policy
+    compression_policy.configure(
+        app.config['STORAGE_COMPRESSION'] == 'zstd',
+        app.config['STORAGE_COMPRESSION_LEVEL'],
+        app.config['STORAGE_COMPRESSION_MIN_RATIO'],
+        app.config['STORAGE_COMPRESSION_MIN_BYTES']
+    )
+
+    from .cache import object_cache
+    object_cache.configure(
+        app.config['DOWNLOAD_CACHE_DIR'],
+        app.config['DOWNLOAD_CACHE_MAX_BYTES'],
+        app.config['DOWNLOAD_CACHE_MAX_OBJECT_BYTES']
+    )
+
+    from .activity import activity_writer
+    activity_writer.configure(
+        app,
+        enabled=app.config['ACTIVITY_ASYNC'],
+        max_queue=app.config['ACTIVITY_QUEUE_SIZE'],
+        batch_size=app.config['ACTIVITY_BATCH_SIZE'],
+        flush_interval=app.config['ACTIVITY_FLUSH_INTERVAL'],
+        overflow=app.config['ACTIVITY_OVERFLOW']
+    )
+
+    from .cli import register_commands
+    register_commands(app)
+
     return app 
\ No newline at end of file
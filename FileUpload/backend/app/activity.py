@@ -0,0 +1,218 @@
+# Activity logging off the request path: queue in-process, insert in batches
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, insert
+from . import db
+from .models import Activity, ActivityRollup
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('sync', 'block', 'drop')
+
+
+class ActivityWriter:
+    """Buffers Activity rows and writes them with multi-row INSERTs.
+
+    A daemon thread flushes when ``batch_size`` rows are waiting or
+    ``flush_interval`` seconds have passed. When the bounded queue is full
+    the ``overflow`` policy decides what happens to the new row:
+
+    - ``sync``: write it inline on the request (never loses records)
+    - ``block``: wait up to ``block_timeout`` for space, then write inline
+    - ``drop``: discard it and count it in ``stats()['dropped']``
+
+    Pending rows are flushed at interpreter exit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self.app = None
+        self.enabled = False
+        self._queue = queue.Queue()
+        self._reset_stats()
+        atexit.register(self.shutdown)
+
+    def _reset_stats(self):
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.inline_writes = 0
+
+    def configure(self, app, enabled, max_queue=10000, batch_size=500,
+                  flush_interval=1.0, overflow='sync', block_timeout=0.5):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'ACTIVITY_OVERFLOW must be one of {", ".join(OVERFLOW_POLICIES)}')
+        self.shutdown()
+        self.app = app
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset_stats()
+
+    def record(self, **fields):
+        """Queue one activity. Call after the request's own commit."""
+        self.record_many([fields])
+
+    def record_many(self, rows):
+        """Queue several activities. Any written inline (writer disabled or
+        queue full) go in with a single INSERT."""
+        now = datetime.utcnow()
+        for fields in rows:
+            fields.setdefault('timestamp', now)
+            fields.setdefault('activity_data', None)
+            fields.setdefault('group_id', None)
+            fields.setdefault('file_id', None)
+        if not self.enabled:
+            self._write(rows)
+            self.inline_writes += len(rows)
+            return
+
+        self._ensure_thread()
+        overflow = []
+        for fields in rows:
+            try:
+                if self.overflow == 'block':
+                    self._queue.put(fields, timeout=self.block_timeout)
+                else:
+                    self._queue.put_nowait(fields)
+            except queue.Full:
+                if self.overflow == 'drop':
+                    self.dropped += 1
+                    logger.warning('Activity queue full, dropped %s activity', fields['activity_type'])
+                else:
+                    overflow.append(fields)
+        if overflow:
+            self._write(overflow)
+            self.inline_writes += len(overflow)
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so gunicorn workers each start their own
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='activity-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._flush_batch(wait=True)
+
+    def _flush_batch(self, wait):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if not wait or timeout <= 0:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+                continue
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+        return len(batch)
+
+    def _write(self, rows):
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(Activity), rows)
+                db.session.commit()
+                self.written += len(rows)
+                self.batches += 1
+            except Exception:
+                db.session.rollback()
+                self.failed += len(rows)
+                logger.exception('Failed to write %d activity record(s)', len(rows))
+            finally:
+                db.session.remove()
+
+    def flush(self):
+        """Write everything queued so far from the calling thread."""
+        while self._flush_batch(wait=False):
+            pass
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 1)
+        if self.app is not None and self.enabled:
+            self.flush()
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+            'inline_writes': self.inline_writes
+        }
+
+
+activity_writer = ActivityWriter()
+
+
+def log_activity(**fields):
+    """Record an Activity row without adding it to the request's transaction."""
+    activity_writer.record(**fields)
+
+
+def log_activities(rows):
+    """log_activity for many rows at once, e.g. a batch upload."""
+    activity_writer.record_many(rows)
+
+
+def compact_activity(before):
+    """Fold raw Activity rows older than ``before`` into daily ActivityRollup
+    counts and delete them, one day per transaction.
+
+    ``before`` is rounded down to midnight so each day is rolled up whole.
+    Returns the number of raw rows removed.
+    """
+    cutoff = datetime.combine(before.date(), datetime.min.time())
+    compacted = 0
+    while True:
+        oldest = db.session.query(func.min(Activity.timestamp)).filter(Activity.timestamp < cutoff).scalar()
+        if oldest is None:
+            return compacted
+        start = datetime.combine(oldest.date(), datetime.min.time())
+        in_day = and_(Activity.timestamp >= start, Activity.timestamp < start + timedelta(days=1))
+
+        buckets = db.session.query(
+            Activity.group_id,
+            Activity.activity_type,
+            func.count(Activity.id)
+        ).filter(in_day).group_by(Activity.group_id, Activity.activity_type).all()
+        for group_id, activity_type, count in buckets:
+            # A day is normally compacted once; merge in case rows arrived late
+            updated = ActivityRollup.query.filter(
+                ActivityRollup.day == start.date(),
+                ActivityRollup.group_id.is_(None) if group_id is None else ActivityRollup.group_id == group_id,
+                ActivityRollup.activity_type == activity_type
+            ).update({ActivityRollup.count: ActivityRollup.count + count}, synchronize_session=False)
+            if not updated:
+                db.session.add(ActivityRollup(day=start.date(), group_id=group_id,
+                                              activity_type=activity_type, count=count))
+
+        compacted += Activity.query.filter(in_day).delete(synchronize_session=False)
+        db.session.commit()
@@ -0,0 +1,134 @@
+# Streaming ZIP archives assembled from MinIO objects
+import queue
+import threading
+import zipfile
+
+COMPRESSION_METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+}
+
+_END_OF_ENTRY = object()
+
+
+class ArchiveEntry:
+    def __init__(self, arcname, minio_key, size, modified, content_encoding=None):
+        self.arcname = arcname
+        self.minio_key = minio_key
+        self.size = size
+        self.modified = modified
+        self.content_encoding = content_encoding
+
+
+class _ChunkSink:
+    """Write-only, unseekable target for ZipFile.
+
+    Without tell()/seek() ZipFile writes data descriptors after each entry
+    instead of seeking back, which is what allows the archive to be streamed.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def unique_arcnames(names):
+    """Disambiguate duplicate filenames as ``name (1).ext``, ``name (2).ext``..."""
+    seen = set()
+    result = []
+    for name in names:
+        candidate, n = name, 0
+        while candidate in seen:
+            n += 1
+            stem, dot, ext = name.rpartition('.')
+            candidate = f'{stem} ({n}).{ext}' if dot and stem else f'{name} ({n})'
+        seen.add(candidate)
+        result.append(candidate)
+    return result
+
+
+def _prefetch(entries, open_object, chunks, stop, chunk_size):
+    """Read every entry's object into the bounded ``chunks`` queue in order.
+
+    Runs in a background thread so the next object is already being fetched
+    while the consumer is still compressing and sending the current one.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for entry in entries:
+            response = open_object(entry)
+            try:
+                for chunk in response.stream(chunk_size):
+                    if not put(chunk):
+                        return
+            finally:
+                response.close()
+                response.release_conn()
+            if not put(_END_OF_ENTRY):
+                return
+    except Exception as e:
+        put(e)
+
+
+def iter_zip(entries, open_object, compression=zipfile.ZIP_STORED,
+             chunk_size=256 * 1024, prefetch_chunks=8):
+    """Yield a ZIP archive of ``entries`` without holding whole objects.
+
+    ``open_object(entry)`` must return a MinIO-style response with
+    ``stream()``, ``close()`` and ``release_conn()``. At most
+    ``prefetch_chunks`` chunks are buffered ahead of the writer.
+    """
+    chunks = queue.Queue(maxsize=prefetch_chunks)
+    stop = threading.Event()
+    fetcher = threading.Thread(
+        target=_prefetch,
+        args=(entries, open_object, chunks, stop, chunk_size),
+        daemon=True
+    )
+    fetcher.start()
+
+    sink = _ChunkSink()
+    try:
+        with zipfile.ZipFile(sink, 'w', compression=compression, allowZip64=True) as archive:
+            for entry in entries:
+                info = zipfile.ZipInfo(entry.arcname, entry.modified.timetuple()[:6])
+                info.compress_type = compression
+                info.file_size = entry.size  # lets ZipFile pick zip64 up front
+                with archive.open(info, 'w') as dest:
+                    while True:
+                        item = chunks.get()
+                        if item is _END_OF_ENTRY:
+                            break
+                        if isinstance(item, Exception):
+                            raise item
+                        dest.write(item)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                data = sink.drain()
+                if data:
+                    yield data
+        yield sink.drain()
+    finally:
+        # Unblock the fetcher if the client went away mid-archive
+        stop.set()
+        fetcher.join(timeout=5)
@@ -0,0 +1,111 @@
+# Group membership/role lookups backed by a per-process cache
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import get_jwt_identity
+from .models import GroupMembership
+
+
+class MembershipCache:
+    """Bounded LRU of (user_id, group_id) -> role whose entries expire after
+    ``ttl`` seconds.
+
+    Only positive lookups are cached, so a newly added member is never
+    refused. Role changes and removals made by this process take effect
+    immediately via invalidate(); other workers see them within ``ttl``.
+    """
+
+    def __init__(self, max_entries=10000, ttl=30):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.configure(max_entries, ttl)
+
+    def configure(self, max_entries, ttl):
+        with self._lock:
+            self.max_entries = max_entries
+            self.ttl = ttl
+            self._entries.clear()
+            self.generation = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, role, generation):
+        """Store ``role`` unless an invalidation happened since ``generation``
+        was read, in which case the role may predate it."""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (role, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id, group_id):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop((int(user_id), int(group_id)), None)
+
+    def invalidate_group(self, group_id):
+        with self._lock:
+            self.generation += 1
+            for key in [k for k in self._entries if k[1] == int(group_id)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries)
+            }
+
+
+membership_cache = MembershipCache()
+
+
+def get_role(user_id, group_id):
+    """The user's role in the group, or None if they are not a member."""
+    key = (int(user_id), int(group_id))
+    role = membership_cache.get(key)
+    if role is not None:
+        return role
+
+    generation = membership_cache.generation
+    membership = GroupMembership.query.filter_by(user_id=key[0], group_id=key[1]).first()
+    if not membership:
+        return None
+    membership_cache.set(key, membership.role, generation)
+    return membership.role
+
+
+def require_membership(roles=None, msg='Not a group member'):
+    """Reject the request with 403 unless the caller belongs to the route's
+    ``group_id`` (with one of ``roles``, if given). Use after jwt_required."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            role = get_role(get_jwt_identity(), kwargs['group_id'])
+            if role is None or (roles and role not in roles):
+                return jsonify({'msg': msg}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,115 @@
+# Content-addressed blobs shared by every File with the same contents
+import hashlib
+from sqlalchemy import case, insert
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .metrics import BLOB_REFERENCES
+from .models import Blob
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def blob_key(sha256, encoding=None):
+    # Encoded copies get their own key, so two racing uploads that chose
+    # different encodings never overwrite each other's object
+    suffix = '.zst' if encoding == 'zstd' else ''
+    return f"blobs/{sha256[:2]}/{sha256}{suffix}"
+
+
+def hash_file(file):
+    """Return (sha256, size) of a seekable file object and rewind it."""
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+def _add_reference(blob, references=1):
+    """Returns False if the blob was purged since it was read."""
+    return Blob.query.filter_by(id=blob.id).update({Blob.ref_count: Blob.ref_count + references}) == 1
+
+
+def acquire_blob(sha256, size, store, references=1, encoding=None):
+    """Take a reference on the blob for ``sha256``, creating it if needed.
+
+    ``store(key)`` is only called when no blob with this digest exists yet,
+    so repeat uploads of the same content never touch MinIO; it must write
+    the content in ``encoding``. An existing blob keeps its own encoding.
+    Returns ``(blob, created)``; the caller commits the surrounding
+    transaction. Whether content already existed is only counted in
+    metrics, never reported to the uploader.
+    """
+    blob = Blob.query.filter_by(sha256=sha256).first()
+    if blob and _add_reference(blob, references):
+        BLOB_REFERENCES.labels('existing').inc(references)
+        return blob, False
+
+    key = blob_key(sha256, encoding)
+    store(key)
+    try:
+        with db.session.begin_nested():
+            blob = Blob(sha256=sha256, minio_key=key, size=size, ref_count=references, content_encoding=encoding)
+            db.session.add(blob)
+    except IntegrityError:
+        # A concurrent upload of the same content created the row first.
+        # Both wrote identical bytes to the same key (unless they chose
+        # different encodings, which leaves ours unused), so just share it.
+        blob = Blob.query.filter_by(sha256=sha256).one()
+        _add_reference(blob, references)
+        BLOB_REFERENCES.labels('existing').inc(references)
+        return blob, False
+    BLOB_REFERENCES.labels('stored').inc(references)
+    return blob, True
+
+
+def acquire_blobs(wanted, store_many):
+    """Batch form of acquire_blob for ``{sha256: (size, references, encoding)}``.
+
+    ``store_many([(sha256, key), ...])`` is called once with every digest
+    that has no blob yet and returns ``{sha256: error}`` for any it could not
+    store. Returns ``({sha256: (blob_id, key, encoding)}, failed)``; digests
+    in ``failed`` got no blob. The caller commits.
+    """
+    existing = {blob.sha256: blob for blob in Blob.query.filter(Blob.sha256.in_(list(wanted)))}
+    if existing:
+        ids = [blob.id for blob in existing.values()]
+        added = Blob.query.filter(Blob.id.in_(ids)).update({
+            Blob.ref_count: Blob.ref_count + case(
+                {blob.id: wanted[sha256][1] for sha256, blob in existing.items()}, value=Blob.id)
+        }, synchronize_session=False)
+        if added < len(ids):
+            # Some were purged since the read; those need storing again
+            remaining = {blob_id for (blob_id,) in db.session.query(Blob.id).filter(Blob.id.in_(ids))}
+            existing = {sha256: blob for sha256, blob in existing.items() if blob.id in remaining}
+    blobs = {sha256: (blob.id, blob.minio_key, blob.content_encoding) for sha256, blob in existing.items()}
+    BLOB_REFERENCES.labels('existing').inc(sum(wanted[sha256][1] for sha256 in existing))
+
+    missing = [sha256 for sha256 in wanted if sha256 not in blobs]
+    if not missing:
+        return blobs, {}
+    failed = store_many([(sha256, blob_key(sha256, wanted[sha256][2])) for sha256 in missing])
+    stored = [sha256 for sha256 in missing if sha256 not in failed]
+    if not stored:
+        return blobs, failed
+
+    try:
+        with db.session.begin_nested():
+            rows = db.session.execute(insert(Blob).returning(Blob.id, Blob.sha256), [
+                {'sha256': sha256, 'minio_key': blob_key(sha256, wanted[sha256][2]), 'size': wanted[sha256][0],
+                 'ref_count': wanted[sha256][1], 'content_encoding': wanted[sha256][2]}
+                for sha256 in stored
+            ])
+            blobs.update({sha256: (blob_id, blob_key(sha256, wanted[sha256][2]), wanted[sha256][2])
+                          for blob_id, sha256 in rows})
+        BLOB_REFERENCES.labels('stored').inc(sum(wanted[sha256][1] for sha256 in stored))
+    except IntegrityError:
+        # A concurrent upload created some of them; settle each on its own
+        for sha256 in stored:
+            size, references, encoding = wanted[sha256]
+            blob, _ = acquire_blob(sha256, size, lambda key: None, references, encoding)
+            blobs[sha256] = (blob.id, blob.minio_key, blob.content_encoding)
+    return blobs, failed
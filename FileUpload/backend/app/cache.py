@@ -0,0 +1,190 @@
+# Read-through cache of MinIO objects on local disk
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+from .metrics import DOWNLOAD_CACHE_EVICTED_BYTES, DOWNLOAD_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Evictions free space down to this share of max_bytes, so a full cache is
+# rescanned once per that much newly cached data rather than on every insert
+EVICT_TARGET = 0.9
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.path = None
+
+
+class ObjectCache:
+    """Size-bounded LRU of whole objects in ``directory``, keyed by object
+    key and ETag so a changed object is never served stale.
+
+    Recency is the file's mtime, bumped on every hit, so gunicorn workers
+    sharing the directory share one LRU order. Each worker keeps a running
+    total of the directory's size and only rescans it to evict; until then
+    it does not see what other workers cached, so the directory can run
+    over budget by what they cached since. Concurrent misses on the same
+    object in a process wait for a single fetch from storage.
+
+    An entry can be evicted by another worker between lookup and use, so
+    callers must handle FileNotFoundError when opening the returned path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.directory = None
+        self.configure(None, 0, 0)
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+
+    def configure(self, directory, max_bytes, max_object_bytes):
+        with self._lock:
+            self.directory = directory
+            self.max_bytes = max_bytes
+            self.max_object_bytes = max_object_bytes
+            self.hits = 0
+            self.misses = 0
+            self.coalesced = 0
+            self.evictions = 0
+            self.evicted_bytes = 0
+            self._size = 0
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._size = sum(size for _, _, size in self._entries())
+
+    def _path(self, key, etag):
+        digest = hashlib.sha256(f'{key}\0{etag}'.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _entries(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, path, st.st_size
+
+    def cacheable(self, size):
+        return self.enabled and size <= self.max_object_bytes
+
+    def get(self, key, etag):
+        """Path of the cached copy, or None."""
+        path = self._path(key, etag)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.hits += 1
+        DOWNLOAD_CACHE_REQUESTS.labels('hit').inc()
+        return path
+
+    def fetch(self, key, etag, open_object):
+        """Return the cached path for ``key``, downloading it with
+        ``open_object()`` (a storage reader) on a miss. Returns None if the
+        download failed, in which case the caller should stream directly."""
+        cached = self.get(key, etag)
+        if cached:
+            return cached
+
+        path = self._path(key, etag)
+        with self._lock:
+            self.misses += 1
+            flight = self._flights.get(path)
+            leader = flight is None
+            if leader:
+                flight = self._flights[path] = _Flight()
+            else:
+                self.coalesced += 1
+        DOWNLOAD_CACHE_REQUESTS.labels('miss').inc()
+
+        if not leader:
+            flight.done.wait()
+            return flight.path
+
+        try:
+            # Another fetch may have finished between our lookup and the lock
+            flight.path = path if os.path.exists(path) else self._download(path, open_object)
+        except Exception:
+            logger.exception('Failed to cache %s', key)
+        finally:
+            with self._lock:
+                del self._flights[path]
+            flight.done.set()
+        return flight.path
+
+    def _download(self, path, open_object):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f'.{uuid.uuid4().hex}.tmp')
+        response = open_object()
+        try:
+            with open(tmp_path, 'wb') as out:
+                shutil.copyfileobj(response, out, 1024 * 1024)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            response.close()
+            response.release_conn()
+
+        with self._lock:
+            self._size += size
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self._evict(keep=path)
+        return path
+
+    def _evict(self, keep):
+        # Rescan so files written by other workers count against the budget
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * EVICT_TARGET
+        evicted = evicted_bytes = 0
+        for _, path, size in entries:
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+            evicted_bytes += size
+        with self._lock:
+            self._size = total
+            self.evictions += evicted
+            self.evicted_bytes += evicted_bytes
+        DOWNLOAD_CACHE_EVICTED_BYTES.inc(evicted_bytes)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+                'size_bytes': self._size
+            }
+
+
+object_cache = ObjectCache()
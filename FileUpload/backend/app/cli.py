@@ -0,0 +1,93 @@
+# Maintenance commands, run with `flask <command>`
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from .activity import compact_activity
+from .purge import PurgeError, expire_upload_sessions, purge_deleted_files, purge_temporary_objects
+from .stats import reconcile_group_stats
+from .thumbnails import generate_thumbnails
+
+
+def register_commands(app):
+    @app.cli.command('reconcile-stats')
+    def reconcile_stats():
+        """Rebuild the per-group file counters from the file table."""
+        count = reconcile_group_stats()
+        click.echo(f'Reconciled counters for {count} group(s).')
+
+    @app.cli.command('compact-activity')
+    @click.option('--days', type=int, default=None,
+                  help='Keep this many days of raw activity (default: ACTIVITY_RETENTION_DAYS).')
+    def compact_activity_command(days):
+        """Roll activity older than the retention window up into daily counts."""
+        if days is None:
+            days = current_app.config['ACTIVITY_RETENTION_DAYS']
+        compacted = compact_activity(datetime.utcnow() - timedelta(days=days))
+        click.echo(f'Compacted {compacted} activity record(s) older than {days} day(s).')
+
+    @app.cli.command('purge-deleted')
+    @click.option('--grace-days', type=int, default=None,
+                  help='Keep soft-deleted files this many days (default: PURGE_GRACE_DAYS).')
+    @click.option('--every', type=int, default=None,
+                  help='Keep running, purging every this many seconds.')
+    def purge_deleted(grace_days, every):
+        """Permanently remove soft-deleted files and their stored objects,
+        and whatever abandoned uploads left in storage."""
+        from . import db, storage
+        if grace_days is None:
+            grace_days = current_app.config['PURGE_GRACE_DAYS']
+        while True:
+            try:
+                files, reclaimed = purge_deleted_files(
+                    datetime.utcnow() - timedelta(days=grace_days),
+                    storage,
+                    batch_size=current_app.config['PURGE_BATCH_SIZE']
+                )
+                click.echo(f'Purged {files} file(s), reclaimed {reclaimed} bytes.')
+                stale = datetime.utcnow() - timedelta(hours=current_app.config['PURGE_STALE_UPLOAD_HOURS'])
+                click.echo(f'Removed {purge_temporary_objects(stale, storage)} stale temporary object(s).')
+                click.echo(f'Aborted {expire_upload_sessions(stale, storage)} abandoned upload session(s).')
+            except PurgeError as e:
+                click.echo(f'Purge stopped: {e}', err=True)
+                if every is None:
+                    raise SystemExit(1)
+            if every is None:
+                return
+            db.session.remove()
+            time.sleep(every)
+
+    @app.cli.command('generate-thumbnails')
+    @click.option('--every', type=float, default=None,
+                  help='Keep running, checking for new jobs every this many seconds when idle.')
+    def generate_thumbnails_command(every):
+        """Render queued thumbnails and store them next to their files."""
+        from . import db, storage
+        config = current_app.config
+        pool = None
+        if config['THUMBNAIL_WORKERS'] > 0:
+            # spawn: the pool only needs render_thumbnail, not a copy of the app
+            pool = ProcessPoolExecutor(config['THUMBNAIL_WORKERS'], mp_context=multiprocessing.get_context('spawn'))
+        try:
+            while True:
+                done, failed, skipped = generate_thumbnails(
+                    storage,
+                    pool,
+                    size=config['THUMBNAIL_SIZE'],
+                    batch_size=config['THUMBNAIL_BATCH_SIZE'],
+                    max_source_bytes=config['THUMBNAIL_MAX_SOURCE_BYTES'],
+                    max_attempts=config['THUMBNAIL_MAX_ATTEMPTS'],
+                    max_in_flight=config['THUMBNAIL_WORKERS']
+                )
+                if done or failed or skipped:
+                    click.echo(f'Generated {done} thumbnail(s), {failed} failed.')
+                    continue
+                if every is None:
+                    return
+                db.session.remove()
+                time.sleep(every)
+        finally:
+            if pool is not None:
+                pool.shutdown()
@@ -0,0 +1,107 @@
+# Optional zstd compression at rest for uploads that compress well
+import zstandard
+
+ZSTD = 'zstd'
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Besides text/*; images, archives and media are already compressed
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/xml', 'application/javascript', 'application/sql',
+    'application/x-yaml', 'application/yaml', 'application/x-ndjson', 'application/rtf'
+}
+
+# Bytes from the start of an upload compressed to estimate its ratio
+SAMPLE_BYTES = 128 * 1024
+
+
+def is_compressible_type(mime_type):
+    if not mime_type:
+        # No guess from the extension (.log, .yaml, .go...): let the sample decide
+        return True
+    return (mime_type.startswith('text/') or mime_type in COMPRESSIBLE_TYPES or
+            mime_type.endswith(('+json', '+xml')))
+
+
+class CompressionPolicy:
+    """Decides which uploads are stored zstd-compressed and does so while
+    streaming them to storage. Disabled unless configured."""
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, enabled=False, level=3, min_ratio=1.5, min_bytes=4096):
+        self.enabled = enabled
+        self.level = level
+        self.min_ratio = min_ratio
+        self.min_bytes = min_bytes
+
+    def encoding_for(self, file, mime_type, size):
+        """``'zstd'`` if seekable ``file`` is worth storing compressed, else
+        None: its type must be textual (or unknown) and a sample from its
+        start must shrink by ``min_ratio``. Rewinds ``file``."""
+        if not self.enabled or size < self.min_bytes or not is_compressible_type(mime_type):
+            return None
+        file.seek(0)
+        sample = file.read(SAMPLE_BYTES)
+        file.seek(0)
+        compressed = zstandard.ZstdCompressor(level=self.level).compress(sample)
+        return ZSTD if len(sample) >= self.min_ratio * len(compressed) else None
+
+    def put(self, storage, key, file, size, content_type, encoding):
+        """Store ``size`` bytes of seekable ``file`` under ``key`` in
+        ``encoding`` (from encoding_for)."""
+        file.seek(0)
+        if encoding is None:
+            storage.put(key, file, length=size, content_type=content_type)
+        else:
+            # Compressed length is unknown up front; MinIO uploads it in parts
+            reader = zstandard.ZstdCompressor(level=self.level).stream_reader(file, size=size)
+            storage.put(key, reader, content_type=content_type)
+
+
+class DecodedResponse:
+    """A storage response holding zstd data that reads as bytes ``[start,
+    stop)`` of the original, with the same ``read``/``stream``/``close``/
+    ``release_conn`` interface. Seeking to ``start`` means decompressing
+    everything before it."""
+
+    def __init__(self, response, start=0, stop=None):
+        self.response = response
+        self._reader = zstandard.ZstdDecompressor().stream_reader(response, read_across_frames=True, closefd=False)
+        self._skip = start
+        self._remaining = None if stop is None else stop - start
+
+    def read(self, amt=-1):
+        while self._skip:
+            skipped = self._reader.read(min(self._skip, COPY_CHUNK_SIZE))
+            if not skipped:
+                break
+            self._skip -= len(skipped)
+        if self._remaining is not None:
+            amt = self._remaining if amt is None or amt < 0 else min(amt, self._remaining)
+        data = self._reader.read(-1 if amt is None else amt)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return data
+
+    def stream(self, amt=COPY_CHUNK_SIZE):
+        return iter(lambda: self.read(amt), b'')
+
+    def close(self):
+        self._reader.close()
+        self.response.close()
+
+    def release_conn(self):
+        self.response.release_conn()
+
+
+def open_decoded(storage, key, encoding, start=0, stop=None):
+    """Open ``key`` so that it reads as original bytes ``[start, stop)``
+    whatever ``encoding`` it is stored in."""
+    if encoding is None:
+        return storage.open(key, offset=start, length=None if stop is None else stop - start)
+    return DecodedResponse(storage.open(key), start, stop)
+
+
+compression_policy = CompressionPolicy()
@@ -0,0 +1,246 @@
+# Prometheus metrics for requests, SQL and object storage
+import os
+import time
+from types import GeneratorType
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from .queries import current_recorder
+
+# With PROMETHEUS_MULTIPROC_DIR set (see gunicorn.conf.py) every worker
+# writes its samples to that directory and /metrics aggregates them
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300)
+
+REQUEST_LATENCY = Histogram(
+    'filevault_http_request_duration_seconds',
+    'Time from request start until the response body was fully sent',
+    ['method', 'endpoint', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_BYTES = Counter(
+    'filevault_http_request_bytes',
+    'Request body bytes received',
+    ['method', 'endpoint']
+)
+RESPONSE_BYTES = Counter(
+    'filevault_http_response_bytes',
+    'Response body bytes sent',
+    ['method', 'endpoint']
+)
+SQL_STATEMENTS = Histogram(
+    'filevault_sql_statements_per_request',
+    'SQL statements executed while handling one request',
+    ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100, 250)
+)
+SQL_TIME = Histogram(
+    'filevault_sql_seconds_per_request',
+    'Time spent executing SQL while handling one request',
+    ['endpoint'],
+    buckets=LATENCY_BUCKETS
+)
+STORAGE_LATENCY = Histogram(
+    'filevault_storage_operation_duration_seconds',
+    'Object storage call latency; for reads, until the object was fully read',
+    ['operation'],
+    buckets=LATENCY_BUCKETS
+)
+STORAGE_BYTES = Counter(
+    'filevault_storage_bytes',
+    'Bytes written to or read from object storage',
+    ['operation']
+)
+STORAGE_ERRORS = Counter(
+    'filevault_storage_errors',
+    'Object storage calls that raised',
+    ['operation']
+)
+DOWNLOAD_CACHE_REQUESTS = Counter(
+    'filevault_download_cache_requests',
+    'Download cache lookups by result (hit, miss)',
+    ['result']
+)
+BLOB_REFERENCES = Counter(
+    'filevault_blob_references',
+    'Blob references taken by uploads, by whether the content was already stored (existing, stored)',
+    ['result']
+)
+DOWNLOAD_CACHE_EVICTED_BYTES = Counter(
+    'filevault_download_cache_evicted_bytes',
+    'Bytes evicted from the download cache'
+)
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+class _CountingIterable:
+    """Counts body bytes as the server sends them and records the request
+    when the server closes the body, which is after the last byte."""
+
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.on_close(self.sent)
+
+
+def _record_on_close(body, callback):
+    close = body.close
+
+    def closing():
+        try:
+            close()
+        finally:
+            callback()
+
+    body.close = closing
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _after_request(response):
+    if 'metrics_start' not in g:
+        return response
+    method, endpoint, status = request.method, _endpoint(), str(response.status_code)
+    start, recorder = g.metrics_start, current_recorder()
+
+    REQUEST_BYTES.labels(method, endpoint).inc(request.content_length or 0)
+    if recorder is not None:
+        SQL_STATEMENTS.labels(endpoint).observe(recorder.count)
+        SQL_TIME.labels(endpoint).observe(recorder.seconds)
+
+    def finished(sent):
+        REQUEST_LATENCY.labels(method, endpoint, status).observe(time.perf_counter() - start)
+        RESPONSE_BYTES.labels(method, endpoint).inc(sent)
+
+    if not response.direct_passthrough and (response.content_length is not None or response.is_sequence):
+        sent = response.content_length or 0
+        response.call_on_close(lambda: finished(sent))
+    elif response.direct_passthrough and not isinstance(response.response, (GeneratorType, list, tuple)):
+        # Werkzeug gives passthrough bodies to the server without running
+        # close callbacks; hook the file wrapper's close so it keeps sendfile
+        sent = response.content_length or 0
+        _record_on_close(response.response, lambda: finished(sent))
+    else:
+        response.response = _CountingIterable(response.response, finished)
+    return response
+
+
+class _TimedReader:
+    """Storage reader that records the read once it is closed."""
+
+    def __init__(self, reader, start):
+        self.reader = reader
+        self.start = start
+        self.received = 0
+        self.closed = False
+
+    def read(self, amt=None):
+        data = self.reader.read(amt)
+        self.received += len(data)
+        return data
+
+    def stream(self, amt=64 * 1024):
+        for chunk in self.reader.stream(amt):
+            self.received += len(chunk)
+            yield chunk
+
+    def close(self):
+        self.reader.close()
+        if not self.closed:
+            self.closed = True
+            STORAGE_LATENCY.labels('get').observe(time.perf_counter() - self.start)
+            STORAGE_BYTES.labels('get').inc(self.received)
+
+    def release_conn(self):
+        self.reader.release_conn()
+
+
+class _CountingStream:
+    def __init__(self, stream):
+        self.stream = stream
+        self.read_bytes = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.read_bytes += len(data)
+        return data
+
+
+class InstrumentedStorage:
+    """Wraps a storage backend, timing every call by operation name."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if not callable(attr) or name.startswith('_') or name == 'local_path':
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                STORAGE_ERRORS.labels(name).inc()
+                raise
+            finally:
+                STORAGE_LATENCY.labels(name).observe(time.perf_counter() - start)
+        return timed
+
+    def put(self, key, stream, length=-1, content_type=None):
+        counted = _CountingStream(stream)
+        start = time.perf_counter()
+        try:
+            self.backend.put(key, counted, length=length, content_type=content_type)
+        except Exception:
+            STORAGE_ERRORS.labels('put').inc()
+            raise
+        finally:
+            STORAGE_LATENCY.labels('put').observe(time.perf_counter() - start)
+            STORAGE_BYTES.labels('put').inc(counted.read_bytes)
+
+    def open(self, key, offset=0, length=None):
+        start = time.perf_counter()
+        try:
+            return _TimedReader(self.backend.open(key, offset=offset, length=length), start)
+        except Exception:
+            STORAGE_ERRORS.labels('get').inc()
+            raise
+
+    def upload_part(self, key, upload_id, part_number, data):
+        STORAGE_BYTES.labels('upload_part').inc(len(data))
+        return self.__getattr__('upload_part')(key, upload_id, part_number, data)
+
+
+def metrics_view():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """Register the request hooks and /metrics. SQL figures come from the
+    query recorder, so call after init_queries."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -5,7 +5,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=True)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)  # scrypt hashes exceed 128
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime, nullable=True)
     is_active = db.Column(db.Boolean, default=True)
@@ -31,26 +31,131 @@ class GroupMembership(db.Model):
     group = db.relationship('Group', back_populates='memberships')
 
 class File(db.Model):
+    __table_args__ = (
+        # Backs the keyset-paginated group listing
+        db.Index('ix_file_group_listing', 'group_id', 'is_deleted', 'uploaded_at', 'id'),
+        # Backs the purge worker's scan for expired soft-deleted files
+        db.Index('ix_file_purge', 'is_deleted', 'deleted_at'),
+        # A file that owns its object is its only row; blob files share keys
+        db.Index('ix_file_owned_key', 'minio_key', unique=True,
+                 postgresql_where=db.text('blob_id IS NULL'), sqlite_where=db.text('blob_id IS NULL')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
     minio_key = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.BigInteger, nullable=False)
     mime_type = db.Column(db.String(100), nullable=True)
+    sha256 = db.Column(db.String(64), nullable=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), nullable=True)  # null: file owns minio_key
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'))
     uploader_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     is_deleted = db.Column(db.Boolean, default=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
+    content_encoding = db.Column(db.String(20), nullable=True)  # zstd: object stored compressed
+    thumbnail_key = db.Column(db.String(255), nullable=True)  # set by the thumbnail worker
     group = db.relationship('Group', back_populates='files')
     uploader = db.relationship('User', back_populates='uploaded_files')
+    blob = db.relationship('Blob', back_populates='files')
+
+class Blob(db.Model):
+    """A content-addressed object shared by every File with the same SHA-256."""
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    minio_key = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    content_encoding = db.Column(db.String(20), nullable=True)  # zstd: object stored compressed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    files = db.relationship('File', back_populates='blob')
+
+class GroupStats(db.Model):
+    """Per-group file counters, maintained in the same transaction as the
+    File changes they summarise. Rebuild with ``flask reconcile-stats``."""
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), primary_key=True)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0)  # last FileChange.seq
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class FileChange(db.Model):
+    """Ordered log of files added to and deleted from each group, read by
+    the /changes endpoint. ``seq`` counts up from 1 per group."""
+    __table_args__ = (
+        db.UniqueConstraint('group_id', 'seq', name='uq_file_change_seq'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    seq = db.Column(db.BigInteger, nullable=False)
+    file_id = db.Column(db.Integer, nullable=False)  # no FK: entries outlive purged files
+    change = db.Column(db.String(10), nullable=False)  # add, delete
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ThumbnailJob(db.Model):
+    """A queued thumbnail render, claimed by ``flask generate-thumbnails``.
+    Deleted once the thumbnail is stored."""
+    __table_args__ = (
+        # Backs the worker's scan for due jobs
+        db.Index('ix_thumbnail_job_claim', 'status', 'run_after'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # also the running lease
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Activity(db.Model):
+    __table_args__ = (
+        # Backs the per-group feed seek and the retention sweep
+        db.Index('ix_activity_group_feed', 'group_id', 'timestamp', 'id'),
+        db.Index('ix_activity_timestamp', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True)
-    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=True, index=True)
     activity_type = db.Column(db.String(50), nullable=False)  # upload, download, group_created, user_joined, etc.
     description = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    activity_data = db.Column(db.JSON, nullable=True) 
\ No newline at end of file
+    activity_data = db.Column(db.JSON, nullable=True)
+    user = db.relationship('User')
+
+class ActivityRollup(db.Model):
+    """Daily per-group, per-type event counts for Activity rows that have
+    aged out of the raw table. Written by ``flask compact-activity``."""
+    __table_args__ = (
+        db.UniqueConstraint('day', 'group_id', 'activity_type', name='uq_activity_rollup_bucket'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True)
+    activity_type = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    minio_key = db.Column(db.String(255), nullable=False)
+    upload_id = db.Column(db.String(255), nullable=False)  # S3 multipart UploadId
+    mime_type = db.Column(db.String(100), nullable=True)
+    part_size = db.Column(db.BigInteger, nullable=False)
+    status = db.Column(db.String(20), default='active')  # active, completing, completed, aborted
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    parts = db.relationship('UploadPart', back_populates='session', order_by='UploadPart.part_number')
+
+class UploadPart(db.Model):
+    __table_args__ = (db.UniqueConstraint('session_id', 'part_number'),)
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(32), db.ForeignKey('upload_session.id'), nullable=False)
+    part_number = db.Column(db.Integer, nullable=False)
+    etag = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    session = db.relationship('UploadSession', back_populates='parts')
@@ -0,0 +1,32 @@
+# Opaque cursors for keyset (seek) pagination
+import base64
+import json
+from datetime import datetime
+from flask import request
+
+
+def encode_cursor(timestamp, row_id):
+    payload = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (timestamp, id) pair encoded by encode_cursor.
+
+    Raises ValueError for anything that is not a cursor we issued.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def page_limit(default, maximum):
+    """Page size from the ``limit`` query parameter, clamped to [1, maximum]."""
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
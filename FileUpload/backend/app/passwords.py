@@ -0,0 +1,110 @@
+# Password hashing in a bounded process pool, off the request worker
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Too many hashes are queued; the caller should answer 429."""
+
+
+def _normalize(method):
+    """The parameter prefix werkzeug stores for ``method``, e.g.
+    ``pbkdf2`` -> ``pbkdf2:sha256:600000``."""
+    name, *params = method.split(':')
+    if name == 'pbkdf2':
+        defaults = ['sha256', '600000']
+    elif name == 'scrypt':
+        defaults = ['32768', '8', '1']
+    else:
+        raise ValueError(f'Unsupported password hash method: {method}')
+    return ':'.join([name] + params + defaults[len(params):])
+
+
+class PasswordHasher:
+    """Runs hashing in ``workers`` processes, rejecting new work with
+    HashingBusy once ``max_pending`` hashes are queued or running, so a
+    login storm cannot occupy every request worker. ``workers=0`` hashes
+    inline.
+
+    The pool only adds concurrency when the request worker can serve other
+    requests while it waits, i.e. under gevent; a sync worker blocks on the
+    hash either way, so there it would only cost memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._generation = 0
+        self.configure()
+
+    def configure(self, method='pbkdf2', workers=2, max_pending=16, timeout=10):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            self.method = method
+            self.prefix = _normalize(method)
+            self.workers = workers
+            self.timeout = timeout
+            self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+            # Hashes queued or running in the pool; the generation keeps
+            # hashes from before a reconfigure from counting against it
+            self.pending = 0
+            self._generation += 1
+            self.rejected = 0
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # Created lazily so each gunicorn worker gets its own; spawn
+                # because forking a process that runs threads is unsafe
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy()
+        with self._lock:
+            self.pending += 1
+            generation = self._generation
+
+        def release(_):
+            slots.release()
+            with self._lock:
+                if self._generation == generation:
+                    self.pending -= 1
+
+        try:
+            future = self._executor().submit(fn, *args)
+        except BaseException:
+            release(None)
+            raise
+        # The slot stays taken until the hash finishes, even if we time out
+        future.add_done_callback(release)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy()
+        except BrokenProcessPool:
+            with self._lock:
+                self._pool = None
+            raise
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Whether ``pwhash`` was made with other parameters than the configured ones."""
+        return pwhash.split('$', 1)[0] != self.prefix
+
+
+password_hasher = PasswordHasher()
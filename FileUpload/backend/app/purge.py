@@ -0,0 +1,136 @@
+# Hard deletion of soft-deleted files once their grace period has passed
+import logging
+from datetime import timezone
+from sqlalchemy import func
+from . import db
+from .models import Activity, Blob, File, ThumbnailJob, UploadPart, UploadSession
+from .storage import ObjectNotFound
+
+logger = logging.getLogger(__name__)
+
+
+class PurgeError(Exception):
+    pass
+
+
+def _remove_objects(storage, keys):
+    errors = storage.delete(keys)
+    if errors:
+        for key, message in errors:
+            logger.error('Failed to remove %s: %s', key, message)
+        raise PurgeError(f'{len(errors)} object(s) could not be removed')
+
+
+def _stored_size(storage, key, size, encoding):
+    """Bytes ``key`` takes in storage: ``size`` is the original length, so
+    compressed objects are asked for theirs."""
+    if encoding is None:
+        return size
+    try:
+        return storage.stat(key).size
+    except ObjectNotFound:
+        return 0
+
+
+def _purge_batch(files, storage):
+    """Delete one batch of File rows and whatever storage only they used.
+    Returns the number of bytes freed in storage."""
+    keys = [f.minio_key for f in files if f.blob_id is None]
+    keys.extend(f.thumbnail_key for f in files if f.blob_id is None and f.thumbnail_key)
+    reclaimed = sum(_stored_size(storage, f.minio_key, f.file_size, f.content_encoding)
+                    for f in files if f.blob_id is None)
+
+    references = {}
+    for f in files:
+        if f.blob_id is not None:
+            references[f.blob_id] = references.get(f.blob_id, 0) + 1
+    for blob_id, count in references.items():
+        Blob.query.filter_by(id=blob_id).update({Blob.ref_count: Blob.ref_count - count},
+                                                synchronize_session=False)
+
+    # The decrement row-locks each blob, so a concurrent upload of the same
+    # content waits for us, then finds the row gone and stores it afresh
+    orphans = Blob.query.filter(Blob.id.in_(references), Blob.ref_count <= 0).all()
+    keys.extend(blob.minio_key for blob in orphans)
+    reclaimed += sum(_stored_size(storage, blob.minio_key, blob.size, blob.content_encoding) for blob in orphans)
+    # A blob's thumbnail is shared by its files, so goes with the blob
+    orphan_ids = {blob.id for blob in orphans}
+    keys.extend({f.thumbnail_key for f in files if f.blob_id in orphan_ids and f.thumbnail_key})
+
+    file_ids = [f.id for f in files]
+    Activity.query.filter(Activity.file_id.in_(file_ids)).update({Activity.file_id: None},
+                                                                 synchronize_session=False)
+    ThumbnailJob.query.filter(ThumbnailJob.file_id.in_(file_ids)).delete(synchronize_session=False)
+    File.query.filter(File.id.in_(file_ids)).delete(synchronize_session=False)
+    Blob.query.filter(Blob.id.in_([blob.id for blob in orphans])).delete(synchronize_session=False)
+
+    # Remove objects before committing: if that fails the rows survive and
+    # the next run retries, rather than leaving objects nothing points to
+    _remove_objects(storage, keys)
+    return reclaimed
+
+
+def purge_deleted_files(before, storage, batch_size=1000):
+    """Hard-delete files soft-deleted before ``before`` and remove their
+    objects (or drop their blob reference), ``batch_size`` rows per
+    transaction.
+
+    Returns ``(files, reclaimed_bytes)``. Raises PurgeError if storage refuses
+    a deletion; batches committed up to that point stay purged.
+    """
+    purged = reclaimed = 0
+    while True:
+        files = db.session.query(File.id, File.minio_key, File.blob_id, File.file_size, File.content_encoding,
+                                 File.thumbnail_key).filter(
+            File.is_deleted == True,
+            func.coalesce(File.deleted_at, File.uploaded_at) < before
+        ).order_by(File.id).limit(batch_size).all()
+        if not files:
+            return purged, reclaimed
+        try:
+            reclaimed += _purge_batch(files, storage)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        purged += len(files)
+
+
+def purge_temporary_objects(before, storage):
+    """Remove objects under ``tmp/`` written before ``before``: streamed
+    uploads copy their body from there to its blob key, and a worker that
+    died in between leaves it behind. Returns the number removed."""
+    before = before.replace(tzinfo=timezone.utc)
+    keys = [key for key, modified in storage.list('tmp/') if modified < before]
+    _remove_objects(storage, keys)
+    return len(keys)
+
+
+def expire_upload_sessions(before, storage):
+    """Abort resumable uploads that were started and last received a part
+    before ``before``, discarding their stored parts. Returns the number
+    aborted; sessions whose parts storage refuses to discard are left
+    active for the next run."""
+    recent_part = db.session.query(UploadPart.id).filter(
+        UploadPart.session_id == UploadSession.id,
+        UploadPart.uploaded_at >= before
+    ).exists()
+    sessions = db.session.query(UploadSession.id, UploadSession.minio_key, UploadSession.upload_id).filter(
+        UploadSession.status == 'active',
+        UploadSession.created_at < before,
+        ~recent_part
+    ).all()
+    aborted = 0
+    for session in sessions:
+        try:
+            storage.abort_multipart(session.minio_key, session.upload_id)
+        except Exception as e:
+            logger.error('Failed to abort upload %s: %s', session.id, e)
+            continue
+        # A complete that claimed the session meanwhile fails in storage and
+        # hands it back as active, for the next run to abort
+        aborted += UploadSession.query.filter_by(id=session.id, status='active').update(
+            {UploadSession.status: 'aborted'}, synchronize_session=False
+        )
+        db.session.commit()
+    return aborted
@@ -0,0 +1,88 @@
+# Per-request SQL statement recording and per-view query budgets
+import logging
+import time
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """The SQL statements issued while handling one request."""
+
+    def __init__(self):
+        self.statements = []
+        self.seconds = 0.0
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+def query_budget(statements):
+    """Declare the most SQL statements one request to the view may issue,
+    however much data is involved. Place directly under the route decorator."""
+    def decorator(view):
+        view.query_budget = statements
+        return view
+    return decorator
+
+
+def current_recorder():
+    """The recorder for the current request, or None outside a request."""
+    if not has_request_context():
+        return None
+    return g.get('query_recorder')
+
+
+def budget_for(endpoint):
+    view = current_app.view_functions.get(endpoint)
+    return getattr(view, 'query_budget', None)
+
+
+def _before_request():
+    g.query_recorder = QueryRecorder()
+
+
+def _after_request(response):
+    recorder = current_recorder()
+    if recorder is None:
+        return response
+    budget = budget_for(request.endpoint)
+
+    if current_app.config['SQL_DEBUG_HEADERS']:
+        response.headers['X-Query-Count'] = str(recorder.count)
+        response.headers['X-Query-Time-Ms'] = f'{recorder.seconds * 1000:.1f}'
+        if budget is not None:
+            response.headers['X-Query-Budget'] = str(budget)
+
+    if budget is not None and recorder.count > budget:
+        message = f'{request.endpoint} issued {recorder.count} SQL statements, budget is {budget}'
+        if current_app.config['SQL_QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded('\n'.join([message] + recorder.statements))
+        logger.warning(message)
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.statements.append(statement)
+        recorder.seconds += elapsed
+
+
+def init_queries(app, db):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
@@ -1,9 +1,10 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from sqlalchemy.orm import joinedload
 from .. import db
 from ..models import User, Activity
+from ..passwords import HashingBusy, password_hasher
+from ..queries import query_budget
 from datetime import datetime, timedelta
 import logging
 
@@ -12,7 +13,13 @@ logger = logging.getLogger(__name__)
 
 auth_bp = Blueprint('auth', __name__)
 
+def _hashing_busy():
+    response = jsonify({'msg': 'Too many sign-in requests, try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 429
+
 @auth_bp.route('/register', methods=['POST'])
+@query_budget(3)
 def register():
     try:
         data = request.json
@@ -28,7 +35,7 @@ def register():
         user = User(
             username=data['username'],
             email=data.get('email'),
-            password_hash=generate_password_hash(data['password']),
+            password_hash=password_hasher.hash(data['password']),
             created_at=datetime.utcnow()
         )
         db.session.add(user)
@@ -36,12 +43,15 @@ def register():
         
         logger.info(f"New user registered: {user.username}")
         return jsonify({'msg': 'User registered successfully'}), 201
+    except HashingBusy:
+        return _hashing_busy()
     except Exception as e:
         logger.error(f"Registration error: {str(e)}")
         db.session.rollback()
         return jsonify({'msg': 'Registration failed'}), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@query_budget(3)
 def login():
     try:
         data = request.json
@@ -49,15 +59,17 @@ def login():
             return jsonify({'msg': 'Missing username or password'}), 400
         
         user = User.query.filter_by(username=data['username']).first()
-        if not user or not check_password_hash(user.password_hash, data['password']):
+        if not user or not password_hasher.verify(user.password_hash, data['password']):
             logger.warning(f"Failed login attempt for username: {data['username']}")
             return jsonify({'msg': 'Invalid credentials'}), 401
         
         if not user.is_active:
             return jsonify({'msg': 'Account is deactivated'}), 403
         
-        # Update last login
+        # Update last login, and upgrade the hash if the cost parameters changed
         user.last_login = datetime.utcnow()
+        if password_hasher.needs_rehash(user.password_hash):
+            user.password_hash = password_hasher.hash(data['password'])
         db.session.commit()
         
         # Create access token with longer expiration
@@ -73,11 +85,14 @@ def login():
             'username': user.username,
             'email': user.email
         }), 200
+    except HashingBusy:
+        return _hashing_busy()
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
         return jsonify({'msg': 'Login failed'}), 500
 
 @auth_bp.route('/me', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 def me():
     try:
@@ -101,6 +116,7 @@ def me():
         return jsonify({'msg': 'Failed to get user profile'}), 500
 
 @auth_bp.route('/profile', methods=['PUT'])
+@query_budget(4)
 @jwt_required()
 def update_profile():
     try:
@@ -129,20 +145,24 @@ def update_profile():
             if not data.get('current_password'):
                 return jsonify({'msg': 'Current password is required'}), 400
             
-            if not check_password_hash(user.password_hash, data['current_password']):
+            if not password_hasher.verify(user.password_hash, data['current_password']):
                 return jsonify({'msg': 'Current password is incorrect'}), 400
             
-            user.password_hash = generate_password_hash(data['new_password'])
+            user.password_hash = password_hasher.hash(data['new_password'])
         
         db.session.commit()
         logger.info(f"Profile updated for user: {user.username}")
         return jsonify({'msg': 'Profile updated successfully'}), 200
+    except HashingBusy:
+        db.session.rollback()
+        return _hashing_busy()
     except Exception as e:
         logger.error(f"Profile update error: {str(e)}")
         db.session.rollback()
         return jsonify({'msg': 'Failed to update profile'}), 500
 
 @auth_bp.route('/change-password', methods=['POST'])
+@query_budget(2)
 @jwt_required()
 def change_password():
     try:
@@ -158,20 +178,23 @@ def change_password():
         if not data.get('current_password') or not data.get('new_password'):
             return jsonify({'msg': 'Current and new password are required'}), 400
         
-        if not check_password_hash(user.password_hash, data['current_password']):
+        if not password_hasher.verify(user.password_hash, data['current_password']):
             return jsonify({'msg': 'Current password is incorrect'}), 400
         
-        user.password_hash = generate_password_hash(data['new_password'])
+        user.password_hash = password_hasher.hash(data['new_password'])
         
         db.session.commit()
         logger.info(f"Password changed for user: {user.username}")
         return jsonify({'msg': 'Password changed successfully'}), 200
+    except HashingBusy:
+        return _hashing_busy()
     except Exception as e:
         logger.error(f"Password change error: {str(e)}")
         db.session.rollback()
         return jsonify({'msg': 'Failed to change password'}), 500
 
 @auth_bp.route('/logout', methods=['POST'])
+@query_budget(1)
 @jwt_required()
 def logout():
     try:
@@ -1,25 +1,64 @@
-import os
+import hashlib
+import time
+import uuid
 import mimetypes
-from flask import Blueprint, request, jsonify, send_file
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, Response, current_app, request, jsonify, send_file, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import insert, select, tuple_, union_all
 from sqlalchemy.orm import joinedload
-from .. import db, minio_client
-from ..models import File, Group, GroupMembership, User, Activity
-from io import BytesIO
-from datetime import datetime
+from .. import db, storage
+from ..activity import log_activities, log_activity
+from ..authz import get_role, require_membership
+from ..archive import COMPRESSION_METHODS, ArchiveEntry, iter_zip, unique_arcnames
+from ..blobs import acquire_blob, acquire_blobs, hash_file
+from ..cache import object_cache
+from ..compression import compression_policy, open_decoded
+from ..models import (File, FileChange, Group, GroupMembership, GroupStats, Activity, UploadSession,
+                      UploadPart)
+from ..pagination import decode_cursor, encode_cursor, page_limit
+from ..queries import query_budget
+from ..search import MATCH_MODES, name_filters, parse_terms
+from ..stats import adjust_group_stats
+from ..storage import ObjectStat
+from ..streaming import HashingReader, iter_object, is_not_modified, requested_range, validators
+from ..thumbnails import THUMBNAIL_CONTENT_TYPE, queue_thumbnails
+from datetime import datetime, timedelta
 
 files_bp = Blueprint('files', __name__)
 
+def _new_object_key(group_id, user_id, original_filename):
+    """Return (unique_filename, minio_key) for a new upload."""
+    unique_filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{user_id}_{original_filename}"
+    return unique_filename, f"group_{group_id}/{unique_filename}"
+
+def _file_json(file):
+    return {
+        'id': file.id,
+        'filename': file.original_filename,
+        'file_size': file.file_size,
+        'mime_type': file.mime_type,
+        'uploaded_at': file.uploaded_at.isoformat(),
+        'thumbnail': file.thumbnail_key is not None,
+        'uploader': {
+            'id': file.uploader.id,
+            'username': file.uploader.username
+        } if file.uploader else None
+    }
+
+def _upload_token_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='presigned-upload')
+
 @files_bp.route('/<int:group_id>/upload', methods=['POST'])
+@query_budget(14)
 @jwt_required()
+@require_membership()
 def upload_file(group_id):
     user_id = get_jwt_identity()
     
-    # Check if user is a group member
-    if not GroupMembership.query.filter_by(user_id=user_id, group_id=group_id).first():
-        return jsonify({'msg': 'Not a group member'}), 403
-    
     if 'file' not in request.files:
         return jsonify({'msg': 'No file part'}), 400
     
@@ -29,28 +68,26 @@ def upload_file(group_id):
     
     # Secure the filename and create unique name
     original_filename = secure_filename(file.filename)
-    file_extension = os.path.splitext(original_filename)[1]
-    unique_filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{user_id}_{original_filename}"
+    unique_filename, minio_key = _new_object_key(group_id, user_id, original_filename)
     
     # Determine MIME type
     mime_type, _ = mimetypes.guess_type(original_filename)
     
-    # Upload to MinIO
-    minio_key = f"group_{group_id}/{unique_filename}"
+    def store(key):
+        compression_policy.put(storage, key, file, file_size, mime_type, encoding)
     
     try:
-        # Get file size
-        file.seek(0, 2)  # Seek to end
-        file_size = file.tell()
-        file.seek(0)  # Reset to beginning
-        
-        minio_client.put_object(
-            os.getenv('MINIO_BUCKET'),
-            minio_key,
-            file,
-            length=file_size,
-            part_size=10*1024*1024
-        )
+        # Werkzeug has already spooled the upload, so hash it before
+        # deciding whether storage needs to see it at all
+        sha256, file_size = hash_file(file)
+        encoding = compression_policy.encoding_for(file, mime_type, file_size)
+        
+        blob = None
+        if current_app.config['CONTENT_ADDRESSED_STORAGE']:
+            blob, _ = acquire_blob(sha256, file_size, store, encoding=encoding)
+            minio_key, encoding = blob.minio_key, blob.content_encoding
+        else:
+            store(minio_key)
         
         # Save to database
         db_file = File(
@@ -59,13 +96,21 @@ def upload_file(group_id):
             minio_key=minio_key,
             file_size=file_size,
             mime_type=mime_type,
+            sha256=sha256,
+            content_encoding=encoding,
+            blob=blob,
             group_id=group_id,
             uploader_id=user_id
         )
         db.session.add(db_file)
+        db.session.flush()
+        adjust_group_stats(group_id, 1, db_file.file_size, [(db_file.id, 'add')])
+        queue_thumbnails([(db_file.id, db_file.mime_type)])
+        
+        db.session.commit()
         
         # Log activity
-        activity = Activity(
+        log_activity(
             user_id=user_id,
             group_id=group_id,
             file_id=db_file.id,
@@ -73,105 +118,1001 @@ def upload_file(group_id):
             description=f'Uploaded "{original_filename}"',
             activity_data={'file_size': file_size, 'mime_type': mime_type}
         )
-        db.session.add(activity)
+        
+        return jsonify({
+            'msg': 'File uploaded successfully',
+            'file_id': db_file.id,
+            'filename': original_filename,
+            'file_size': file_size
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': f'Upload failed: {str(e)}'}), 500
+
+@files_bp.route('/<int:group_id>/upload-stream', methods=['POST', 'PUT'])
+@query_budget(10)
+@jwt_required()
+@require_membership()
+def upload_stream(group_id):
+    """Upload the raw request body, piping it to storage without spooling.
+    
+    The filename comes from the X-Filename header or ``filename`` query
+    parameter; the MIME type from ``mime_type`` or the Content-Type header.
+    """
+    user_id = get_jwt_identity()
+    
+    original_filename = secure_filename(
+        request.headers.get('X-Filename') or request.args.get('filename', '')
+    )
+    if not original_filename:
+        return jsonify({'msg': 'No file selected'}), 400
+    
+    unique_filename, minio_key = _new_object_key(group_id, user_id, original_filename)
+    
+    mime_type = request.args.get('mime_type') or request.mimetype
+    if not mime_type or mime_type == 'application/octet-stream':
+        mime_type, _ = mimetypes.guess_type(original_filename)
+    
+    reader = HashingReader(request.stream)
+    content_addressed = current_app.config['CONTENT_ADDRESSED_STORAGE']
+    
+    # The digest is only known once the body has been read, so with content
+    # addressing the body lands on a temporary key first and is then copied
+    # server-side to its blob key (or dropped if the content already exists)
+    upload_key = f"tmp/{uuid.uuid4().hex}" if content_addressed else minio_key
+    
+    try:
+        blob = None
+        try:
+            storage.put(upload_key, reader, content_type=mime_type)
+            if reader.size == 0:
+                return jsonify({'msg': 'Empty request body'}), 400
+            if content_addressed:
+                blob, _ = acquire_blob(reader.hexdigest(), reader.size, lambda key: storage.copy(upload_key, key))
+                minio_key = blob.minio_key
+        finally:
+            # Whatever happened, a temporary object is not needed any more;
+            # purge-deleted sweeps any left by a worker that died here
+            if content_addressed or reader.size == 0:
+                storage.delete([upload_key])
+        
+        # Save to database
+        db_file = File(
+            filename=unique_filename,
+            original_filename=original_filename,
+            minio_key=minio_key,
+            file_size=reader.size,
+            mime_type=mime_type,
+            sha256=reader.hexdigest(),
+            content_encoding=blob.content_encoding if blob else None,
+            blob=blob,
+            group_id=group_id,
+            uploader_id=user_id
+        )
+        db.session.add(db_file)
+        db.session.flush()
+        adjust_group_stats(group_id, 1, db_file.file_size, [(db_file.id, 'add')])
+        queue_thumbnails([(db_file.id, db_file.mime_type)])
         
         db.session.commit()
         
+        # Log activity
+        log_activity(
+            user_id=user_id,
+            group_id=group_id,
+            file_id=db_file.id,
+            activity_type='upload',
+            description=f'Uploaded "{original_filename}"',
+            activity_data={'file_size': reader.size, 'mime_type': mime_type}
+        )
+        
         return jsonify({
             'msg': 'File uploaded successfully',
             'file_id': db_file.id,
             'filename': original_filename,
-            'file_size': file_size
+            'file_size': reader.size,
+            'sha256': db_file.sha256
         }), 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'msg': f'Upload failed: {str(e)}'}), 500
 
+@files_bp.route('/<int:group_id>/upload-batch', methods=['POST'])
+@query_budget(14)
+@jwt_required()
+@require_membership()
+def upload_batch(group_id):
+    """Upload many files in one multipart request (repeated ``files`` parts).
+    
+    Parts are hashed and written to storage by a bounded thread pool, then
+    recorded with one INSERT. Returns a result per part, in request order,
+    with either a ``file_id`` or an ``error``; 207 if any part failed.
+    """
+    user_id = int(get_jwt_identity())
+    
+    parts = request.files.getlist('files')
+    if not parts:
+        return jsonify({'msg': 'No files'}), 400
+    if len(parts) > current_app.config['UPLOAD_BATCH_MAX_FILES']:
+        return jsonify({'msg': f"At most {current_app.config['UPLOAD_BATCH_MAX_FILES']} files per batch"}), 400
+    
+    uploads = []
+    for index, part in enumerate(parts):
+        original_filename = secure_filename(part.filename or '')
+        upload = {'filename': original_filename, 'part': part}
+        if not original_filename:
+            upload['error'] = 'No file selected'
+        else:
+            # The index keeps same-named parts of one batch on separate keys
+            upload['unique_filename'], upload['minio_key'] = _new_object_key(
+                group_id, user_id, f'{index}_{original_filename}')
+            upload['mime_type'], _ = mimetypes.guess_type(original_filename)
+        uploads.append(upload)
+    valid = [upload for upload in uploads if 'error' not in upload]
+    
+    def store(upload, key):
+        compression_policy.put(storage, key, upload['part'].stream, upload['file_size'], upload['mime_type'],
+                               upload['content_encoding'])
+    
+    def run_all(function, items):
+        """Call ``function`` on every item concurrently; return {index: error}."""
+        errors = {}
+        with ThreadPoolExecutor(current_app.config['UPLOAD_BATCH_CONCURRENCY']) as pool:
+            futures = {pool.submit(function, item): i for i, item in enumerate(items)}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    errors[futures[future]] = str(future.exception())
+        return errors
+    
+    try:
+        def hash_upload(upload):
+            upload['sha256'], upload['file_size'] = hash_file(upload['part'].stream)
+            upload['content_encoding'] = compression_policy.encoding_for(
+                upload['part'].stream, upload['mime_type'], upload['file_size'])
+        for i, error in run_all(hash_upload, valid).items():
+            valid[i]['error'] = error
+        valid = [upload for upload in valid if 'error' not in upload]
+        
+        if current_app.config['CONTENT_ADDRESSED_STORAGE']:
+            wanted, first = {}, {}
+            for upload in valid:
+                size, references, encoding = wanted.get(
+                    upload['sha256'], (upload['file_size'], 0, upload['content_encoding']))
+                wanted[upload['sha256']] = (size, references + 1, encoding)
+                first.setdefault(upload['sha256'], upload)
+            
+            def store_many(pending):
+                errors = run_all(lambda item: store(first[item[0]], item[1]), pending)
+                return {pending[i][0]: error for i, error in errors.items()}
+            
+            blobs, failed = acquire_blobs(wanted, store_many)
+            for upload in valid:
+                if upload['sha256'] in failed:
+                    upload['error'] = failed[upload['sha256']]
+                else:
+                    upload['blob_id'], upload['minio_key'], upload['content_encoding'] = blobs[upload['sha256']]
+        else:
+            errors = run_all(lambda upload: store(upload, upload['minio_key']), valid)
+            for i, error in errors.items():
+                valid[i]['error'] = error
+        
+        stored = [upload for upload in valid if 'error' not in upload]
+        if stored:
+            # Match ids back by unique filename: asking for rows in parameter
+            # order makes SQLite fall back to one INSERT per row
+            rows = db.session.execute(insert(File).returning(File.id, File.filename), [{
+                'filename': upload['unique_filename'],
+                'original_filename': upload['filename'],
+                'minio_key': upload['minio_key'],
+                'file_size': upload['file_size'],
+                'mime_type': upload['mime_type'],
+                'sha256': upload['sha256'],
+                'content_encoding': upload['content_encoding'],
+                'blob_id': upload.get('blob_id'),
+                'group_id': group_id,
+                'uploader_id': user_id,
+                'is_deleted': False,
+                'uploaded_at': datetime.utcnow()
+            } for upload in stored])
+            file_ids = {filename: file_id for file_id, filename in rows}
+            for upload in stored:
+                upload['file_id'] = file_ids[upload['unique_filename']]
+            adjust_group_stats(group_id, len(stored), sum(upload['file_size'] for upload in stored),
+                               [(upload['file_id'], 'add') for upload in stored])
+            queue_thumbnails([(upload['file_id'], upload['mime_type']) for upload in stored])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': f'Upload failed: {str(e)}'}), 500
+    
+    if stored:
+        log_activities([{
+            'user_id': user_id,
+            'group_id': group_id,
+            'file_id': upload['file_id'],
+            'activity_type': 'upload',
+            'description': f'Uploaded "{upload["filename"]}"',
+            'activity_data': {'file_size': upload['file_size'], 'mime_type': upload['mime_type']}
+        } for upload in stored])
+    
+    results = []
+    for upload in uploads:
+        if 'error' in upload:
+            results.append({'filename': upload['filename'], 'error': upload['error']})
+        else:
+            results.append({'filename': upload['filename'], 'file_id': upload['file_id'],
+                            'file_size': upload['file_size']})
+    return jsonify({'files': results}), 201 if len(stored) == len(uploads) else 207
+
 @files_bp.route('/<int:group_id>/list', methods=['GET'])
+@query_budget(2)
 @jwt_required()
+@require_membership()
 def list_files(group_id):
-    user_id = get_jwt_identity()
+    """One page of the group's files, newest first by default.
     
-    # Check if user is a group member
-    if not GroupMembership.query.filter_by(user_id=user_id, group_id=group_id).first():
-        return jsonify({'msg': 'Not a group member'}), 403
+    Query parameters: ``limit``, ``cursor`` (the ``next_cursor`` of the
+    previous page), ``order`` (``desc``/``asc``), ``mime_type`` (exact, or a
+    prefix such as ``image/``) and ``uploader_id``.
+    """
+    limit = page_limit(current_app.config['FILES_PAGE_SIZE'], current_app.config['FILES_MAX_PAGE_SIZE'])
+    descending = request.args.get('order', 'desc') != 'asc'
     
-    files = File.query.filter_by(group_id=group_id, is_deleted=False).options(
+    query = File.query.filter_by(group_id=group_id, is_deleted=False)
+    
+    mime_type = request.args.get('mime_type')
+    if mime_type:
+        if mime_type.endswith('/'):
+            query = query.filter(File.mime_type.startswith(mime_type, autoescape=True))
+        else:
+            query = query.filter(File.mime_type == mime_type)
+    
+    uploader_id = request.args.get('uploader_id', type=int)
+    if uploader_id is not None:
+        query = query.filter(File.uploader_id == uploader_id)
+    
+    # Keyset pagination: seek past the last (uploaded_at, id) instead of
+    # using OFFSET, so every page is an index range scan
+    if request.args.get('cursor'):
+        try:
+            position = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return jsonify({'msg': 'Invalid cursor'}), 400
+        key = tuple_(File.uploaded_at, File.id)
+        query = query.filter(key < position if descending else key > position)
+    
+    if descending:
+        query = query.order_by(File.uploaded_at.desc(), File.id.desc())
+    else:
+        query = query.order_by(File.uploaded_at.asc(), File.id.asc())
+    
+    files = query.options(joinedload(File.uploader)).limit(limit + 1).all()
+    has_more = len(files) > limit
+    files = files[:limit]
+    
+    return jsonify({
+        'files': [_file_json(file) for file in files],
+        'next_cursor': encode_cursor(files[-1].uploaded_at, files[-1].id) if has_more else None
+    })
+
+@files_bp.route('/<int:group_id>/changes', methods=['GET'])
+@query_budget(28)  # 3 plus one counter read per poll at the default wait and interval
+@jwt_required()
+@require_membership()
+def list_changes(group_id):
+    """Files added to or deleted from the group after change ``since``.
+    
+    Without ``since`` only the current ``cursor`` is returned: take it before
+    listing the group, then pass it back as ``since`` to stay in sync. With
+    ``wait`` (seconds, capped at CHANGES_MAX_WAIT) the request is held open
+    until something changes, re-reading the group's counter every
+    CHANGES_POLL_INTERVAL. Every response reports that cap as ``max_wait``;
+    when it is 0 (sync workers) clients should poll on a timer instead.
+    Apply changes in ``seq`` order; adds carry the same fields as ``list``.
+    """
+    limit = page_limit(current_app.config['CHANGES_PAGE_SIZE'], current_app.config['CHANGES_MAX_PAGE_SIZE'])
+    max_wait = current_app.config['CHANGES_MAX_WAIT']
+    wait = min(max(request.args.get('wait', 0, type=float), 0), max_wait)
+    since = request.args.get('since', type=int)
+    
+    def latest_seq():
+        return db.session.query(GroupStats.change_seq).filter_by(group_id=group_id).scalar() or 0
+    
+    latest = latest_seq()
+    if since is None:
+        return jsonify({'changes': [], 'cursor': latest, 'has_more': False, 'max_wait': max_wait})
+    if since < 0 or since > latest:
+        return jsonify({'msg': 'Invalid cursor'}), 400
+    
+    deadline = time.monotonic() + wait
+    while latest == since and time.monotonic() < deadline:
+        # Hand the connection back to the pool while idle
+        db.session.close()
+        time.sleep(max(0, min(current_app.config['CHANGES_POLL_INTERVAL'], deadline - time.monotonic())))
+        latest = latest_seq()
+    if latest == since:
+        return jsonify({'changes': [], 'cursor': since, 'has_more': False, 'max_wait': max_wait})
+    
+    rows = db.session.query(FileChange, File).outerjoin(File, File.id == FileChange.file_id).options(
         joinedload(File.uploader)
-    ).order_by(File.uploaded_at.desc()).all()
-    
-    file_list = []
-    for file in files:
-        file_list.append({
-            'id': file.id,
-            'filename': file.original_filename,
-            'file_size': file.file_size,
-            'mime_type': file.mime_type,
-            'uploaded_at': file.uploaded_at.isoformat(),
-            'uploader': {
-                'id': file.uploader.id,
-                'username': file.uploader.username
-            } if file.uploader else None
-        })
+    ).filter(
+        FileChange.group_id == group_id,
+        FileChange.seq > since
+    ).order_by(FileChange.seq).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
-    return jsonify(file_list)
+    changes = []
+    for change, file in rows:
+        entry = {'seq': change.seq, 'change': change.change, 'file_id': change.file_id}
+        if change.change == 'add':
+            # None if the file has since been purged; its delete follows
+            entry['file'] = _file_json(file) if file else None
+        changes.append(entry)
+    
+    # No rows past ``since`` although the counter moved: the log was pruned
+    # or rebuilt, so skip ahead to the counter
+    cursor = rows[-1][0].seq if rows else latest
+    return jsonify({'changes': changes, 'cursor': cursor, 'has_more': has_more, 'max_wait': max_wait})
 
 @files_bp.route('/<int:group_id>/download/<int:file_id>', methods=['GET'])
+@query_budget(3)
 @jwt_required()
+@require_membership()
 def download_file(group_id, file_id):
     user_id = get_jwt_identity()
     
-    # Check if user is a group member
-    if not GroupMembership.query.filter_by(user_id=user_id, group_id=group_id).first():
+    db_file = File.query.get(file_id)
+    if not db_file or db_file.group_id != group_id or db_file.is_deleted:
+        return jsonify({'msg': 'File not found'}), 404
+    
+    try:
+        stat = storage.stat(db_file.minio_key)
+        encoding = db_file.content_encoding
+        passthrough = False
+        if encoding:
+            # Validators and ranges describe what is sent: the stored bytes
+            # as they are to clients accepting the encoding (whole-object
+            # requests only), the original bytes to everyone else
+            passthrough = not request.range and request.accept_encodings[encoding] > 0
+            if passthrough:
+                stat = ObjectStat(stat.size, stat.etag and f'{stat.etag}-{encoding}', stat.last_modified)
+            else:
+                stat = ObjectStat(db_file.file_size, stat.etag, stat.last_modified)
+        headers = validators(stat)
+        if encoding:
+            headers['Vary'] = 'Accept-Encoding'
+            if passthrough:
+                headers['Content-Encoding'] = encoding
+        
+        if is_not_modified(stat):
+            return Response(status=304, headers=headers)
+        
+        try:
+            byte_range = requested_range(stat)
+        except ValueError:
+            headers['Content-Range'] = f'bytes */{stat.size}'
+            return Response(status=416, headers=headers)
+        
+        if byte_range:
+            start, stop = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{stat.size}'
+        else:
+            start, stop = 0, stat.size
+            status = 200
+        
+        # Log download activity once per download, not for every resumed range
+        if start == 0:
+            log_activity(
+                user_id=user_id,
+                group_id=group_id,
+                file_id=file_id,
+                activity_type='download',
+                description=f'Downloaded "{db_file.original_filename}"'
+            )
+        
+        # Local objects, and hot remote ones via the disk cache, are served
+        # with sendfile; send_file re-applies the Range with our validators
+        path = None
+        if not encoding:
+            path = storage.local_path(db_file.minio_key)
+            if path is None and stat.etag and object_cache.cacheable(stat.size):
+                path = object_cache.fetch(db_file.minio_key, stat.etag,
+                                          lambda: storage.open(db_file.minio_key))
+        if path:
+            try:
+                result = send_file(
+                    path,
+                    mimetype=db_file.mime_type or 'application/octet-stream',
+                    as_attachment=True,
+                    download_name=db_file.original_filename,
+                    etag=stat.etag,
+                    last_modified=stat.last_modified
+                )
+            except FileNotFoundError:
+                # Evicted by another worker before send_file opened it; once
+                # open, an eviction no longer affects this response
+                pass
+            else:
+                result.headers['Accept-Ranges'] = 'bytes'
+                return result
+        
+        if encoding and not passthrough:
+            response = open_decoded(storage, db_file.minio_key, encoding, start, stop)
+        elif byte_range:
+            response = storage.open(db_file.minio_key, offset=start, length=stop - start)
+        else:
+            response = storage.open(db_file.minio_key)
+        
+        headers['Content-Length'] = str(stop - start)
+        result = Response(
+            iter_object(response, current_app.config['DOWNLOAD_CHUNK_SIZE']),
+            status=status,
+            headers=headers,
+            mimetype=db_file.mime_type or 'application/octet-stream',
+            direct_passthrough=True
+        )
+        result.headers.set('Content-Disposition', 'attachment',
+                           filename=db_file.original_filename)
+        return result
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': f'Download failed: {str(e)}'}), 500
+
+@files_bp.route('/<int:group_id>/thumbnail/<int:file_id>', methods=['GET'])
+@query_budget(3)
+@jwt_required()
+@require_membership()
+def get_thumbnail(group_id, file_id):
+    """The file's WEBP thumbnail, once the thumbnail worker has made it.
+    
+    A thumbnail never changes for a given key (the key names the source
+    object and the size), so it is served as immutable and revalidated by
+    an ETag derived from the key alone.
+    """
+    db_file = File.query.get(file_id)
+    if not db_file or db_file.group_id != group_id or db_file.is_deleted:
+        return jsonify({'msg': 'File not found'}), 404
+    if not db_file.thumbnail_key:
+        return jsonify({'msg': 'Thumbnail not available'}), 404
+    
+    etag = hashlib.sha256(db_file.thumbnail_key.encode()).hexdigest()[:32]
+    headers = {
+        'ETag': f'"{etag}"',
+        # private: the response depends on the caller's membership
+        'Cache-Control': f"private, max-age={current_app.config['THUMBNAIL_MAX_AGE']}, immutable"
+    }
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    
+    try:
+        response = storage.open(db_file.thumbnail_key)
+    except Exception as e:
+        return jsonify({'msg': f'Thumbnail failed: {str(e)}'}), 500
+    return Response(iter_object(response, current_app.config['DOWNLOAD_CHUNK_SIZE']), headers=headers,
+                    mimetype=THUMBNAIL_CONTENT_TYPE, direct_passthrough=True)
+
+def _archive_token_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='archive-link')
+
+def _archive_selection():
+    """``(compression, file_ids, error)`` requested for an archive; ``error``
+    is a 400 response when the request is invalid.
+    
+    ``file_ids`` may be a comma separated query parameter or a JSON list;
+    ``compression`` is ``stored`` (default) or ``deflate``.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return None, None, (jsonify({'msg': 'Expected a JSON object'}), 400)
+    compression = data.get('compression') or request.args.get('compression', 'stored')
+    if compression not in COMPRESSION_METHODS:
+        return None, None, (jsonify({'msg': 'Compression must be stored or deflate'}), 400)
+    
+    file_ids = data.get('file_ids')
+    if file_ids is not None and not (
+        isinstance(file_ids, list) and all(isinstance(i, int) and not isinstance(i, bool) for i in file_ids)
+    ):
+        return None, None, (jsonify({'msg': 'Invalid file_ids'}), 400)
+    if file_ids is None and request.args.get('file_ids'):
+        try:
+            file_ids = [int(i) for i in request.args['file_ids'].split(',')]
+        except ValueError:
+            return None, None, (jsonify({'msg': 'Invalid file_ids'}), 400)
+    return compression, file_ids, None
+
+def _archive_response(group_id, user_id, compression, file_ids):
+    group = Group.query.get(group_id)
+    if not group:
+        return jsonify({'msg': 'Group not found'}), 404
+    
+    query = File.query.filter_by(group_id=group_id, is_deleted=False)
+    if file_ids is not None:
+        query = query.filter(File.id.in_(file_ids))
+    files = query.order_by(File.uploaded_at, File.id).limit(
+        current_app.config['ARCHIVE_MAX_FILES'] + 1
+    ).all()
+    
+    if not files:
+        return jsonify({'msg': 'No files to archive'}), 404
+    if len(files) > current_app.config['ARCHIVE_MAX_FILES']:
+        return jsonify({'msg': f"Archives are limited to {current_app.config['ARCHIVE_MAX_FILES']} files"}), 400
+    
+    arcnames = unique_arcnames([f.original_filename for f in files])
+    entries = [
+        ArchiveEntry(name, f.minio_key, f.file_size, f.uploaded_at or datetime.utcnow(), f.content_encoding)
+        for name, f in zip(arcnames, files)
+    ]
+    total_size = sum(f.file_size for f in files)
+    
+    # One activity entry for the whole archive
+    log_activity(
+        user_id=user_id,
+        group_id=group_id,
+        activity_type='download_archive',
+        description=f'Downloaded {len(files)} file(s) as an archive',
+        activity_data={
+            'file_count': len(files),
+            'total_size': total_size,
+            'file_ids': [f.id for f in files] if file_ids is not None else None
+        }
+    )
+    
+    response = Response(
+        iter_zip(
+            entries,
+            lambda entry: open_decoded(storage, entry.minio_key, entry.content_encoding),
+            compression=COMPRESSION_METHODS[compression],
+            chunk_size=current_app.config['DOWNLOAD_CHUNK_SIZE']
+        ),
+        mimetype='application/zip',
+        direct_passthrough=True
+    )
+    response.headers.set('Content-Disposition', 'attachment',
+                         filename=f"{secure_filename(group.name) or 'files'}.zip")
+    return response
+
+@files_bp.route('/<int:group_id>/archive', methods=['GET', 'POST'])
+@query_budget(3)
+@jwt_required()
+@require_membership()
+def download_archive(group_id):
+    """Stream a ZIP of the whole group, or of the ``file_ids`` selection."""
+    compression, file_ids, error = _archive_selection()
+    if error:
+        return error
+    return _archive_response(group_id, get_jwt_identity(), compression, file_ids)
+
+@files_bp.route('/<int:group_id>/archive-link', methods=['POST'])
+@query_budget(1)
+@jwt_required()
+@require_membership()
+def create_archive_link(group_id):
+    """A short-lived URL for the same archive as ``archive`` that needs no
+    Authorization header, so a browser can download it straight to disk."""
+    compression, file_ids, error = _archive_selection()
+    if error:
+        return error
+    token = _archive_token_serializer().dumps({
+        'user_id': str(get_jwt_identity()),
+        'group_id': group_id,
+        'compression': compression,
+        'file_ids': file_ids
+    })
+    return jsonify({
+        'url': url_for('files.download_archive_link', group_id=group_id, token=token),
+        'expires_in': current_app.config['ARCHIVE_LINK_EXPIRY']
+    }), 200
+
+@files_bp.route('/<int:group_id>/archive/<token>', methods=['GET'])
+@query_budget(3)
+def download_archive_link(group_id, token):
+    try:
+        link = _archive_token_serializer().loads(token, max_age=current_app.config['ARCHIVE_LINK_EXPIRY'])
+    except BadSignature:
+        return jsonify({'msg': 'Invalid or expired archive link'}), 403
+    if link['group_id'] != group_id:
+        return jsonify({'msg': 'Invalid or expired archive link'}), 403
+    # The user may have left the group since the link was made
+    if get_role(link['user_id'], group_id) is None:
         return jsonify({'msg': 'Not a group member'}), 403
+    return _archive_response(group_id, link['user_id'], link['compression'], link['file_ids'])
+
+@files_bp.route('/<int:group_id>/presign-upload', methods=['POST'])
+@query_budget(2)
+@jwt_required()
+@require_membership()
+def presign_upload(group_id):
+    if not current_app.config['PRESIGNED_TRANSFERS'] or not storage.supports_presign:
+        return jsonify({'msg': 'Presigned transfers are disabled'}), 404
+    
+    user_id = get_jwt_identity()
+    
+    data = request.json or {}
+    original_filename = secure_filename(data.get('filename', ''))
+    if not original_filename:
+        return jsonify({'msg': 'Missing filename'}), 400
+    
+    unique_filename, minio_key = _new_object_key(group_id, user_id, original_filename)
+    expiry = current_app.config['PRESIGNED_URL_EXPIRY']
+    
+    try:
+        upload_url = storage.presigned_put(minio_key, timedelta(seconds=expiry))
+    except Exception as e:
+        return jsonify({'msg': f'Presign failed: {str(e)}'}), 500
+    
+    # The token binds the object key to this user and group so finalize
+    # cannot be used to claim someone else's object
+    upload_token = _upload_token_serializer().dumps({
+        'user_id': str(user_id),
+        'group_id': group_id,
+        'minio_key': minio_key,
+        'filename': unique_filename,
+        'original_filename': original_filename
+    })
+    
+    return jsonify({
+        'upload_url': upload_url,
+        'upload_token': upload_token,
+        'expires_in': expiry
+    }), 200
+
+@files_bp.route('/<int:group_id>/finalize', methods=['POST'])
+@query_budget(7)
+@jwt_required()
+@require_membership()
+def finalize_upload(group_id):
+    if not current_app.config['PRESIGNED_TRANSFERS'] or not storage.supports_presign:
+        return jsonify({'msg': 'Presigned transfers are disabled'}), 404
+    
+    user_id = get_jwt_identity()
+    
+    data = request.json or {}
+    try:
+        # Allow the client the full URL lifetime plus time to finish the PUT
+        token = _upload_token_serializer().loads(
+            data.get('upload_token', ''),
+            max_age=current_app.config['PRESIGNED_URL_EXPIRY'] * 2
+        )
+    except BadSignature:
+        return jsonify({'msg': 'Invalid or expired upload token'}), 400
+    
+    if token['user_id'] != str(user_id) or token['group_id'] != group_id:
+        return jsonify({'msg': 'Invalid or expired upload token'}), 400
+    
+    minio_key = token['minio_key']
+    if File.query.filter_by(minio_key=minio_key).first():
+        return jsonify({'msg': 'Upload already finalized'}), 409
+    
+    try:
+        stat = storage.stat(minio_key)
+    except Exception:
+        return jsonify({'msg': 'Uploaded object not found'}), 400
+    
+    original_filename = token['original_filename']
+    mime_type, _ = mimetypes.guess_type(original_filename)
+    
+    try:
+        db_file = File(
+            filename=token['filename'],
+            original_filename=original_filename,
+            minio_key=minio_key,
+            file_size=stat.size,
+            mime_type=mime_type,
+            group_id=group_id,
+            uploader_id=user_id
+        )
+        db.session.add(db_file)
+        db.session.flush()
+        adjust_group_stats(group_id, 1, db_file.file_size, [(db_file.id, 'add')])
+        queue_thumbnails([(db_file.id, db_file.mime_type)])
+        
+        db.session.commit()
+        
+        # Log activity
+        log_activity(
+            user_id=user_id,
+            group_id=group_id,
+            file_id=db_file.id,
+            activity_type='upload',
+            description=f'Uploaded "{original_filename}"',
+            activity_data={'file_size': stat.size, 'mime_type': mime_type, 'presigned': True}
+        )
+        
+        return jsonify({
+            'msg': 'File uploaded successfully',
+            'file_id': db_file.id,
+            'filename': original_filename,
+            'file_size': stat.size
+        }), 201
+        
+    except IntegrityError:
+        # A concurrent finalize of the same token got past the check above
+        db.session.rollback()
+        return jsonify({'msg': 'Upload already finalized'}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': f'Upload failed: {str(e)}'}), 500
+
+@files_bp.route('/<int:group_id>/presign-download/<int:file_id>', methods=['GET'])
+@query_budget(3)
+@jwt_required()
+@require_membership()
+def presign_download(group_id, file_id):
+    if not current_app.config['PRESIGNED_TRANSFERS'] or not storage.supports_presign:
+        return jsonify({'msg': 'Presigned transfers are disabled'}), 404
+    
+    user_id = get_jwt_identity()
     
     db_file = File.query.get(file_id)
     if not db_file or db_file.group_id != group_id or db_file.is_deleted:
         return jsonify({'msg': 'File not found'}), 404
+    if db_file.content_encoding:
+        # MinIO would hand out the compressed bytes as they are
+        return jsonify({'msg': 'File is stored compressed; use the download endpoint'}), 409
     
+    expiry = current_app.config['PRESIGNED_URL_EXPIRY']
     try:
-        # Get file from MinIO
-        response = minio_client.get_object(os.getenv('MINIO_BUCKET'), db_file.minio_key)
+        download_url = storage.presigned_get(
+            db_file.minio_key,
+            timedelta(seconds=expiry),
+            response_headers={
+                'response-content-disposition': f'attachment; filename="{db_file.original_filename}"',
+                'response-content-type': db_file.mime_type or 'application/octet-stream'
+            }
+        )
         
         # Log download activity
-        activity = Activity(
+        log_activity(
             user_id=user_id,
             group_id=group_id,
             file_id=file_id,
             activity_type='download',
-            description=f'Downloaded "{db_file.original_filename}"'
+            description=f'Downloaded "{db_file.original_filename}"',
+            activity_data={'presigned': True}
+        )
+        
+        return jsonify({
+            'download_url': download_url,
+            'expires_in': expiry
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': f'Presign failed: {str(e)}'}), 500
+
+def _active_upload_session(group_id, session_id, user_id):
+    session = UploadSession.query.get(session_id)
+    if (not session or session.group_id != group_id or
+            str(session.user_id) != str(user_id) or session.status != 'active'):
+        return None
+    return session
+
+def _session_json(session):
+    return {
+        'session_id': session.id,
+        'filename': session.original_filename,
+        'part_size': session.part_size,
+        'status': session.status,
+        'parts': [{
+            'part_number': part.part_number,
+            'etag': part.etag,
+            'size': part.size
+        } for part in session.parts]
+    }
+
+@files_bp.route('/<int:group_id>/uploads', methods=['POST'])
+@query_budget(4)
+@jwt_required()
+@require_membership()
+def create_upload_session(group_id):
+    user_id = get_jwt_identity()
+    
+    data = request.json or {}
+    original_filename = secure_filename(data.get('filename', ''))
+    if not original_filename:
+        return jsonify({'msg': 'Missing filename'}), 400
+    
+    unique_filename, minio_key = _new_object_key(group_id, user_id, original_filename)
+    mime_type, _ = mimetypes.guess_type(original_filename)
+    
+    try:
+        upload_id = storage.create_multipart(minio_key, mime_type)
+        
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            group_id=group_id,
+            user_id=user_id,
+            filename=unique_filename,
+            original_filename=original_filename,
+            minio_key=minio_key,
+            upload_id=upload_id,
+            mime_type=mime_type,
+            part_size=current_app.config['UPLOAD_PART_SIZE']
+        )
+        db.session.add(session)
+        db.session.commit()
+        
+        return jsonify(_session_json(session)), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': f'Upload session failed: {str(e)}'}), 500
+
+@files_bp.route('/<int:group_id>/uploads/<session_id>', methods=['GET'])
+@query_budget(3)
+@jwt_required()
+@require_membership()
+def get_upload_session(group_id, session_id):
+    session = _active_upload_session(group_id, session_id, get_jwt_identity())
+    if not session:
+        return jsonify({'msg': 'Upload session not found'}), 404
+    
+    return jsonify(_session_json(session))
+
+@files_bp.route('/<int:group_id>/uploads/<session_id>/parts/<int:part_number>', methods=['PUT'])
+@query_budget(4)
+@jwt_required()
+@require_membership()
+def upload_part(group_id, session_id, part_number):
+    session = _active_upload_session(group_id, session_id, get_jwt_identity())
+    if not session:
+        return jsonify({'msg': 'Upload session not found'}), 404
+    
+    if not 1 <= part_number <= 10000:
+        return jsonify({'msg': 'Part number must be between 1 and 10000'}), 400
+    
+    # Parts are buffered in memory, so bound them before reading the body
+    if request.content_length is None:
+        return jsonify({'msg': 'Content-Length is required'}), 411
+    if request.content_length == 0 or request.content_length > session.part_size:
+        return jsonify({'msg': f'Part size must be between 1 and {session.part_size} bytes'}), 400
+    
+    data = request.get_data(cache=False)
+    
+    try:
+        etag = storage.upload_part(session.minio_key, session.upload_id, part_number, data)
+    except Exception as e:
+        return jsonify({'msg': f'Part upload failed: {str(e)}'}), 500
+    
+    # A retried part replaces the previous attempt
+    part = UploadPart.query.filter_by(session_id=session.id, part_number=part_number).first()
+    if not part:
+        part = UploadPart(session_id=session.id, part_number=part_number)
+        db.session.add(part)
+    part.etag = etag
+    part.size = len(data)
+    part.uploaded_at = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent retry of the same part on another worker
+        db.session.rollback()
+        UploadPart.query.filter_by(session_id=session.id, part_number=part_number).update({
+            'etag': etag,
+            'size': len(data),
+            'uploaded_at': datetime.utcnow()
+        })
+        db.session.commit()
+    
+    return jsonify({'part_number': part_number, 'etag': etag, 'size': len(data)}), 200
+
+@files_bp.route('/<int:group_id>/uploads/<session_id>/complete', methods=['POST'])
+@query_budget(15)
+@jwt_required()
+@require_membership()
+def complete_upload_session(group_id, session_id):
+    user_id = get_jwt_identity()
+    session = _active_upload_session(group_id, session_id, user_id)
+    if not session:
+        return jsonify({'msg': 'Upload session not found'}), 404
+    
+    parts = session.parts
+    if not parts:
+        return jsonify({'msg': 'No parts uploaded'}), 400
+    
+    missing = sorted(set(range(1, parts[-1].part_number + 1)) - {p.part_number for p in parts})
+    if missing:
+        return jsonify({'msg': 'Missing parts', 'missing_parts': missing}), 400
+    
+    file_size = sum(part.size for part in parts)
+    
+    # Claim the session so concurrent complete calls cannot create two files
+    claimed = UploadSession.query.filter_by(id=session.id, status='active').update(
+        {'status': 'completing'}
+    )
+    db.session.commit()
+    if not claimed:
+        return jsonify({'msg': 'Upload session not found'}), 404
+    
+    try:
+        storage.complete_multipart(
+            session.minio_key,
+            session.upload_id,
+            [(part.part_number, part.etag) for part in parts]
         )
-        db.session.add(activity)
+        
+        # Save to database
+        db_file = File(
+            filename=session.filename,
+            original_filename=session.original_filename,
+            minio_key=session.minio_key,
+            file_size=file_size,
+            mime_type=session.mime_type,
+            group_id=group_id,
+            uploader_id=user_id
+        )
+        db.session.add(db_file)
+        db.session.flush()
+        adjust_group_stats(group_id, 1, db_file.file_size, [(db_file.id, 'add')])
+        queue_thumbnails([(db_file.id, db_file.mime_type)])
+        
+        session.status = 'completed'
+        session.completed_at = datetime.utcnow()
         db.session.commit()
         
-        return send_file(
-            BytesIO(response.read()),
-            download_name=db_file.original_filename,
-            as_attachment=True,
-            mimetype=db_file.mime_type
+        # Log activity
+        log_activity(
+            user_id=user_id,
+            group_id=group_id,
+            file_id=db_file.id,
+            activity_type='upload',
+            description=f'Uploaded "{session.original_filename}"',
+            activity_data={'file_size': file_size, 'mime_type': session.mime_type, 'parts': len(parts)}
         )
         
+        return jsonify({
+            'msg': 'File uploaded successfully',
+            'file_id': db_file.id,
+            'filename': session.original_filename,
+            'file_size': file_size
+        }), 201
+        
     except Exception as e:
-        return jsonify({'msg': f'Download failed: {str(e)}'}), 500
+        db.session.rollback()
+        # Release the claim so the client can retry
+        UploadSession.query.filter_by(id=session_id).update({'status': 'active'})
+        db.session.commit()
+        return jsonify({'msg': f'Upload failed: {str(e)}'}), 500
+
+@files_bp.route('/<int:group_id>/uploads/<session_id>', methods=['DELETE'])
+@query_budget(3)
+@jwt_required()
+@require_membership()
+def abort_upload_session(group_id, session_id):
+    session = _active_upload_session(group_id, session_id, get_jwt_identity())
+    if not session:
+        return jsonify({'msg': 'Upload session not found'}), 404
+    
+    try:
+        storage.abort_multipart(session.minio_key, session.upload_id)
+        session.status = 'aborted'
+        db.session.commit()
+        return jsonify({'msg': 'Upload aborted'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': f'Abort failed: {str(e)}'}), 500
 
 @files_bp.route('/<int:group_id>/delete/<int:file_id>', methods=['DELETE'])
+@query_budget(7)
 @jwt_required()
+@require_membership()
 def delete_file(group_id, file_id):
     user_id = get_jwt_identity()
-    
-    # Check if user is a group member
-    membership = GroupMembership.query.filter_by(user_id=user_id, group_id=group_id).first()
-    if not membership:
-        return jsonify({'msg': 'Not a group member'}), 403
+    role = get_role(user_id, group_id)
     
     db_file = File.query.get(file_id)
     if not db_file or db_file.group_id != group_id or db_file.is_deleted:
         return jsonify({'msg': 'File not found'}), 404
     
     # Check if user can delete (uploader, admin, or owner)
-    can_delete = (db_file.uploader_id == user_id or 
-                  membership.role in ['admin', 'owner'])
+    can_delete = (str(db_file.uploader_id) == str(user_id) or 
+                  role in ['admin', 'owner'])
     
     if not can_delete:
         return jsonify({'msg': 'Insufficient permissions to delete this file'}), 403
@@ -180,18 +1121,18 @@ def delete_file(group_id, file_id):
         # Mark as deleted (soft delete)
         db_file.is_deleted = True
         db_file.deleted_at = datetime.utcnow()
+        adjust_group_stats(group_id, -1, -db_file.file_size, [(db_file.id, 'delete')])
+        
+        db.session.commit()
         
         # Log activity
-        activity = Activity(
+        log_activity(
             user_id=user_id,
             group_id=group_id,
             file_id=file_id,
             activity_type='delete',
             description=f'Deleted "{db_file.original_filename}"'
         )
-        db.session.add(activity)
-        
-        db.session.commit()
         
         return jsonify({'msg': 'File deleted successfully'}), 200
         
@@ -200,65 +1141,76 @@ def delete_file(group_id, file_id):
         return jsonify({'msg': f'Delete failed: {str(e)}'}), 500
 
 @files_bp.route('/stats', methods=['GET'])
+@query_budget(1)
 @jwt_required()
 def get_file_stats():
     user_id = get_jwt_identity()
     
-    # Get user's groups
-    memberships = GroupMembership.query.filter_by(user_id=user_id).all()
-    group_ids = [m.group_id for m in memberships]
+    # Counters for every group the user belongs to, in one indexed read
+    counters = GroupStats.query.join(
+        GroupMembership, GroupMembership.group_id == GroupStats.group_id
+    ).filter(GroupMembership.user_id == user_id).all()
     
-    if not group_ids:
-        return jsonify({
-            'total_files': 0,
-            'total_size': 0,
-            'files_by_group': {}
-        })
-    
-    # Get file statistics
-    files = File.query.filter(
-        File.group_id.in_(group_ids),
-        File.is_deleted == False
-    ).all()
-    
-    total_files = len(files)
-    total_size = sum(f.file_size for f in files)
-    
-    # Group files by group
     files_by_group = {}
-    for file in files:
-        if file.group_id not in files_by_group:
-            files_by_group[file.group_id] = {
-                'count': 0,
-                'size': 0
+    for stats in counters:
+        if stats.file_count:
+            files_by_group[stats.group_id] = {
+                'count': stats.file_count,
+                'size': stats.total_bytes
             }
-        files_by_group[file.group_id]['count'] += 1
-        files_by_group[file.group_id]['size'] += file.file_size
     
     return jsonify({
-        'total_files': total_files,
-        'total_size': total_size,
+        'total_files': sum(stats.file_count for stats in counters),
+        'total_size': sum(stats.total_bytes for stats in counters),
         'files_by_group': files_by_group
     })
 
 @files_bp.route('/recent-activity', methods=['GET'])
+@query_budget(2)
 @jwt_required()
 def get_recent_activity():
+    """One page of activity across the caller's groups, newest first.
+    
+    Query parameters: ``limit``, ``cursor`` (the ``next_cursor`` of the
+    previous page) and ``group_id`` to restrict the feed to one group.
+    """
     user_id = get_jwt_identity()
     
-    # Get user's groups
-    memberships = GroupMembership.query.filter_by(user_id=user_id).all()
-    group_ids = [m.group_id for m in memberships]
+    limit = page_limit(current_app.config['ACTIVITY_PAGE_SIZE'], current_app.config['ACTIVITY_MAX_PAGE_SIZE'])
+    
+    group_ids = [group_id for (group_id,) in db.session.query(GroupMembership.group_id).filter_by(user_id=user_id)]
+    only_group = request.args.get('group_id', type=int)
+    if only_group is not None:
+        group_ids = [group_id for group_id in group_ids if group_id == only_group]
     
     if not group_ids:
-        return jsonify([])
+        return jsonify({'activities': [], 'next_cursor': None})
+    
+    position = None
+    if request.args.get('cursor'):
+        try:
+            position = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return jsonify({'msg': 'Invalid cursor'}), 400
+    
+    # Seek each group's (group_id, timestamp, id) index separately and merge
+    # the heads: an IN list over the index would have to sort every matching
+    # row, this reads at most limit + 1 rows per group
+    heads = []
+    for group_id in group_ids:
+        head = select(Activity.id, Activity.timestamp).where(Activity.group_id == group_id)
+        if position:
+            head = head.where(tuple_(Activity.timestamp, Activity.id) < position)
+        head = head.order_by(Activity.timestamp.desc(), Activity.id.desc()).limit(limit + 1).subquery()
+        heads.append(select(head.c.id, head.c.timestamp))
+    merged = union_all(*heads).subquery()
+    page_ids = select(merged.c.id).order_by(merged.c.timestamp.desc(), merged.c.id.desc()).limit(limit + 1)
     
-    # Get recent activities
-    activities = Activity.query.filter(
-        Activity.group_id.in_(group_ids)
-    ).options(
+    activities = Activity.query.filter(Activity.id.in_(page_ids)).options(
         joinedload(Activity.user)
-    ).order_by(Activity.timestamp.desc()).limit(20).all()
+    ).order_by(Activity.timestamp.desc(), Activity.id.desc()).all()
+    has_more = len(activities) > limit
+    activities = activities[:limit]
     
     activity_list = []
     for activity in activities:
@@ -267,6 +1219,7 @@ def get_recent_activity():
             'type': activity.activity_type,
             'description': activity.description,
             'timestamp': activity.timestamp.isoformat(),
+            'group_id': activity.group_id,
             'user': {
                 'id': activity.user.id,
                 'username': activity.user.username
@@ -274,4 +1227,89 @@ def get_recent_activity():
             'metadata': activity.activity_data
         })
     
-    return jsonify(activity_list) 
\ No newline at end of file
+    return jsonify({
+        'activities': activity_list,
+        'next_cursor': encode_cursor(activities[-1].timestamp, activities[-1].id) if has_more else None
+    })
+
+@files_bp.route('/search', methods=['GET'])
+@query_budget(2)
+@jwt_required()
+def search_files():
+    """Files across the caller's groups whose names match ``q``, newest first.
+    
+    Query parameters: ``q``, ``match`` (``substring``, ``prefix`` or
+    ``token``; see app.search), ``mime_type`` (exact, or a prefix such as
+    ``image/``), ``min_size``/``max_size`` in bytes, ``uploaded_after``/
+    ``uploaded_before`` (ISO 8601), ``group_id``, ``limit`` and ``cursor``
+    (the ``next_cursor`` of the previous page).
+    """
+    user_id = get_jwt_identity()
+    
+    terms = parse_terms(request.args.get('q', ''))
+    if not terms:
+        return jsonify({'msg': 'Search query is required'}), 400
+    mode = request.args.get('match', 'substring')
+    if mode not in MATCH_MODES:
+        return jsonify({'msg': f"match must be one of {', '.join(MATCH_MODES)}"}), 400
+    try:
+        uploaded_after, uploaded_before = (
+            datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+            for name in ('uploaded_after', 'uploaded_before')
+        )
+    except ValueError:
+        return jsonify({'msg': 'Invalid date'}), 400
+    position = None
+    if request.args.get('cursor'):
+        try:
+            position = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return jsonify({'msg': 'Invalid cursor'}), 400
+    
+    limit = page_limit(current_app.config['FILES_PAGE_SIZE'], current_app.config['FILES_MAX_PAGE_SIZE'])
+    
+    group_ids = [group_id for (group_id,) in db.session.query(GroupMembership.group_id).filter_by(user_id=user_id)]
+    only_group = request.args.get('group_id', type=int)
+    if only_group is not None:
+        group_ids = [group_id for group_id in group_ids if group_id == only_group]
+    
+    if not group_ids:
+        return jsonify({'files': [], 'next_cursor': None})
+    
+    query = File.query.filter(
+        File.group_id.in_(group_ids),
+        File.is_deleted == False,
+        *name_filters(terms, mode, db.engine.dialect.name)
+    )
+    
+    mime_type = request.args.get('mime_type')
+    if mime_type:
+        if mime_type.endswith('/'):
+            query = query.filter(File.mime_type.startswith(mime_type, autoescape=True))
+        else:
+            query = query.filter(File.mime_type == mime_type)
+    
+    min_size = request.args.get('min_size', type=int)
+    if min_size is not None:
+        query = query.filter(File.file_size >= min_size)
+    max_size = request.args.get('max_size', type=int)
+    if max_size is not None:
+        query = query.filter(File.file_size <= max_size)
+    if uploaded_after:
+        query = query.filter(File.uploaded_at >= uploaded_after)
+    if uploaded_before:
+        query = query.filter(File.uploaded_at < uploaded_before)
+    
+    if position:
+        query = query.filter(tuple_(File.uploaded_at, File.id) < position)
+    
+    files = query.options(joinedload(File.uploader), joinedload(File.group)).order_by(
+        File.uploaded_at.desc(), File.id.desc()
+    ).limit(limit + 1).all()
+    has_more = len(files) > limit
+    files = files[:limit]
+    
+    return jsonify({
+        'files': [dict(_file_json(file), group={'id': file.group.id, 'name': file.group.name}) for file in files],
+        'next_cursor': encode_cursor(files[-1].uploaded_at, files[-1].id) if has_more else None
+    })
@@ -1,13 +1,19 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy.orm import joinedload
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 from .. import db
-from ..models import User, Group, GroupMembership, Activity
+from ..activity import log_activity
+from ..authz import get_role, membership_cache
+from ..models import (User, Group, GroupMembership, GroupStats, File, FileChange, Activity, ActivityRollup,
+                      UploadSession, UploadPart)
+from ..queries import query_budget
 from datetime import datetime
 
 groups_bp = Blueprint('groups', __name__)
 
 @groups_bp.route('/', methods=['POST'])
+@query_budget(6)
 @jwt_required()
 def create_group():
     data = request.json
@@ -34,17 +40,17 @@ def create_group():
         role='owner'
     )
     db.session.add(membership)
+    db.session.add(GroupStats(group_id=group.id))
+    
+    db.session.commit()
     
     # Log activity
-    activity = Activity(
+    log_activity(
         user_id=user_id,
         group_id=group.id,
         activity_type='group_created',
         description=f'Created group "{group.name}"'
     )
-    db.session.add(activity)
-    
-    db.session.commit()
     
     return jsonify({
         'msg': 'Group created', 
@@ -58,29 +64,59 @@ def create_group():
     }), 201
 
 @groups_bp.route('/my', methods=['GET'])
+@query_budget(2)
 @jwt_required()
 def my_groups():
     user_id = get_jwt_identity()
-    memberships = GroupMembership.query.filter_by(user_id=user_id).options(
-        joinedload(GroupMembership.group).joinedload(Group.memberships).joinedload(GroupMembership.user),
-        joinedload(GroupMembership.group).joinedload(Group.files)
+    
+    my_group_ids = db.session.query(GroupMembership.group_id).filter(
+        GroupMembership.user_id == user_id
+    ).scalar_subquery()
+    
+    member_counts = db.session.query(
+        GroupMembership.group_id,
+        func.count(GroupMembership.id).label('member_count')
+    ).filter(GroupMembership.group_id.in_(my_group_ids)).group_by(GroupMembership.group_id).subquery()
+    
+    # One row per group with its counts; file counts come from GroupStats
+    rows = db.session.query(
+        GroupMembership.role,
+        Group,
+        member_counts.c.member_count,
+        func.coalesce(GroupStats.file_count, 0)
+    ).join(Group, Group.id == GroupMembership.group_id).join(
+        member_counts, member_counts.c.group_id == Group.id
+    ).outerjoin(GroupStats, GroupStats.group_id == Group.id).filter(
+        GroupMembership.user_id == user_id
     ).all()
     
-    groups = []
-    for membership in memberships:
-        group = membership.group
-        member_count = len(group.memberships)
-        file_count = len([f for f in group.files if not f.is_deleted])
-        
-        # Get member details for display
-        members = []
-        for member_membership in group.memberships[:5]:  # Limit to 5 members for display
-            members.append({
-                'id': member_membership.user.id,
-                'username': member_membership.user.username,
-                'role': member_membership.role
+    # First 5 members of every group for display, in a single query
+    members_by_group = {}
+    if rows:
+        ranked = db.session.query(
+            GroupMembership.group_id,
+            GroupMembership.role,
+            User.id.label('user_id'),
+            User.username,
+            func.row_number().over(
+                partition_by=GroupMembership.group_id,
+                order_by=GroupMembership.id
+            ).label('position')
+        ).join(User, User.id == GroupMembership.user_id).filter(
+            GroupMembership.group_id.in_([group.id for _, group, _, _ in rows])
+        ).subquery()
+        preview = db.session.query(ranked).filter(ranked.c.position <= 5).order_by(
+            ranked.c.group_id, ranked.c.position
+        ).all()
+        for member in preview:
+            members_by_group.setdefault(member.group_id, []).append({
+                'id': member.user_id,
+                'username': member.username,
+                'role': member.role
             })
-        
+    
+    groups = []
+    for role, group, member_count, file_count in rows:
         groups.append({
             'id': group.id,
             'name': group.name,
@@ -88,26 +124,28 @@ def my_groups():
             'created_at': group.created_at.isoformat(),
             'member_count': member_count,
             'file_count': file_count,
-            'role': membership.role,
-            'members': members
+            'role': role,
+            'members': members_by_group.get(group.id, [])
         })
     
     return jsonify(groups)
 
 @groups_bp.route('/<int:group_id>', methods=['GET'])
+@query_budget(3)
 @jwt_required()
 def get_group(group_id):
-    user_id = get_jwt_identity()
-    membership = GroupMembership.query.filter_by(user_id=user_id, group_id=group_id).first()
+    role = get_role(get_jwt_identity(), group_id)
     
-    if not membership:
+    if not role:
         return jsonify({'msg': 'Not a group member'}), 403
     
-    group = Group.query.get(group_id)
+    group = Group.query.options(
+        selectinload(Group.memberships).joinedload(GroupMembership.user)
+    ).get(group_id)
     if not group:
         return jsonify({'msg': 'Group not found'}), 404
     
-    # Get all members with details
+    # Get all members with details (loaded above, users included)
     members = []
     for member_membership in group.memberships:
         members.append({
@@ -123,18 +161,18 @@ def get_group(group_id):
         'description': group.description,
         'created_at': group.created_at.isoformat(),
         'members': members,
-        'your_role': membership.role
+        'your_role': role
     })
 
 @groups_bp.route('/<int:group_id>/add_user', methods=['POST'])
+@query_budget(5)
 @jwt_required()
 def add_user(group_id):
     user_id = get_jwt_identity()
     data = request.json
     
     # Check if user is admin or owner
-    membership = GroupMembership.query.filter_by(user_id=user_id, group_id=group_id).first()
-    if not membership or membership.role not in ['admin', 'owner']:
+    if get_role(user_id, group_id) not in ['admin', 'owner']:
         return jsonify({'msg': 'Insufficient permissions'}), 403
     
     if not data.get('username'):
@@ -154,27 +192,27 @@ def add_user(group_id):
     )
     db.session.add(new_membership)
     
+    db.session.commit()
+    membership_cache.invalidate(user_to_add.id, group_id)
+    
     # Log activity
-    activity = Activity(
+    log_activity(
         user_id=user_id,
         group_id=group_id,
         activity_type='user_joined',
         description=f'Added {user_to_add.username} to group'
     )
-    db.session.add(activity)
-    
-    db.session.commit()
     return jsonify({'msg': 'User added to group'}), 200
 
 @groups_bp.route('/<int:group_id>/remove_user', methods=['POST'])
+@query_budget(5)
 @jwt_required()
 def remove_user(group_id):
     user_id = get_jwt_identity()
     data = request.json
     
     # Check if user is admin or owner
-    membership = GroupMembership.query.filter_by(user_id=user_id, group_id=group_id).first()
-    if not membership or membership.role not in ['admin', 'owner']:
+    if get_role(user_id, group_id) not in ['admin', 'owner']:
         return jsonify({'msg': 'Insufficient permissions'}), 403
     
     if not data.get('username'):
@@ -196,44 +234,56 @@ def remove_user(group_id):
     
     db.session.delete(member_membership)
     
+    db.session.commit()
+    membership_cache.invalidate(user_to_remove.id, group_id)
+    
     # Log activity
-    activity = Activity(
+    log_activity(
         user_id=user_id,
         group_id=group_id,
         activity_type='user_removed',
         description=f'Removed {user_to_remove.username} from group'
     )
-    db.session.add(activity)
-    
-    db.session.commit()
     return jsonify({'msg': 'User removed from group'}), 200
 
 @groups_bp.route('/<int:group_id>', methods=['DELETE'])
+@query_budget(13)
 @jwt_required()
 def delete_group(group_id):
     user_id = get_jwt_identity()
     
     # Check if user is owner
-    membership = GroupMembership.query.filter_by(user_id=user_id, group_id=group_id).first()
-    if not membership or membership.role != 'owner':
+    if get_role(user_id, group_id) != 'owner':
         return jsonify({'msg': 'Only group owners can delete groups'}), 403
     
     group = Group.query.get(group_id)
     if not group:
         return jsonify({'msg': 'Group not found'}), 404
     
-    # Delete all memberships
+    # Delete all memberships and the group's counters and change log
     GroupMembership.query.filter_by(group_id=group_id).delete()
-    
-    # Mark all files as deleted
-    from ..models import File
-    files = File.query.filter_by(group_id=group_id).all()
-    for file in files:
-        file.is_deleted = True
-        file.deleted_at = datetime.utcnow()
+    GroupStats.query.filter_by(group_id=group_id).delete()
+    FileChange.query.filter_by(group_id=group_id).delete()
+    
+    # Soft-delete and detach all files in one statement; the purge worker
+    # removes them once the grace period is over
+    File.query.filter_by(group_id=group_id).update({
+        File.is_deleted: True,
+        File.deleted_at: func.coalesce(File.deleted_at, datetime.utcnow()),
+        File.group_id: None
+    }, synchronize_session=False)
+    Activity.query.filter_by(group_id=group_id).update({Activity.group_id: None}, synchronize_session=False)
+    ActivityRollup.query.filter_by(group_id=group_id).update({ActivityRollup.group_id: None},
+                                                             synchronize_session=False)
+    
+    # Unfinished uploads are dropped; MinIO expires their stale parts
+    session_ids = db.session.query(UploadSession.id).filter_by(group_id=group_id)
+    UploadPart.query.filter(UploadPart.session_id.in_(session_ids)).delete(synchronize_session=False)
+    UploadSession.query.filter_by(group_id=group_id).delete(synchronize_session=False)
     
     # Delete the group
     db.session.delete(group)
     db.session.commit()
+    membership_cache.invalidate_group(group_id)
     
     return jsonify({'msg': 'Group deleted'}), 200 
\ No newline at end of file
@@ -0,0 +1,98 @@
+# Indexed filename search: a pg_trgm index on Postgres, an FTS5 trigram
+# table on SQLite
+import re
+from sqlalchemy import column, event, func, select, table, text
+from .models import File
+
+MATCH_MODES = ('substring', 'prefix', 'token')
+
+# Trigram indexes can only narrow a search by terms of this length or more
+MIN_INDEXED_TERM = 3
+
+_POSTGRES_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    # Serves LIKE and regex matches on the lowered name; every filter below
+    # is written against lower(original_filename) so the planner can use it
+    'CREATE INDEX IF NOT EXISTS ix_file_name_trgm ON file USING gin (lower(original_filename) gin_trgm_ops)'
+]
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS file_name_fts USING fts5("
+    "original_filename, content='file', content_rowid='id', tokenize='trigram case_sensitive 0')",
+    "INSERT INTO file_name_fts(file_name_fts) VALUES ('rebuild')",
+    "CREATE TRIGGER IF NOT EXISTS file_name_fts_ai AFTER INSERT ON file BEGIN "
+    "INSERT INTO file_name_fts(rowid, original_filename) VALUES (new.id, new.original_filename); END",
+    "CREATE TRIGGER IF NOT EXISTS file_name_fts_ad AFTER DELETE ON file BEGIN "
+    "INSERT INTO file_name_fts(file_name_fts, rowid, original_filename) "
+    "VALUES ('delete', old.id, old.original_filename); END",
+    "CREATE TRIGGER IF NOT EXISTS file_name_fts_au AFTER UPDATE OF original_filename ON file BEGIN "
+    "INSERT INTO file_name_fts(file_name_fts, rowid, original_filename) "
+    "VALUES ('delete', old.id, old.original_filename); "
+    "INSERT INTO file_name_fts(rowid, original_filename) VALUES (new.id, new.original_filename); END"
+]
+
+_fts = table('file_name_fts', column('rowid'), column('file_name_fts'))
+
+
+def install_search_index(connection):
+    """Create the filename index for the connection's database. Idempotent;
+    runs after ``create_all`` creates the file table, and from migrate.py
+    for existing databases."""
+    statements = {'postgresql': _POSTGRES_DDL, 'sqlite': _SQLITE_DDL}.get(connection.dialect.name, [])
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def _drop_search_index(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS file_name_fts'))
+
+
+def _create_search_index(target, connection, **kw):
+    install_search_index(connection)
+
+
+event.listen(File.__table__, 'after_create', _create_search_index)
+event.listen(File.__table__, 'before_drop', _drop_search_index)
+
+
+def parse_terms(query):
+    """Lowercased whitespace-separated terms of a search query."""
+    return query.lower().split()
+
+
+def _glob_escape(term):
+    return re.sub(r'([*?\[])', r'[\1]', term)
+
+
+def _regex_escape(term):
+    # Postgres AREs treat a backslash before any non-alphanumeric as literal
+    return re.sub(r'([^a-z0-9])', r'\\\1', term)
+
+
+def name_filters(terms, mode, dialect):
+    """WHERE clauses matching File.original_filename against ``terms``.
+
+    ``substring``: every term appears anywhere in the name. ``prefix``: the
+    name starts with the terms as typed. ``token``: every term starts a word
+    of the name, words being split on anything but letters and digits.
+    """
+    name = func.lower(File.original_filename)
+    if mode == 'prefix':
+        clauses = [name.startswith(' '.join(terms), autoescape=True)]
+    elif mode == 'token' and dialect == 'postgresql':
+        clauses = [name.op('~')(f'(^|[^[:alnum:]]){_regex_escape(term)}') for term in terms]
+    elif mode == 'token':
+        clauses = [name.op('GLOB')(f'{_glob_escape(term)}*') | name.op('GLOB')(f'*[^a-z0-9]{_glob_escape(term)}*')
+                   for term in terms]
+    else:
+        clauses = [name.contains(term, autoescape=True) for term in terms]
+
+    # The predicates above check each name exactly; on SQLite the FTS table
+    # narrows the rows they are checked against (pg_trgm serves them directly)
+    phrases = [' '.join(terms)] if mode == 'prefix' else terms
+    indexed = [phrase for phrase in phrases if len(phrase) >= MIN_INDEXED_TERM]
+    if dialect == 'sqlite' and indexed:
+        match = ' AND '.join('"{}"'.format(phrase.replace('"', '""')) for phrase in indexed)
+        clauses.append(File.id.in_(select(_fts.c.rowid).where(_fts.c.file_name_fts.op('MATCH')(match))))
+    return clauses
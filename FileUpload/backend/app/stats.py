@@ -0,0 +1,123 @@
+# Incrementally maintained per-group storage counters and change sequence
+from datetime import datetime
+from sqlalchemy import and_, exists, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import File, FileChange, Group, GroupStats
+
+
+def _group_totals(group_id):
+    return db.session.query(func.count(File.id), func.coalesce(func.sum(File.file_size), 0)).filter(
+        File.group_id == group_id,
+        File.is_deleted == False
+    ).one()
+
+
+def _record_changes(group_id, last_seq, changes):
+    first = last_seq - len(changes) + 1
+    db.session.execute(insert(FileChange), [
+        {'group_id': group_id, 'seq': first + i, 'file_id': file_id, 'change': change,
+         'changed_at': datetime.utcnow()}
+        for i, (file_id, change) in enumerate(changes)
+    ])
+
+
+def adjust_group_stats(group_id, files, size, changes=()):
+    """Apply a file count/byte delta to a group's counters and log
+    ``changes`` (``[(file_id, 'add' | 'delete')]``) under the group's next
+    change sequence numbers.
+
+    Call after the File change has been made in the current transaction so
+    the counters commit (or roll back) together with it. The UPDATE locks
+    the group's counter row until commit, so sequence numbers become
+    visible in order.
+    """
+    values = {
+        GroupStats.file_count: GroupStats.file_count + files,
+        GroupStats.total_bytes: GroupStats.total_bytes + size,
+        GroupStats.updated_at: datetime.utcnow()
+    }
+    if changes:
+        values[GroupStats.change_seq] = GroupStats.change_seq + len(changes)
+    last_seq = db.session.execute(
+        update(GroupStats).where(GroupStats.group_id == group_id).values(values)
+        .returning(GroupStats.change_seq).execution_options(synchronize_session=False)
+    ).scalar()
+    if last_seq is not None:
+        if changes:
+            _record_changes(group_id, last_seq, changes)
+        return
+
+    # No counters yet (group predates the table): seed them from the
+    # group's files, which already include the pending change
+    db.session.flush()
+    file_count, total_bytes = _group_totals(group_id)
+    last_seq = len(changes) + db.session.query(func.coalesce(func.max(FileChange.seq), 0)).filter(
+        FileChange.group_id == group_id).scalar()
+    try:
+        with db.session.begin_nested():
+            db.session.add(GroupStats(group_id=group_id, file_count=file_count, total_bytes=total_bytes,
+                                      change_seq=last_seq))
+    except IntegrityError:
+        # Seeded concurrently by another request; apply our delta to theirs
+        adjust_group_stats(group_id, files, size, changes)
+        return
+    if changes:
+        _record_changes(group_id, last_seq, changes)
+
+
+def seed_group_stats():
+    """Create counters for the groups that have none, with one INSERT ...
+    SELECT over their files. Counters that exist are left alone, so unlike
+    reconcile_group_stats this is safe next to live workers; migrate.py
+    runs it on every start. Returns the number of groups seeded.
+    """
+    change_seq = select(func.coalesce(func.max(FileChange.seq), 0)).where(
+        FileChange.group_id == Group.id).scalar_subquery()
+    totals = select(
+        Group.id,
+        func.count(File.id),
+        func.coalesce(func.sum(File.file_size), 0),
+        change_seq,
+        literal(datetime.utcnow())
+    ).outerjoin(File, and_(File.group_id == Group.id, File.is_deleted == False)).where(
+        ~exists().where(GroupStats.group_id == Group.id)
+    ).group_by(Group.id)
+    try:
+        seeded = db.session.execute(insert(GroupStats).from_select(
+            ['group_id', 'file_count', 'total_bytes', 'change_seq', 'updated_at'], totals
+        )).rowcount
+        db.session.commit()
+    except IntegrityError:
+        # A request seeded one of them meanwhile; adjust_group_stats seeds
+        # any group left without counters on its next change
+        db.session.rollback()
+        return 0
+    return seeded
+
+
+def reconcile_group_stats():
+    """Rebuild every group's counters from the file table with one GROUP BY.
+
+    Returns the number of groups written. Counter updates that race with
+    the rebuild may be lost, so run it when uploads are quiet: it is a
+    one-off repair (``flask reconcile-stats``), not part of migrations.
+    """
+    totals = db.session.query(
+        Group.id,
+        func.count(File.id),
+        func.coalesce(func.sum(File.file_size), 0)
+    ).outerjoin(File, and_(File.group_id == Group.id, File.is_deleted == False)).group_by(Group.id).all()
+
+    # The change sequence continues from the log rather than restarting
+    change_seqs = dict(db.session.query(FileChange.group_id, func.max(FileChange.seq)).group_by(FileChange.group_id))
+
+    now = datetime.utcnow()
+    GroupStats.query.delete(synchronize_session=False)
+    db.session.add_all([
+        GroupStats(group_id=group_id, file_count=file_count, total_bytes=total_bytes,
+                   change_seq=change_seqs.get(group_id, 0), updated_at=now)
+        for group_id, file_count, total_bytes in totals
+    ])
+    db.session.commit()
+    return len(totals)
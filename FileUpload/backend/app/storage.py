@@ -0,0 +1,329 @@
+# Object storage backends: MinIO/S3, or a directory on the local filesystem
+import hashlib
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+from minio.commonconfig import ComposeSource
+from minio.datatypes import Part
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_fdatasync = getattr(os, 'fdatasync', os.fsync)  # not available on macOS
+
+
+class ObjectNotFound(Exception):
+    pass
+
+
+class ObjectStat:
+    def __init__(self, size, etag, last_modified, content_type=None):
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+
+
+class StorageBackend:
+    """Operations the routes need from an object store.
+
+    ``open()`` returns a reader with ``stream(chunk_size)``, ``read()``,
+    ``close()`` and ``release_conn()``, like a MinIO response. Keys are
+    ``/``-separated relative paths.
+    """
+    supports_presign = False
+
+    def put(self, key, stream, length=-1, content_type=None):
+        """Store ``length`` bytes from ``stream`` (all of it when -1)."""
+        raise NotImplementedError
+
+    def open(self, key, offset=0, length=None):
+        raise NotImplementedError
+
+    def stat(self, key):
+        """Return an ObjectStat, or raise ObjectNotFound."""
+        raise NotImplementedError
+
+    def copy(self, source, key):
+        raise NotImplementedError
+
+    def delete(self, keys):
+        """Delete ``keys``; return ``(key, message)`` for each that failed.
+        Keys that do not exist are not failures."""
+        raise NotImplementedError
+
+    def list(self, prefix):
+        """Yield ``(key, last_modified)`` for every object under ``prefix``."""
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Filesystem path of the object if it can be served directly."""
+        return None
+
+    def presigned_put(self, key, expires):
+        raise NotImplementedError
+
+    def presigned_get(self, key, expires, response_headers=None):
+        raise NotImplementedError
+
+    def create_multipart(self, key, content_type):
+        """Start a multipart upload and return its upload id."""
+        raise NotImplementedError
+
+    def upload_part(self, key, upload_id, part_number, data):
+        """Store one part and return its ETag."""
+        raise NotImplementedError
+
+    def complete_multipart(self, key, upload_id, parts):
+        """Assemble ``(part_number, etag)`` pairs, in order, into ``key``."""
+        raise NotImplementedError
+
+    def abort_multipart(self, key, upload_id):
+        """Discard the upload's parts; an upload already gone is not an error."""
+        raise NotImplementedError
+
+
+class MinioStorage(StorageBackend):
+    supports_presign = True
+
+    def __init__(self, client, bucket, presign_client=None, part_size=8 * 1024 * 1024):
+        self.client = client
+        self.bucket = bucket
+        self.presign_client = presign_client or client
+        self.part_size = part_size
+
+    def put(self, key, stream, length=-1, content_type=None):
+        self.client.put_object(
+            self.bucket,
+            key,
+            stream,
+            length=length,
+            content_type=content_type or 'application/octet-stream',
+            part_size=self.part_size
+        )
+
+    def open(self, key, offset=0, length=None):
+        return self.client.get_object(self.bucket, key, offset=offset, length=length or 0)
+
+    def stat(self, key):
+        try:
+            return self.client.stat_object(self.bucket, key)
+        except S3Error as e:
+            if e.code in ('NoSuchKey', 'NotFound'):
+                raise ObjectNotFound(key) from e
+            raise
+
+    def copy(self, source, key):
+        # compose_object rather than copy_object, which is limited to 5 GiB
+        self.client.compose_object(self.bucket, key, [ComposeSource(self.bucket, source)])
+
+    def delete(self, keys):
+        if not keys:
+            return []
+        # remove_objects is lazy: errors only surface while iterating
+        errors = self.client.remove_objects(self.bucket, [DeleteObject(key) for key in keys])
+        return [(error.name, error.message) for error in errors]
+
+    def list(self, prefix):
+        for obj in self.client.list_objects(self.bucket, prefix=prefix, recursive=True):
+            yield obj.object_name, obj.last_modified
+
+    def presigned_put(self, key, expires):
+        return self.presign_client.presigned_put_object(self.bucket, key, expires=expires)
+
+    def presigned_get(self, key, expires, response_headers=None):
+        return self.presign_client.presigned_get_object(self.bucket, key, expires=expires,
+                                                        response_headers=response_headers)
+
+    # minio-py has no public API for client-driven multipart uploads; these
+    # wrap its private helpers, whose signatures test_storage pins down
+    def create_multipart(self, key, content_type):
+        return self.client._create_multipart_upload(self.bucket, key,
+                                                    {'Content-Type': content_type or 'application/octet-stream'})
+
+    def upload_part(self, key, upload_id, part_number, data):
+        return self.client._upload_part(self.bucket, key, data, None, upload_id, part_number)
+
+    def complete_multipart(self, key, upload_id, parts):
+        self.client._complete_multipart_upload(self.bucket, key, upload_id,
+                                               [Part(number, etag) for number, etag in parts])
+
+    def abort_multipart(self, key, upload_id):
+        try:
+            self.client._abort_multipart_upload(self.bucket, key, upload_id)
+        except S3Error as e:
+            if e.code != 'NoSuchUpload':
+                raise
+
+
+class _FileReader:
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, amt=None):
+        if self.remaining is not None:
+            amt = self.remaining if amt is None or amt < 0 else min(amt, self.remaining)
+        data = self.file.read(-1 if amt is None else amt)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def stream(self, amt=COPY_CHUNK_SIZE):
+        return iter(lambda: self.read(amt), b'')
+
+    def close(self):
+        self.file.close()
+
+    def release_conn(self):
+        pass
+
+
+class LocalStorage(StorageBackend):
+    """Objects as files under ``root``, for single-node deployments and tests.
+
+    Writes go to a temporary file that is renamed into place, so readers
+    never see partial objects. Data is fdatasync'ed every ``fsync_bytes``
+    while streaming (0 leaves it to the final fsync) to keep the page cache
+    from building up a large burst of dirty pages.
+    """
+
+    def __init__(self, root, fsync_bytes=64 * 1024 * 1024):
+        self.root = os.path.abspath(root)
+        self.fsync_bytes = fsync_bytes
+        self._uploads = os.path.join(self.root, '.uploads')
+        os.makedirs(self._uploads, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        relative = os.path.relpath(path, self.root)
+        # Dot names are reserved for temporary files and multipart uploads
+        if relative.startswith('..') or any(part.startswith('.') for part in relative.split(os.sep)):
+            raise ValueError(f'Invalid object key: {key}')
+        return path
+
+    def _write(self, path, chunks):
+        """Atomically write ``chunks`` to ``path``; returns the MD5 hex digest."""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f'.{uuid.uuid4().hex}.tmp')
+        md5 = hashlib.md5()
+        try:
+            with open(tmp_path, 'wb') as out:
+                unsynced = 0
+                for chunk in chunks:
+                    out.write(chunk)
+                    md5.update(chunk)
+                    unsynced += len(chunk)
+                    if self.fsync_bytes and unsynced >= self.fsync_bytes:
+                        out.flush()
+                        _fdatasync(out.fileno())
+                        unsynced = 0
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._sync_directory(directory)
+        return md5.hexdigest()
+
+    def _sync_directory(self, directory):
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def put(self, key, stream, length=-1, content_type=None):
+        self._write(self._path(key), _FileReader(stream, None if length < 0 else length).stream())
+
+    def open(self, key, offset=0, length=None):
+        try:
+            file = open(self._path(key), 'rb')
+        except FileNotFoundError as e:
+            raise ObjectNotFound(key) from e
+        file.seek(offset)
+        return _FileReader(file, length)
+
+    def stat(self, key):
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError as e:
+            raise ObjectNotFound(key) from e
+        return ObjectStat(
+            size=st.st_size,
+            etag=f'{st.st_mtime_ns:x}-{st.st_size:x}',
+            last_modified=datetime.fromtimestamp(st.st_mtime, timezone.utc).replace(microsecond=0)
+        )
+
+    def copy(self, source, key):
+        # A hard link shares the data blocks, so "copying" costs no I/O
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f'.{uuid.uuid4().hex}.tmp')
+        os.link(self._path(source), tmp_path)
+        os.replace(tmp_path, path)
+
+    def delete(self, keys):
+        errors = []
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                errors.append((key, str(e)))
+        return errors
+
+    def list(self, prefix):
+        top = os.path.join(self.root, prefix)
+        for directory, dirnames, filenames in os.walk(top):
+            # Skip temporary files and multipart uploads
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                yield key, datetime.fromtimestamp(mtime, timezone.utc)
+
+    def local_path(self, key):
+        return self._path(key)
+
+    def _upload_dir(self, upload_id):
+        if not upload_id.isalnum():
+            raise ValueError(f'Invalid upload id: {upload_id}')
+        return os.path.join(self._uploads, upload_id)
+
+    def create_multipart(self, key, content_type):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_dir(upload_id))
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, data):
+        directory = self._upload_dir(upload_id)
+        if not os.path.isdir(directory):
+            raise ObjectNotFound(upload_id)
+        return self._write(os.path.join(directory, str(part_number)), [data])
+
+    def complete_multipart(self, key, upload_id, parts):
+        directory = self._upload_dir(upload_id)
+
+        def chunks():
+            for number, _ in parts:
+                with open(os.path.join(directory, str(number)), 'rb') as part:
+                    yield from iter(lambda: part.read(COPY_CHUNK_SIZE), b'')
+
+        self._write(self._path(key), chunks())
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def abort_multipart(self, key, upload_id):
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
@@ -0,0 +1,88 @@
+# Helpers for streaming object data to and from MinIO without buffering it
+import hashlib
+from flask import request
+from werkzeug.http import http_date
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+
+def iter_object(response, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield a MinIO response body in bounded chunks and always hand the
+    connection back to the urllib3 pool, even if the client disconnects."""
+    try:
+        for chunk in response.stream(chunk_size):
+            yield chunk
+    finally:
+        response.close()
+        response.release_conn()
+
+
+class HashingReader:
+    """File-like wrapper that counts and SHA-256 hashes bytes as they are read."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        self._sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+
+def validators(stat):
+    """ETag/Last-Modified response headers for a stat_object result."""
+    headers = {'Accept-Ranges': 'bytes'}
+    if stat.etag:
+        headers['ETag'] = f'"{stat.etag}"'
+    if stat.last_modified:
+        headers['Last-Modified'] = http_date(stat.last_modified)
+    return headers
+
+
+def is_not_modified(stat):
+    """True if the request's conditional headers match the stored object."""
+    if request.if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 7232 6)
+        return bool(stat.etag) and request.if_none_match.contains_weak(stat.etag)
+    if request.if_modified_since and stat.last_modified:
+        return stat.last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def _if_range_matches(stat):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        # If-Range requires a strong comparison
+        return bool(stat.etag) and if_range.etag == stat.etag
+    if if_range.date is not None:
+        return (stat.last_modified is not None and
+                stat.last_modified.replace(microsecond=0) == if_range.date)
+    return True
+
+
+def requested_range(stat):
+    """Resolve the request's Range header against the stored object.
+
+    Returns ``None`` when the whole object should be sent, ``(start, stop)``
+    for a single satisfiable range and raises ``ValueError`` when the range
+    cannot be satisfied. Multi-range requests are served as a full response.
+    """
+    rng = request.range
+    if rng is None or rng.units != 'bytes' or len(rng.ranges) != 1:
+        return None
+    if not _if_range_matches(stat):
+        return None
+    start, stop = rng.ranges[0]
+    if start < 0:
+        # Suffix range; a suffix longer than the object means all of it
+        start = max(stat.size + start, 0)
+    stop = stat.size if stop is None else min(stop, stat.size)
+    if start >= stop:
+        raise ValueError('Range not satisfiable')
+    return start, stop
@@ -0,0 +1,200 @@
+# Thumbnail generation: upload transactions queue a ThumbnailJob, and
+# `flask generate-thumbnails` renders them in a process pool
+import io
+import logging
+import os
+import shutil
+import tempfile
+from collections import deque
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import insert
+from . import db
+from .compression import COPY_CHUNK_SIZE, open_decoded
+from .models import File, ThumbnailJob
+from .storage import ObjectNotFound
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_CONTENT_TYPE = 'image/webp'
+
+# What Pillow decodes out of the box, plus PDFs via pdfium
+THUMBNAIL_SOURCE_TYPES = {
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff', 'application/pdf'
+}
+
+# Seconds before retrying a failed render; doubles with each attempt
+RETRY_DELAY = 30
+
+
+def supports_thumbnail(mime_type):
+    return mime_type in THUMBNAIL_SOURCE_TYPES
+
+
+def thumbnail_key(source_key, size):
+    """Derived object key of the ``size`` thumbnail of ``source_key``. Files
+    sharing a blob share the thumbnail."""
+    return f'thumbnails/{size}/{source_key}.webp'
+
+
+def queue_thumbnails(files):
+    """Queue a job for each ``(file_id, mime_type)`` that can have a
+    thumbnail. Call in the transaction that creates the files, so a job
+    exists exactly when its file does."""
+    if not current_app.config['THUMBNAILS_ENABLED']:
+        return
+    now = datetime.utcnow()
+    rows = [{'file_id': file_id, 'status': 'queued', 'attempts': 0, 'run_after': now, 'created_at': now}
+            for file_id, mime_type in files if supports_thumbnail(mime_type)]
+    if rows:
+        db.session.execute(insert(ThumbnailJob), rows)
+
+
+def render_thumbnail(path, mime_type, size):
+    """WEBP bytes of the image or PDF at ``path`` scaled to fit in ``size``
+    x ``size``. Runs in the worker's pool processes, which read the source
+    from disk themselves rather than being sent it."""
+    # Imported here: only the thumbnail worker needs the imaging libraries
+    from PIL import Image, ImageOps
+
+    if mime_type == 'application/pdf':
+        import pypdfium2
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            page = pdf[0]
+            image = page.render(scale=size / max(page.get_size())).to_pil()
+        finally:
+            pdf.close()
+        return _encode_thumbnail(image, size)
+
+    with Image.open(path) as image:
+        # Lets JPEG decode at a fraction of full resolution
+        image.draft('RGB', (size, size))
+        return _encode_thumbnail(ImageOps.exif_transpose(image), size)
+
+
+def _encode_thumbnail(image, size):
+    image.thumbnail((size, size))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+    out = io.BytesIO()
+    image.save(out, 'WEBP', quality=80)
+    return out.getvalue()
+
+
+def claim_thumbnail_jobs(limit, lease):
+    """Mark up to ``limit`` due jobs running for ``lease`` and return them.
+
+    A job whose worker died is due again once its lease runs out. On
+    Postgres concurrent workers skip each other's locked rows.
+    """
+    now = datetime.utcnow()
+    jobs = ThumbnailJob.query.filter(
+        ThumbnailJob.status.in_(('queued', 'running')),
+        ThumbnailJob.run_after <= now
+    ).order_by(ThumbnailJob.run_after).limit(limit).with_for_update(skip_locked=True).all()
+    for job in jobs:
+        job.status = 'running'
+        job.attempts += 1
+        job.run_after = now + lease
+    db.session.commit()
+    return jobs
+
+
+def _spool_object(storage, file):
+    """Copy the file's original bytes to a temporary file and return its
+    path, so the source never has to be held in memory."""
+    response = open_decoded(storage, file.minio_key, file.content_encoding)
+    try:
+        with tempfile.NamedTemporaryFile(prefix='thumbnail-', delete=False) as out:
+            try:
+                shutil.copyfileobj(response, out, COPY_CHUNK_SIZE)
+            except BaseException:
+                out.close()
+                os.remove(out.name)
+                raise
+        return out.name
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def _fail(job, error, max_attempts):
+    logger.warning('Thumbnail for file %s failed (attempt %s): %s', job.file_id, job.attempts, error)
+    job.error = str(error)
+    if job.attempts >= max_attempts:
+        job.status = 'failed'
+    else:
+        job.status = 'queued'
+        job.run_after = datetime.utcnow() + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+
+
+def generate_thumbnails(storage, pool=None, size=256, batch_size=8, max_source_bytes=64 * 1024 * 1024,
+                        max_attempts=5, lease=timedelta(minutes=5), max_in_flight=2):
+    """Claim one batch of jobs and render it, in ``pool`` (an executor) or
+    inline when None. Returns ``(done, failed, skipped)``, skipped being
+    jobs for files deleted meanwhile; failed jobs are retried with backoff
+    until ``max_attempts``. Sources are spooled to disk one job at a time,
+    with at most ``max_in_flight`` submitted to the pool at once."""
+    jobs = claim_thumbnail_jobs(batch_size, lease)
+    done = failed = skipped = 0
+
+    todo = []
+    for job in jobs:
+        file = db.session.get(File, job.file_id)
+        if file is None or file.is_deleted:
+            db.session.delete(job)
+            skipped += 1
+            continue
+        key = thumbnail_key(file.minio_key, size)
+        try:
+            # Already there for another file with the same blob, or from a
+            # run that died before recording it
+            storage.stat(key)
+            file.thumbnail_key = key
+            db.session.delete(job)
+            done += 1
+            continue
+        except ObjectNotFound:
+            pass
+        if file.file_size > max_source_bytes:
+            job.attempts = max_attempts
+            _fail(job, f'source is larger than {max_source_bytes} bytes', max_attempts)
+            failed += 1
+            continue
+        todo.append((job, file, key))
+    db.session.commit()
+
+    def finish(job, file, key, path, result):
+        nonlocal done, failed
+        try:
+            thumbnail = result()
+            storage.put(key, io.BytesIO(thumbnail), length=len(thumbnail), content_type=THUMBNAIL_CONTENT_TYPE)
+            file.thumbnail_key = key
+            db.session.delete(job)
+            done += 1
+        except Exception as e:
+            _fail(job, e, max_attempts)
+            failed += 1
+        finally:
+            os.remove(path)
+        db.session.commit()
+
+    running = deque()
+    for job, file, key in todo:
+        try:
+            path = _spool_object(storage, file)
+        except Exception as e:
+            _fail(job, e, max_attempts)
+            failed += 1
+            db.session.commit()
+            continue
+        if pool is None:
+            finish(job, file, key, path, lambda: render_thumbnail(path, file.mime_type, size))
+            continue
+        running.append((job, file, key, path, pool.submit(render_thumbnail, path, file.mime_type, size).result))
+        if len(running) >= max(max_in_flight, 1):
+            finish(*running.popleft())
+    while running:
+        finish(*running.popleft())
+    return done, failed, skipped
@@ -0,0 +1 @@
+# Load-test harness, run with `python -m bench`
@@ -0,0 +1,210 @@
+"""Benchmark the API against a seeded dataset.
+
+    python -m bench run --groups 50 --members 20 --files 200 --concurrency 16 -o before.json
+    python -m bench compare before.json after.json --fail-over 10
+
+By default the app runs in-process on a threaded WSGI server, backed by a
+fresh SQLite file and the local filesystem storage backend, so no MinIO or
+Postgres is needed. Pass --database-url to benchmark Postgres, --storage
+minio to use the MINIO_* settings, and --url to drive an already running
+server that shares the same database and storage.
+
+--server sync|gevent runs gunicorn.conf.py with that worker class instead.
+Slow clients only hold a worker while their transfer outlasts the socket
+buffers, so compare the two with large objects:
+
+    python -m bench run --server sync --file-size 8388608 --files 4 --concurrency 32 \\
+        --stall-ms 200 --scenarios download list_files -o sync.json
+    python -m bench run --server gevent --file-size 8388608 --files 4 --concurrency 32 \\
+        --stall-ms 200 --scenarios download list_files -o gevent.json
+    python -m bench compare sync.json gevent.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from .runner import SCENARIOS, run_scenario
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _start_gunicorn(worker_class, workers):
+    """Serve the app from gunicorn.conf.py with the current environment and
+    return (process, base_url) once it accepts connections."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_WORKER_CLASS=worker_class,
+               WEB_CONCURRENCY=str(workers))
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:create_app()'],
+                               cwd=backend_dir, env=env)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise SystemExit('gunicorn did not start')
+            time.sleep(0.2)
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='filevault-bench-')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('SECRET_KEY', 'bench-secret-key')
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-jwt-secret-key-that-is-long-enough')
+    os.environ['STORAGE_BACKEND'] = args.storage
+    os.environ.setdefault('STORAGE_LOCAL_ROOT', os.path.join(workdir, 'objects'))
+
+    from werkzeug.serving import make_server
+    from app import create_app, db
+    from .seed import seed
+
+    app = create_app()
+    server = process = None
+    try:
+        with app.app_context():
+            if args.database_url:
+                db.drop_all()
+            db.create_all()
+            from app import storage
+            dataset = seed(storage, args.groups, args.members, args.files, users=args.users,
+                           file_size=args.file_size)
+
+        base_url = args.url
+        if args.server != 'in-process':
+            process, base_url = _start_gunicorn(args.server, args.workers)
+        elif not base_url:
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f'http://127.0.0.1:{server.server_port}'
+
+        options = {'file_size': args.file_size, 'stall_ms': args.stall_ms}
+        results = {}
+        for name in args.scenarios:
+            results[name] = run_scenario(base_url, SCENARIOS[name], dataset, args.requests,
+                                         args.concurrency, options)
+            latency = results[name]['latency_ms']
+            print(f"{name:16} {results[name]['throughput_rps']:>9} req/s  p50 {latency['p50']:>8} ms  "
+                  f"p99 {latency['p99']:>8} ms  errors {results[name]['errors']}", file=sys.stderr)
+    finally:
+        if server:
+            server.shutdown()
+        if process:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': _git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'database': os.environ['DATABASE_URL'].split(':', 1)[0],
+        'storage': args.storage,
+        'target': args.url or args.server,
+        'params': {
+            'groups': args.groups, 'members': args.members, 'files': args.files, 'users': args.users,
+            'file_size': args.file_size, 'requests': args.requests, 'concurrency': args.concurrency,
+            'stall_ms': args.stall_ms, 'workers': args.workers if args.server != 'in-process' else None
+        },
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    def change(old, new):
+        return (new - old) / old * 100 if old else 0.0
+
+    regressed = []
+    print(f"{'scenario':16} {'req/s':>20} {'p50 ms':>22} {'p99 ms':>22}")
+    for name, new in candidate['results'].items():
+        old = baseline['results'].get(name)
+        if not old:
+            continue
+        cells = []
+        for old_value, new_value in ((old['throughput_rps'], new['throughput_rps']),
+                                     (old['latency_ms']['p50'], new['latency_ms']['p50']),
+                                     (old['latency_ms']['p99'], new['latency_ms']['p99'])):
+            cells.append(f'{old_value:>8} -> {new_value:<8} {change(old_value, new_value):+6.1f}%')
+        print(f'{name:16} ' + '  '.join(cells))
+        if args.fail_over is not None and change(old['latency_ms']['p99'], new['latency_ms']['p99']) > args.fail_over:
+            regressed.append(name)
+
+    if baseline.get('params') != candidate.get('params'):
+        print('warning: runs used different parameters', file=sys.stderr)
+    if regressed:
+        print(f"p99 regressed by more than {args.fail_over}%: {', '.join(regressed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='seed a dataset and benchmark it')
+    run_parser.add_argument('--groups', type=int, default=20)
+    run_parser.add_argument('--members', type=int, default=10)
+    run_parser.add_argument('--files', type=int, default=100, help='files per group')
+    run_parser.add_argument('--users', type=int, default=None, help='user pool size (default: members * 4)')
+    run_parser.add_argument('--file-size', type=int, default=16 * 1024)
+    run_parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    run_parser.add_argument('--database-url', help='benchmark this database (its tables are recreated)')
+    run_parser.add_argument('--storage', choices=['local', 'minio'], default='local')
+    run_parser.add_argument('--url', help='drive this server instead of an in-process one')
+    run_parser.add_argument('--server', choices=['in-process', 'sync', 'gevent'], default='in-process',
+                            help='serve with gunicorn using this worker class')
+    run_parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    run_parser.add_argument('--stall-ms', type=int, default=0,
+                            help='make every client pause this long mid-request, like a slow link')
+    run_parser.add_argument('-o', '--output', help='write the JSON report here instead of stdout')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two JSON reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--fail-over', type=float, default=None,
+                                help='exit 1 if any p99 regresses by more than this percentage')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# Drive the seeded app over HTTP and summarise latency per scenario
+import http.client
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+
+def _multipart(filename, data):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def upload(dataset, rng, options):
+    token, group_id = dataset.pick(rng)
+    body, content_type = _multipart('bench_upload.bin', os.urandom(options['file_size']))
+    return 'POST', f'/api/files/{group_id}/upload', token, body, content_type
+
+
+def download(dataset, rng, options):
+    token, group_id = dataset.pick(rng)
+    file_id = rng.choice(dataset.group_files[group_id])
+    return 'GET', f'/api/files/{group_id}/download/{file_id}', token, None, None
+
+
+def list_files(dataset, rng, options):
+    token, group_id = dataset.pick(rng)
+    return 'GET', f'/api/files/{group_id}/list', token, None, None
+
+
+def my_groups(dataset, rng, options):
+    token, _ = dataset.pick(rng)
+    return 'GET', '/api/groups/my', token, None, None
+
+
+def stats(dataset, rng, options):
+    token, _ = dataset.pick(rng)
+    return 'GET', '/api/files/stats', token, None, None
+
+
+def recent_activity(dataset, rng, options):
+    token, _ = dataset.pick(rng)
+    return 'GET', '/api/files/recent-activity', token, None, None
+
+
+SCENARIOS = {
+    'upload': upload,
+    'download': download,
+    'list_files': list_files,
+    'my_groups': my_groups,
+    'stats': stats,
+    'recent_activity': recent_activity
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(base_url, build_request, dataset, requests, concurrency, options, rng_seed=0):
+    """Issue ``requests`` requests from ``concurrency`` keep-alive connections.
+    Returns throughput, latency percentiles (ms) and the error count.
+
+    With ``options['stall_ms']`` every client acts like a slow one: it
+    pauses between its headers and body, or after the first 64KB of a
+    response, while the server holds the request open.
+    """
+    target = urlsplit(base_url)
+    stall = options.get('stall_ms', 0) / 1000
+    remaining = [requests]
+    lock = threading.Lock()
+    latencies, errors, received = [], [0], [0]
+
+    def worker(index):
+        rng = random.Random(rng_seed * 1000 + index)
+        conn = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+        try:
+            while True:
+                with lock:
+                    if remaining[0] == 0:
+                        return
+                    remaining[0] -= 1
+                method, path, token, body, content_type = build_request(dataset, rng, options)
+                headers = {'Authorization': f'Bearer {token}'}
+                if content_type:
+                    headers['Content-Type'] = content_type
+                start = time.perf_counter()
+                try:
+                    if stall:
+                        headers['Content-Length'] = str(len(body or b''))
+                        conn.putrequest(method, path)
+                        for name, value in headers.items():
+                            conn.putheader(name, value)
+                        conn.endheaders()
+                        if body:
+                            time.sleep(stall)
+                            conn.send(body)
+                        response = conn.getresponse()
+                        data = response.read(64 * 1024)
+                        if not body:
+                            time.sleep(stall)
+                        size = len(data) + len(response.read())
+                    else:
+                        conn.request(method, path, body=body, headers=headers)
+                        response = conn.getresponse()
+                        size = len(response.read())
+                    ok = response.status < 400
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    size, ok = 0, False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    received[0] += size
+                    if not ok:
+                        errors[0] += 1
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'concurrency': concurrency,
+        'seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'received_bytes': received[0],
+        'latency_ms': {
+            'mean': round(sum(ms) / len(ms), 3) if ms else None,
+            'p50': round(percentile(ms, 50), 3) if ms else None,
+            'p90': round(percentile(ms, 90), 3) if ms else None,
+            'p99': round(percentile(ms, 99), 3) if ms else None,
+            'max': round(ms[-1], 3) if ms else None
+        }
+    }
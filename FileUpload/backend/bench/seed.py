@@ -0,0 +1,95 @@
+# Bulk-load a realistic dataset for the benchmarks
+import os
+import random
+from datetime import datetime, timedelta
+from io import BytesIO
+from flask_jwt_extended import create_access_token
+from werkzeug.security import generate_password_hash
+from sqlalchemy import insert
+from app import db
+from app.models import Activity, File, Group, GroupMembership, User
+from app.stats import reconcile_group_stats
+
+PASSWORD = 'benchpass'
+
+
+class Dataset:
+    """What the scenarios need to know about the seeded data."""
+
+    def __init__(self):
+        self.tokens = {}       # user id -> access token
+        self.user_groups = {}  # user id -> [group id]
+        self.group_files = {}  # group id -> [file id]
+
+    def pick(self, rng):
+        """A random (token, group id) for a user that belongs to a group."""
+        user_id = rng.choice(list(self.user_groups))
+        return self.tokens[user_id], rng.choice(self.user_groups[user_id])
+
+
+def seed(storage, groups, members, files, users=None, file_size=4096, activity_per_file=3, rng_seed=0):
+    """Insert ``groups`` groups of ``members`` members and ``files`` files
+    each, drawn from a pool of ``users`` users, with stored objects and an
+    activity history spread over the last 90 days. Call in an app context."""
+    rng = random.Random(rng_seed)
+    users = users or members * 4
+    now = datetime.utcnow()
+
+    # One hash for everyone: hashing thousands of passwords would dominate seeding
+    password_hash = generate_password_hash(PASSWORD)
+    db.session.execute(insert(User), [
+        {'username': f'bench{i}', 'password_hash': password_hash, 'created_at': now, 'is_active': True}
+        for i in range(users)
+    ])
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+
+    db.session.execute(insert(Group), [
+        {'name': f'bench-group-{i}', 'created_by': user_ids[0], 'created_at': now}
+        for i in range(groups)
+    ])
+    group_ids = [group_id for (group_id,) in db.session.query(Group.id).order_by(Group.id)]
+
+    dataset = Dataset()
+    memberships, group_members = [], {}
+    for group_id in group_ids:
+        chosen = rng.sample(user_ids, min(members, len(user_ids)))
+        group_members[group_id] = chosen
+        for i, user_id in enumerate(chosen):
+            memberships.append({'user_id': user_id, 'group_id': group_id, 'role': 'owner' if i == 0 else 'member',
+                                'joined_at': now})
+            dataset.user_groups.setdefault(user_id, []).append(group_id)
+    db.session.execute(insert(GroupMembership), memberships)
+
+    file_rows = []
+    for group_id in group_ids:
+        for i in range(files):
+            key = f'group_{group_id}/bench_{i}.bin'
+            storage.put(key, BytesIO(os.urandom(file_size)), length=file_size)
+            file_rows.append({
+                'filename': f'bench_{i}.bin', 'original_filename': f'bench_{i}.bin', 'minio_key': key,
+                'file_size': file_size, 'mime_type': 'application/octet-stream', 'group_id': group_id,
+                'uploader_id': rng.choice(group_members[group_id]), 'is_deleted': False,
+                'uploaded_at': now - timedelta(seconds=rng.randrange(90 * 86400))
+            })
+    if file_rows:
+        db.session.execute(insert(File), file_rows)
+    for file_id, group_id in db.session.query(File.id, File.group_id):
+        dataset.group_files.setdefault(group_id, []).append(file_id)
+
+    activity = []
+    for group_id, file_ids in dataset.group_files.items():
+        for file_id in file_ids:
+            for _ in range(activity_per_file):
+                activity.append({
+                    'user_id': rng.choice(group_members[group_id]), 'group_id': group_id, 'file_id': file_id,
+                    'activity_type': 'download', 'description': 'Downloaded "bench file"',
+                    'timestamp': now - timedelta(seconds=rng.randrange(90 * 86400)), 'activity_data': None
+                })
+    for start in range(0, len(activity), 10000):
+        db.session.execute(insert(Activity), activity[start:start + 10000])
+    db.session.commit()
+    reconcile_group_stats()
+
+    for user_id in dataset.user_groups:
+        dataset.tokens[user_id] = create_access_token(identity=str(user_id), expires_delta=timedelta(days=1))
+    return dataset
@@ -0,0 +1,30 @@
+# Gunicorn settings, used by start.sh (`gunicorn -c gunicorn.conf.py`)
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+
+# sync handles one request per worker process, so a slow client holds a
+# whole worker for the length of its transfer. gevent serves up to
+# worker_connections requests per worker, switching whenever one waits on
+# the client, Postgres or MinIO; size DB_POOL_SIZE and MINIO_POOL_SIZE to
+# match, since waiting for a pooled connection blocks a request too.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+
+def post_fork(server, worker):
+    # psycopg2 blocks in C, out of sight of gevent's socket patching; make it
+    # yield to the hub while waiting on the server instead
+    if worker_class == 'gevent' and os.getenv('DATABASE_URL', '').startswith('postgres'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live-gauge samples from the shared metrics
+    # directory; its counters and histograms are kept
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -11,6 +11,12 @@ echo "Database is ready!"
 echo "Running database migrations..."
 python3 migrate.py
 
+# Workers write metrics to a shared directory that /metrics aggregates;
+# it must start empty so samples from a previous run are not reported
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/filevault-metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 # Start the application
 echo "Starting Flask application..."
-exec gunicorn -b 0.0.0.0:8000 "app:create_app()" 
\ No newline at end of file
+exec gunicorn -c gunicorn.conf.py "app:create_app()" 
\ No newline at end of file
@@ -0,0 +1,14 @@
+# Default environment so create_app() works without a .env file
+import os
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+os.environ.setdefault('JWT_SECRET_KEY', 'test-jwt-secret-key-that-is-long-enough')
+os.environ.setdefault('MINIO_ENDPOINT', 'localhost:9000')
+os.environ.setdefault('MINIO_BUCKET', 'filevault')
+os.environ.setdefault('ACTIVITY_ASYNC', 'false')
+# Any request over its view's query budget fails the test that made it
+os.environ.setdefault('SQL_QUERY_BUDGET_STRICT', 'true')
+# Hash inline and cheaply; the pool itself is covered in test_auth
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+os.environ.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
@@ -0,0 +1,175 @@
+# Shared fixtures for route tests: an in-memory MinIO stand-in and a base test case
+import hashlib
+import json
+import unittest
+from datetime import datetime, timezone
+from io import BytesIO
+from unittest import mock
+
+from minio.error import S3Error
+
+from app import create_app, db
+from app.storage import MinioStorage
+
+
+class FakeObject:
+    def __init__(self, name, data, content_type=None):
+        self.object_name = name
+        self.data = data
+        self.size = len(data)
+        self.etag = hashlib.md5(data).hexdigest()
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.content_type = content_type or 'application/octet-stream'
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+        self.released = False
+
+    def stream(self, amt=65536):
+        for i in range(0, len(self.data), amt):
+            yield self.data[i:i + amt]
+
+    def read(self, amt=None):
+        if amt is None:
+            data, self.data = self.data, b''
+        else:
+            data, self.data = self.data[:amt], self.data[amt:]
+        return data
+
+    def close(self):
+        self.closed = True
+
+    def release_conn(self):
+        self.released = True
+
+
+class FakeMinio:
+    """Just enough of the minio.Minio API for the routes under test."""
+
+    def __init__(self):
+        self.objects = {}
+        self.responses = []
+        self.uploads = {}
+        self.puts = 0
+
+    def _missing(self, name):
+        return S3Error('NoSuchKey', 'Object does not exist', name, None, None, None)
+
+    def put_object(self, bucket, name, data, length, content_type='application/octet-stream',
+                   part_size=0, **kwargs):
+        body = data.read() if length < 0 else data.read(length)
+        self.objects[name] = FakeObject(name, body, content_type)
+        self.puts += 1
+
+    def compose_object(self, bucket, name, sources):
+        body = b''.join(self.objects[source.object_name].data for source in sources)
+        self.objects[name] = FakeObject(name, body, self.objects[sources[0].object_name].content_type)
+
+    def remove_object(self, bucket, name):
+        self.objects.pop(name, None)
+
+    def remove_objects(self, bucket, delete_object_list):
+        for obj in delete_object_list:
+            self.objects.pop(obj._name, None)
+        return iter([])
+
+    def list_objects(self, bucket, prefix=None, recursive=False):
+        return iter([obj for name, obj in sorted(self.objects.items()) if name.startswith(prefix or '')])
+
+    def stat_object(self, bucket, name):
+        if name not in self.objects:
+            raise self._missing(name)
+        return self.objects[name]
+
+    def get_object(self, bucket, name, offset=0, length=0):
+        if name not in self.objects:
+            raise self._missing(name)
+        data = self.objects[name].data
+        data = data[offset:offset + length] if length else data[offset:]
+        response = FakeResponse(data)
+        self.responses.append(response)
+        return response
+
+    def _create_multipart_upload(self, bucket, name, headers):
+        upload_id = f'upload-{len(self.uploads) + 1}'
+        self.uploads[upload_id] = {'name': name, 'parts': {}, 'headers': headers}
+        return upload_id
+
+    def _upload_part(self, bucket, name, data, headers, upload_id, part_number):
+        self.uploads[upload_id]['parts'][part_number] = data
+        return hashlib.md5(data).hexdigest()
+
+    def _complete_multipart_upload(self, bucket, name, upload_id, parts):
+        upload = self.uploads.pop(upload_id)
+        body = b''.join(upload['parts'][part.part_number] for part in parts)
+        self.objects[name] = FakeObject(name, body, upload['headers'].get('Content-Type'))
+
+    def _abort_multipart_upload(self, bucket, name, upload_id):
+        if self.uploads.pop(upload_id, None) is None:
+            raise S3Error('NoSuchUpload', 'The specified upload does not exist', name, None, None, None)
+
+    def presigned_put_object(self, bucket, name, expires=None):
+        return f'http://minio.test/{bucket}/{name}?X-Amz-Signature=put'
+
+    def presigned_get_object(self, bucket, name, expires=None, response_headers=None):
+        return f'http://minio.test/{bucket}/{name}?X-Amz-Signature=get'
+
+
+class FileVaultTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.populated = 0
+        self.minio = FakeMinio()
+        self.storage = MinioStorage(self.minio, 'filevault')
+        patcher = mock.patch('app.routes.files.storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def post_json(self, url, payload, headers=None):
+        return self.client.post(url, data=json.dumps(payload),
+                                content_type='application/json', headers=headers)
+
+    def count_queries(self, url, headers=None, method='GET', **kwargs):
+        """Make a request and return it with the number of SQL statements it issued."""
+        self.app.config['SQL_DEBUG_HEADERS'] = True
+        response = self.client.open(url, method=method, headers=headers, **kwargs)
+        return response, int(response.headers['X-Query-Count'])
+
+    def login(self, username, password='testpass'):
+        self.post_json('/api/auth/register', {'username': username, 'password': password})
+        response = self.post_json('/api/auth/login', {'username': username, 'password': password})
+        return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+    def create_group(self, headers, name='team'):
+        response = self.post_json('/api/groups/', {'name': name}, headers=headers)
+        return response.get_json()['group_id']
+
+    def add_member(self, headers, group_id, username, role='member'):
+        return self.post_json(f'/api/groups/{group_id}/add_user',
+                              {'username': username, 'role': role}, headers=headers)
+
+    def populate(self, headers, group_id, members=0, files=0):
+        """Add ``members`` new users to the group and upload ``files`` distinct files."""
+        for _ in range(members):
+            self.populated += 1
+            username = f'member{self.populated}'
+            self.login(username)
+            self.add_member(headers, group_id, username)
+        for i in range(files):
+            self.populated += 1
+            self.client.post(f'/api/files/{group_id}/upload',
+                             data={'file': (BytesIO(f'file {self.populated}'.encode()), f'f{i}.txt')},
+                             headers=headers)
@@ -0,0 +1,130 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from app import db
+from app.activity import activity_writer, compact_activity, log_activity
+from app.models import Activity, ActivityRollup
+from tests.helpers import FileVaultTestCase
+
+
+class ActivityWriterTestCase(FileVaultTestCase):
+    def configure(self, **options):
+        settings = dict(enabled=True, max_queue=100, batch_size=50, flush_interval=0.05)
+        settings.update(options)
+        activity_writer.configure(self.app, **settings)
+        self.addCleanup(activity_writer.configure, self.app, enabled=False)
+
+    def count(self):
+        with self.app.app_context():
+            return Activity.query.count()
+
+    def test_batches_are_flushed_in_the_background(self):
+        """Test queued activities are written by the writer thread"""
+        self.configure()
+        for i in range(10):
+            log_activity(user_id=1, activity_type='download', description=f'Downloaded {i}')
+        activity_writer.shutdown()
+        self.assertEqual(self.count(), 10)
+        self.assertEqual(activity_writer.stats()['written'], 10)
+
+    def test_full_queue_writes_inline_by_default(self):
+        """Test the sync overflow policy never loses records"""
+        self.configure(max_queue=2)
+        with mock.patch.object(activity_writer, '_ensure_thread'):
+            for i in range(5):
+                log_activity(user_id=1, activity_type='download', description=f'Downloaded {i}')
+            self.assertEqual(activity_writer.stats()['inline_writes'], 3)
+            activity_writer.flush()
+        self.assertEqual(self.count(), 5)
+
+    def test_full_queue_drop_policy(self):
+        """Test the drop overflow policy discards and counts excess records"""
+        self.configure(max_queue=2, overflow='drop')
+        with mock.patch.object(activity_writer, '_ensure_thread'):
+            for i in range(5):
+                log_activity(user_id=1, activity_type='download', description=f'Downloaded {i}')
+            activity_writer.flush()
+        self.assertEqual(activity_writer.stats()['dropped'], 3)
+        self.assertEqual(self.count(), 2)
+
+    def test_event_time_is_preserved(self):
+        """Test rows keep the time they were recorded, not the flush time"""
+        self.configure()
+        with mock.patch.object(activity_writer, '_ensure_thread'):
+            log_activity(user_id=1, activity_type='download', description='Downloaded')
+            with self.app.app_context():
+                queued_at = activity_writer._queue.queue[0]['timestamp']
+            activity_writer.flush()
+        with self.app.app_context():
+            self.assertEqual(db.session.query(Activity.timestamp).scalar(), queued_at)
+
+
+class ActivityFeedTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.first = self.create_group(self.headers, 'first')
+        self.second = self.create_group(self.headers, 'second')
+        self.outsider = self.create_group(self.login('mallory'), 'private')
+
+    def test_pages_merge_groups_newest_first(self):
+        """Test the feed pages through every group in order without gaps or repeats"""
+        base = datetime(2024, 1, 1)
+        with self.app.app_context():
+            for i in range(7):
+                for group_id in (self.first, self.second, self.outsider):
+                    log_activity(user_id=1, group_id=group_id, activity_type='download',
+                                 description=f'{group_id}-{i}', timestamp=base + timedelta(minutes=i))
+            expected = [a.id for a in Activity.query.filter(Activity.group_id.in_([self.first, self.second])).order_by(
+                Activity.timestamp.desc(), Activity.id.desc())]
+
+        seen, cursor = [], None
+        while True:
+            url = '/api/files/recent-activity?limit=4' + (f'&cursor={cursor}' if cursor else '')
+            page = self.client.get(url, headers=self.headers).get_json()
+            self.assertLessEqual(len(page['activities']), 4)
+            seen.extend(a['id'] for a in page['activities'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_group_filter_and_user(self):
+        """Test group_id narrows the feed and entries carry their user"""
+        page = self.client.get(f'/api/files/recent-activity?group_id={self.second}', headers=self.headers).get_json()
+        self.assertEqual([a['group_id'] for a in page['activities']], [self.second])
+        self.assertEqual(page['activities'][0]['user']['username'], 'alice')
+
+        page = self.client.get(f'/api/files/recent-activity?group_id={self.outsider}', headers=self.headers).get_json()
+        self.assertEqual(page['activities'], [])
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.client.get('/api/files/recent-activity?cursor=nope', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_compaction_rolls_up_old_days(self):
+        """Test old raw rows become daily per-group counts and recent rows stay"""
+        now = datetime.utcnow()
+        old = now - timedelta(days=30)
+        with self.app.app_context():
+            for hours in (0, 1, 2):
+                log_activity(user_id=1, group_id=self.first, activity_type='download',
+                             description='old', timestamp=old.replace(hour=hours))
+            log_activity(user_id=1, group_id=None, activity_type='login', description='old', timestamp=old)
+            log_activity(user_id=1, group_id=self.first, activity_type='download', description='new', timestamp=now)
+            before = Activity.query.count()
+
+            self.assertEqual(compact_activity(now - timedelta(days=7)), 4)
+            self.assertEqual(Activity.query.count(), before - 4)
+            rollups = {(r.day, r.group_id, r.activity_type): r.count for r in ActivityRollup.query}
+            self.assertEqual(rollups, {(old.date(), self.first, 'download'): 3, (old.date(), None, 'login'): 1})
+
+            log_activity(user_id=1, group_id=self.first, activity_type='download', description='late', timestamp=old)
+            compact_activity(now - timedelta(days=7))
+            self.assertEqual(ActivityRollup.query.filter_by(group_id=self.first).one().count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,12 @@
 import unittest
 import json
+import os
+import threading
+import time
+from unittest import mock
 from app import create_app, db
 from app.models import User
+from app.passwords import password_hasher
 
 class AuthTestCase(unittest.TestCase):
     def setUp(self):
@@ -52,5 +57,74 @@ class AuthTestCase(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(data['msg'], 'Invalid credentials')
 
+
+class PasswordHashingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.addCleanup(password_hasher.configure, self.app.config['PASSWORD_HASH_METHOD'], 0)
+        
+        with self.app.app_context():
+            db.create_all()
+    
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+    
+    def post(self, url, payload):
+        return self.client.post(url, data=json.dumps(payload), content_type='application/json')
+    
+    def stored_hash(self):
+        with self.app.app_context():
+            return User.query.filter_by(username='testuser').one().password_hash
+    
+    def test_rehash_on_login(self):
+        """Test login upgrades hashes made with old cost parameters"""
+        password_hasher.configure('pbkdf2:sha256:1000', workers=0)
+        self.post('/api/auth/register', {'username': 'testuser', 'password': 'testpass'})
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha256:1000$'))
+        
+        password_hasher.configure('pbkdf2:sha256:2000', workers=0)
+        response = self.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha256:2000$'))
+        
+        response = self.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, 200)
+    
+    def test_hashing_in_pool(self):
+        """Test registration and login hash in the process pool"""
+        password_hasher.configure('pbkdf2:sha256:1000', workers=1)
+        self.assertEqual(self.post('/api/auth/register', {'username': 'testuser', 'password': 'testpass'}).status_code, 201)
+        self.assertEqual(self.post('/api/auth/login', {'username': 'testuser', 'password': 'testpass'}).status_code, 200)
+        self.assertEqual(self.post('/api/auth/login', {'username': 'testuser', 'password': 'nope'}).status_code, 401)
+    
+    def test_saturated_pool_rejects_with_429(self):
+        """Test a full hashing queue answers 429 instead of waiting"""
+        with mock.patch.dict(os.environ, {'PASSWORD_HASH_WORKERS': '1', 'PASSWORD_HASH_MAX_PENDING': '1',
+                                          'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000000'}):
+            self.app = create_app()
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+        
+        # Another request's slow hash fills the queue
+        hashing = threading.Thread(target=password_hasher.hash, args=('storm',))
+        hashing.start()
+        while password_hasher.pending < 1:
+            time.sleep(0.01)
+        
+        response = self.post('/api/auth/register', {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(password_hasher.rejected, 1)
+        
+        hashing.join()
+        password_hasher.configure('pbkdf2:sha256:1000', workers=1, max_pending=1)
+        response = self.post('/api/auth/register', {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, 201)
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,60 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+
+from app.models import Activity, File, GroupMembership
+from bench.__main__ import main
+from bench.runner import SCENARIOS, percentile
+from bench.seed import seed
+from tests.helpers import FileVaultTestCase
+
+
+class BenchSeedTestCase(FileVaultTestCase):
+    def test_seeded_dataset_serves_every_scenario(self):
+        """Test the seeded dataset is consistent and every scenario request succeeds"""
+        with self.app.app_context():
+            dataset = seed(self.storage, groups=3, members=2, files=4, users=5, file_size=128)
+            self.assertEqual(File.query.count(), 12)
+            self.assertEqual(GroupMembership.query.count(), 6)
+            self.assertEqual(Activity.query.count(), 36)
+
+        rng = random.Random(0)
+        for name, build_request in SCENARIOS.items():
+            method, path, token, body, content_type = build_request(dataset, rng, {'file_size': 128})
+            response = self.client.open(path, method=method, data=body, content_type=content_type,
+                                        headers={'Authorization': f'Bearer {token}'})
+            self.assertLess(response.status_code, 400, name)
+            response.close()
+
+
+class BenchCompareTestCase(unittest.TestCase):
+    def write_report(self, directory, name, p99):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            json.dump({'params': {}, 'results': {'stats': {
+                'throughput_rps': 100.0, 'latency_ms': {'p50': 5.0, 'p99': p99}}}}, f)
+        return path
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_compare_fails_on_p99_regression(self):
+        """Test compare exits non-zero only when p99 regresses past the threshold"""
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = self.write_report(directory, 'old.json', 10.0)
+            candidate = self.write_report(directory, 'new.json', 12.0)
+            with redirect_stdout(StringIO()), redirect_stderr(StringIO()):
+                self.assertEqual(main(['compare', baseline, candidate, '--fail-over', '50']), 0)
+                self.assertEqual(main(['compare', baseline, candidate, '--fail-over', '10']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,847 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from io import BytesIO
+from unittest import mock
+
+import zstandard
+
+from app import db
+from app.cache import object_cache
+from app.compression import compression_policy
+from app.models import Activity, Blob, File, FileChange, GroupStats
+from app.stats import reconcile_group_stats, seed_group_stats
+from tests.helpers import FakeResponse, FileVaultTestCase
+
+
+class ListFilesTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+        for i in range(7):
+            name = f'photo{i}.png' if i % 2 else f'doc{i}.txt'
+            self.client.post(f'/api/files/{self.group_id}/upload',
+                             data={'file': (BytesIO(f'file {i}'.encode()), name)},
+                             headers=self.headers)
+        self.url = f'/api/files/{self.group_id}/list'
+
+    def collect(self, params):
+        names, cursor = [], None
+        while True:
+            query = dict(params, cursor=cursor) if cursor else params
+            page = self.client.get(self.url, query_string=query, headers=self.headers).get_json()
+            self.assertLessEqual(len(page['files']), params['limit'])
+            names.extend(f['filename'] for f in page['files'])
+            cursor = page['next_cursor']
+            if not cursor:
+                return names
+
+    def test_pages_cover_every_file_once(self):
+        """Test following next_cursor visits every file exactly once, newest first"""
+        names = self.collect({'limit': 3})
+        self.assertEqual(names, ['doc6.txt', 'photo5.png', 'doc4.txt', 'photo3.png',
+                                 'doc2.txt', 'photo1.png', 'doc0.txt'])
+        self.assertEqual(self.collect({'limit': 2, 'order': 'asc'}), list(reversed(names)))
+
+    def test_mime_type_prefix_filter(self):
+        """Test filtering by a MIME type prefix"""
+        self.assertEqual(self.collect({'limit': 2, 'mime_type': 'image/'}),
+                         ['photo5.png', 'photo3.png', 'photo1.png'])
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.client.get(self.url, query_string={'cursor': 'nope'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class DownloadTestCase(FileVaultTestCase):
+    filename = 'data.bin'
+
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+        self.payload = bytes(range(256)) * 64
+        response = self.client.post(f'/api/files/{self.group_id}/upload',
+                                    data={'file': (BytesIO(self.payload), self.filename)},
+                                    headers=self.headers)
+        self.file_id = response.get_json()['file_id']
+        self.url = f'/api/files/{self.group_id}/download/{self.file_id}'
+
+    def test_full_download_streams_and_releases_connection(self):
+        """Test full download returns the object with validators"""
+        response = self.client.get(self.url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.payload)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response.headers)
+        self.assertIn('Last-Modified', response.headers)
+        self.assertTrue(self.minio.responses[-1].released)
+
+    def test_range_request(self):
+        """Test a single byte range returns 206 partial content"""
+        headers = dict(self.headers, Range='bytes=100-199')
+        response = self.client.get(self.url, headers=headers)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.payload[100:200])
+        self.assertEqual(response.headers['Content-Range'], f'bytes 100-199/{len(self.payload)}')
+
+    def test_suffix_range_request(self):
+        """Test a suffix byte range returns the tail of the object"""
+        headers = dict(self.headers, Range='bytes=-10')
+        response = self.client.get(self.url, headers=headers)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.payload[-10:])
+
+    def test_unsatisfiable_range(self):
+        """Test a range beyond the object returns 416"""
+        headers = dict(self.headers, Range=f'bytes={len(self.payload) + 10}-')
+        response = self.client.get(self.url, headers=headers)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], f'bytes */{len(self.payload)}')
+
+    def test_if_range_mismatch_sends_full_object(self):
+        """Test a stale If-Range validator falls back to the full object"""
+        headers = dict(self.headers, Range='bytes=0-9')
+        headers['If-Range'] = '"stale-etag"'
+        response = self.client.get(self.url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.payload)
+
+    def test_if_none_match_returns_not_modified(self):
+        """Test a matching If-None-Match returns 304 without a body"""
+        etag = self.client.get(self.url, headers=self.headers).headers['ETag']
+        opened = len(self.minio.responses)
+        response = self.client.get(self.url, headers=dict(self.headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(len(self.minio.responses), opened)
+
+
+class CachedDownloadTestCase(DownloadTestCase):
+    """The download tests again, served through the local disk cache."""
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        object_cache.configure(cache_dir, 2 * len(self.payload) + 1, len(self.payload))
+        self.addCleanup(object_cache.configure, None, 0, 0)
+
+    def test_hits_skip_minio(self):
+        """Test repeat downloads are served from disk"""
+        self.client.get(self.url, headers=self.headers)
+        opened = len(self.minio.responses)
+        response = self.client.get(self.url, headers=dict(self.headers, Range='bytes=10-19'))
+        self.assertEqual(response.data, self.payload[10:20])
+        self.assertEqual(len(self.minio.responses), opened)
+        self.assertEqual(object_cache.stats()['hits'], 1)
+
+    def test_concurrent_misses_fetch_once(self):
+        """Test simultaneous misses on one object share a single fetch"""
+        release = threading.Event()
+        opened = []
+
+        def open_object():
+            opened.append(1)
+            release.wait(5)
+            return self.minio.get_object('filevault', 'shared')
+
+        self.minio.put_object('filevault', 'shared', BytesIO(b'shared'), 6)
+        paths = []
+        threads = [threading.Thread(target=lambda: paths.append(object_cache.fetch('shared', 'etag', open_object)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while object_cache.stats()['coalesced'] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(len(set(paths)), 1)
+
+    def test_least_recently_used_is_evicted(self):
+        """Test the byte budget evicts the least recently used object"""
+        def store(name):
+            self.minio.put_object('filevault', name, BytesIO(self.payload), len(self.payload))
+            return object_cache.fetch(name, 'etag', lambda: self.minio.get_object('filevault', name))
+
+        object_cache.configure(object_cache.directory, 3 * len(self.payload) - 1, len(self.payload))
+        first, second = store('first'), store('second')
+        os.utime(first, (0, 0))
+        store('third')
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+        self.assertEqual(object_cache.stats()['evicted_bytes'], len(self.payload))
+
+    def test_directory_is_only_rescanned_to_evict(self):
+        """Test inserts keep a running size and eviction frees headroom for later ones"""
+        object_cache.configure(object_cache.directory, 1000, 100)
+        with mock.patch.object(object_cache, '_entries', wraps=object_cache._entries) as scans:
+            for i in range(13):
+                object_cache.fetch(f'object-{i}', 'etag', lambda: FakeResponse(b'x' * 100))
+        self.assertEqual(scans.call_count, 2)
+        self.assertEqual((object_cache.stats()['evictions'], object_cache.stats()['size_bytes']), (4, 900))
+
+    def test_entry_evicted_before_serving(self):
+        """Test a cached copy removed by another worker falls back to streaming from storage"""
+        fetch = object_cache.fetch
+
+        def fetch_then_evict(*args):
+            path = fetch(*args)
+            os.remove(path)
+            return path
+
+        with mock.patch.object(object_cache, 'fetch', side_effect=fetch_then_evict):
+            response = self.client.get(self.url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.payload)
+
+
+class CompressedDownloadTestCase(DownloadTestCase):
+    """The download tests again, for a file stored zstd-compressed."""
+    filename = 'data.csv'
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {'STORAGE_COMPRESSION': 'zstd'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def stored(self):
+        with self.app.app_context():
+            db_file = db.session.get(File, self.file_id)
+            return db_file.content_encoding, self.minio.objects[db_file.minio_key].data
+
+    def test_stored_compressed(self):
+        """Test the object is stored compressed and the encoding recorded"""
+        encoding, data = self.stored()
+        self.assertEqual(encoding, 'zstd')
+        self.assertLess(len(data), len(self.payload) / 10)
+        self.assertEqual(zstandard.ZstdDecompressor().decompress(data), self.payload)
+
+    def test_accepting_clients_get_encoded_bytes(self):
+        """Test a client accepting zstd gets the stored bytes with their own ETag"""
+        plain = self.client.get(self.url, headers=self.headers)
+        self.assertEqual(plain.headers['Content-Length'], str(len(self.payload)))
+        self.assertEqual(plain.headers['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+        headers = dict(self.headers, **{'Accept-Encoding': 'gzip, zstd'})
+        encoded = self.client.get(self.url, headers=headers)
+        self.assertEqual(encoded.headers['Content-Encoding'], 'zstd')
+        self.assertEqual(encoded.data, self.stored()[1])
+        self.assertNotEqual(encoded.headers['ETag'], plain.headers['ETag'])
+
+        revalidated = self.client.get(self.url, headers=dict(headers, **{'If-None-Match': encoded.headers['ETag']}))
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_only_compressible_uploads_are_compressed(self):
+        """Test random data and binary types are stored as they are"""
+        for name, data in [('noise.txt', os.urandom(64 * 1024)), ('image.png', self.payload + b'png'),
+                           ('tiny.csv', b'a,b\n' * 10)]:
+            response = self.client.post(f'/api/files/{self.group_id}/upload',
+                                        data={'file': (BytesIO(data), name)}, headers=self.headers)
+            file_id = response.get_json()['file_id']
+            with self.app.app_context():
+                self.assertIsNone(db.session.get(File, file_id).content_encoding, name)
+            download = self.client.get(f'/api/files/{self.group_id}/download/{file_id}', headers=self.headers)
+            self.assertEqual(download.data, data)
+
+    def test_duplicates_share_the_compressed_blob(self):
+        """Test identical content shares the compressed blob whatever the current policy"""
+        compression_policy.configure(enabled=False)
+        other_group = self.create_group(self.headers, 'other')
+        response = self.client.post(f'/api/files/{other_group}/upload',
+                                    data={'file': (BytesIO(self.payload), 'copy.csv')}, headers=self.headers)
+        with self.app.app_context():
+            self.assertEqual([(blob.content_encoding, blob.ref_count) for blob in Blob.query], [('zstd', 2)])
+        download = self.client.get(f'/api/files/{other_group}/download/{response.get_json()["file_id"]}',
+                                   headers=self.headers)
+        self.assertEqual(download.data, self.payload)
+
+    def test_batch_uploads_and_archives(self):
+        """Test batch uploads are compressed too and archives hold the original bytes"""
+        files = {'a.json': b'{"key": "value"}\n' * 1000, 'b.log': b'GET / 200\n' * 1000}
+        response = self.client.post(f'/api/files/{self.group_id}/upload-batch',
+                                    data={'files': [(BytesIO(data), name) for name, data in files.items()]},
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        with self.app.app_context():
+            self.assertEqual({f.original_filename: f.content_encoding for f in File.query},
+                             {'a.json': 'zstd', 'b.log': 'zstd', 'data.csv': 'zstd'})
+
+        archive = zipfile.ZipFile(BytesIO(self.client.get(f'/api/files/{self.group_id}/archive',
+                                                          headers=self.headers).data))
+        self.assertEqual(archive.read('a.json'), files['a.json'])
+        self.assertEqual(archive.read('data.csv'), self.payload)
+
+
+class StreamingUploadTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+        self.url = f'/api/files/{self.group_id}/upload-stream'
+
+    def test_raw_body_upload(self):
+        """Test the raw body is stored with its computed size and hash"""
+        body = b'{"rows": [1, 2, 3]}' * 100
+        response = self.client.put(self.url, data=body,
+                                   headers=dict(self.headers, **{'X-Filename': 'rows.json'}))
+        self.assertEqual(response.status_code, 201)
+        data = response.get_json()
+        self.assertEqual(data['file_size'], len(body))
+        self.assertEqual(data['sha256'], hashlib.sha256(body).hexdigest())
+
+        (stored,) = self.minio.objects.values()
+        self.assertEqual(stored.data, body)
+        self.assertEqual(stored.content_type, 'application/json')
+        self.assertEqual(stored.object_name, f"blobs/{data['sha256'][:2]}/{data['sha256']}")
+
+    def test_filename_required(self):
+        """Test a raw upload without a filename is rejected"""
+        response = self.client.put(self.url, data=b'abc', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_empty_body_rejected(self):
+        """Test an empty raw upload is rejected and nothing is stored"""
+        response = self.client.put(f'{self.url}?filename=empty.txt', data=b'', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.minio.objects, {})
+
+
+class DeduplicationTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.groups = [self.create_group(self.headers, name) for name in ('one', 'two')]
+        self.payload = b'installer bytes' * 1000
+
+    def upload(self, group_id):
+        return self.client.post(f'/api/files/{group_id}/upload',
+                                data={'file': (BytesIO(self.payload), 'setup.exe')},
+                                headers=self.headers)
+
+    def test_same_content_stored_once(self):
+        """Test identical uploads into different groups share one blob"""
+        first = self.upload(self.groups[0]).get_json()
+        second = self.upload(self.groups[1]).get_json()
+        # Uploaders never learn whether someone else stored the content
+        self.assertNotIn('deduplicated', second)
+        self.assertEqual(first.keys(), second.keys())
+        self.assertEqual(self.minio.puts, 1)
+        self.assertEqual(len(self.minio.objects), 1)
+
+        with self.app.app_context():
+            (blob,) = Blob.query.all()
+            self.assertEqual(blob.ref_count, 2)
+            self.assertEqual(blob.sha256, hashlib.sha256(self.payload).hexdigest())
+
+        response = self.client.get(f"/api/files/{self.groups[1]}/download/{second['file_id']}",
+                                   headers=self.headers)
+        self.assertEqual(response.data, self.payload)
+
+    def test_streamed_duplicate_discards_temporary_object(self):
+        """Test a streamed upload of existing content leaves no extra object"""
+        self.upload(self.groups[0])
+        response = self.client.put(f'/api/files/{self.groups[1]}/upload-stream', data=self.payload,
+                                   headers=dict(self.headers, **{'X-Filename': 'setup.exe'}))
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('deduplicated', response.get_json())
+        self.assertEqual(len(self.minio.objects), 1)
+
+    def test_failed_streamed_upload_removes_temporary_object(self):
+        """Test a streamed upload that fails after storing its body leaves nothing behind"""
+        with mock.patch('app.routes.files.acquire_blob', side_effect=RuntimeError('database went away')):
+            response = self.client.put(f'/api/files/{self.groups[0]}/upload-stream', data=self.payload,
+                                       headers=dict(self.headers, **{'X-Filename': 'setup.exe'}))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.minio.objects, {})
+
+
+class BatchUploadTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+        self.url = f'/api/files/{self.group_id}/upload-batch'
+
+    def upload(self, files):
+        return self.client.post(self.url, data={'files': [(BytesIO(data), name) for name, data in files]},
+                                headers=self.headers)
+
+    def test_batch_is_stored_and_recorded(self):
+        """Test a batch stores each distinct content once and records every file"""
+        files = [(f'f{i}.txt', f'content {i % 20}'.encode()) for i in range(30)]
+        files.append(('f0.txt', b'same name, other content'))
+        response = self.upload(files)
+        self.assertEqual(response.status_code, 201)
+        results = response.get_json()['files']
+        self.assertEqual([r['filename'] for r in results], [name for name, _ in files])
+        self.assertEqual(len(self.minio.objects), 21)
+
+        for result, (name, data) in zip(results, files):
+            download = self.client.get(f"/api/files/{self.group_id}/download/{result['file_id']}",
+                                       headers=self.headers)
+            self.assertEqual(download.data, data)
+
+        with self.app.app_context():
+            self.assertEqual(sum(blob.ref_count for blob in Blob.query), 31)
+            self.assertEqual(Activity.query.filter_by(activity_type='upload').count(), 31)
+            stats = db.session.get(GroupStats, self.group_id)
+            self.assertEqual(stats.file_count, 31)
+            self.assertEqual(stats.total_bytes, sum(len(data) for _, data in files))
+
+    def test_existing_content_is_shared(self):
+        """Test batch parts matching stored blobs only take references"""
+        self.upload([('a.txt', b'alpha')])
+        puts = self.minio.puts
+        response = self.upload([('b.txt', b'alpha'), ('c.txt', b'gamma')])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.minio.puts, puts + 1)
+        with self.app.app_context():
+            self.assertEqual(Blob.query.filter_by(size=5).order_by(Blob.id).first().ref_count, 2)
+
+    def test_partial_failure(self):
+        """Test a failed part is reported while the rest are stored"""
+        put_object = self.minio.put_object
+
+        def flaky_put(bucket, name, data, length, **kwargs):
+            if data.read(4) == b'fail':
+                raise OSError('storage unavailable')
+            data.seek(0)
+            return put_object(bucket, name, data, length, **kwargs)
+        self.minio.put_object = flaky_put
+
+        response = self.upload([('ok.txt', b'fine'), ('bad.txt', b'failing'), ('', b'nameless')])
+        self.assertEqual(response.status_code, 207)
+        ok, bad, nameless = response.get_json()['files']
+        self.assertIn('file_id', ok)
+        self.assertIn('storage unavailable', bad['error'])
+        self.assertEqual(nameless['error'], 'No file selected')
+        with self.app.app_context():
+            self.assertEqual(db.session.get(GroupStats, self.group_id).file_count, 1)
+
+
+class ArchiveTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+        self.file_ids = []
+        for name, body in (('notes.txt', b'first'), ('notes.txt', b'second'), ('log.txt', b'x' * 5000)):
+            response = self.client.post(f'/api/files/{self.group_id}/upload',
+                                        data={'file': (BytesIO(body), name)}, headers=self.headers)
+            self.file_ids.append(response.get_json()['file_id'])
+
+    def test_group_archive(self):
+        """Test the whole group is streamed as a ZIP with unique names"""
+        response = self.client.get(f'/api/files/{self.group_id}/archive?compression=deflate',
+                                   headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(response.data))
+        self.assertEqual(archive.namelist(), ['notes.txt', 'notes (1).txt', 'log.txt'])
+        self.assertEqual(archive.read('notes (1).txt'), b'second')
+        self.assertEqual(archive.getinfo('log.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertTrue(all(r.released for r in self.minio.responses))
+
+        with self.app.app_context():
+            activity = Activity.query.filter_by(activity_type='download_archive').one()
+            self.assertEqual(activity.activity_data['file_count'], 3)
+
+    def test_selection_archive(self):
+        """Test only the selected files are included"""
+        response = self.client.get(f'/api/files/{self.group_id}/archive?file_ids={self.file_ids[2]}',
+                                   headers=self.headers)
+        archive = zipfile.ZipFile(BytesIO(response.data))
+        self.assertEqual(archive.namelist(), ['log.txt'])
+        self.assertEqual(archive.getinfo('log.txt').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.read('log.txt'), b'x' * 5000)
+
+    def test_invalid_selection(self):
+        """Test a JSON selection that is not a list of ids is rejected"""
+        for payload in ({'file_ids': 5}, {'file_ids': '1,2'}, {'file_ids': [self.file_ids[0], 'x']},
+                        {'file_ids': [True]}, [self.file_ids[0]]):
+            response = self.post_json(f'/api/files/{self.group_id}/archive', payload, headers=self.headers)
+            self.assertEqual(response.status_code, 400, payload)
+
+        response = self.post_json(f'/api/files/{self.group_id}/archive', {'file_ids': self.file_ids[:1]},
+                                  headers=self.headers)
+        self.assertEqual(zipfile.ZipFile(BytesIO(response.data)).namelist(), ['notes.txt'])
+
+    def test_archive_link(self):
+        """Test a signed link downloads the selection without a JWT, only for members"""
+        response = self.post_json(f'/api/files/{self.group_id}/archive-link',
+                                  {'file_ids': self.file_ids[1:], 'compression': 'deflate'}, headers=self.headers)
+        url = response.get_json()['url']
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(BytesIO(response.data))
+        self.assertEqual(archive.namelist(), ['notes.txt', 'log.txt'])
+        self.assertEqual(archive.getinfo('log.txt').compress_type, zipfile.ZIP_DEFLATED)
+
+        self.assertEqual(self.client.get(url[:-2]).status_code, 403)
+        other_group = self.create_group(self.headers, 'other')
+        self.assertEqual(self.client.get(url.replace(f'/{self.group_id}/', f'/{other_group}/')).status_code, 403)
+        with mock.patch('app.routes.files.get_role', return_value=None):
+            self.assertEqual(self.client.get(url).status_code, 403)
+        with mock.patch('itsdangerous.timed.time.time', return_value=time.time() + 61):
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class StatsTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.groups = [self.create_group(self.headers, name) for name in ('one', 'two')]
+        self.file_ids = []
+        for group_id, body in ((self.groups[0], b'aaaa'), (self.groups[0], b'bbbbbb'), (self.groups[1], b'cc')):
+            response = self.client.post(f'/api/files/{group_id}/upload',
+                                        data={'file': (BytesIO(body), 'f.txt')}, headers=self.headers)
+            self.file_ids.append(response.get_json()['file_id'])
+
+    def stats(self):
+        return self.client.get('/api/files/stats', headers=self.headers).get_json()
+
+    def test_counters_follow_uploads_and_deletes(self):
+        """Test /stats reflects uploads and soft deletes"""
+        stats = self.stats()
+        self.assertEqual(stats['total_files'], 3)
+        self.assertEqual(stats['total_size'], 12)
+        self.assertEqual(stats['files_by_group'][str(self.groups[0])], {'count': 2, 'size': 10})
+
+        self.client.delete(f'/api/files/{self.groups[0]}/delete/{self.file_ids[1]}', headers=self.headers)
+        stats = self.stats()
+        self.assertEqual(stats['total_files'], 2)
+        self.assertEqual(stats['files_by_group'][str(self.groups[0])], {'count': 1, 'size': 4})
+
+    def test_reconcile_rebuilds_counters(self):
+        """Test reconcile restores counters from the file table"""
+        with self.app.app_context():
+            GroupStats.query.delete()
+            db.session.commit()
+            self.assertEqual(reconcile_group_stats(), 2)
+        self.assertEqual(self.stats()['total_size'], 12)
+
+    def test_seed_only_fills_missing_counters(self):
+        """Test seeding creates counters for groups without any and leaves the rest alone"""
+        with self.app.app_context():
+            GroupStats.query.filter_by(group_id=self.groups[1]).delete()
+            GroupStats.query.filter_by(group_id=self.groups[0]).update({GroupStats.file_count: 99})
+            db.session.commit()
+            self.assertEqual(seed_group_stats(), 1)
+            self.assertEqual(seed_group_stats(), 0)
+            self.assertEqual(db.session.get(GroupStats, self.groups[0]).file_count, 99)
+            seeded = db.session.get(GroupStats, self.groups[1])
+            self.assertEqual((seeded.file_count, seeded.total_bytes, seeded.change_seq), (1, 2, 1))
+
+    def test_missing_counters_are_seeded(self):
+        """Test a group without a counters row is seeded on its next upload"""
+        with self.app.app_context():
+            GroupStats.query.filter_by(group_id=self.groups[1]).delete()
+            db.session.commit()
+        self.client.post(f'/api/files/{self.groups[1]}/upload',
+                         data={'file': (BytesIO(b'ddd'), 'g.txt')}, headers=self.headers)
+        self.assertEqual(self.stats()['files_by_group'][str(self.groups[1])], {'count': 2, 'size': 5})
+
+
+class ChangeFeedTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+        self.url = f'/api/files/{self.group_id}/changes'
+
+    def upload(self, name):
+        return self.client.post(f'/api/files/{self.group_id}/upload',
+                                data={'file': (BytesIO(name.encode()), name)},
+                                headers=self.headers).get_json()['file_id']
+
+    def changes(self, **params):
+        return self.client.get(self.url, query_string=params, headers=self.headers).get_json()
+
+    def test_adds_and_deletes_since_cursor(self):
+        """Test the feed returns only changes after the cursor, in order and paged"""
+        self.upload('old.txt')
+        cursor = self.changes()['cursor']
+        first, second = self.upload('a.txt'), self.upload('b.txt')
+        self.client.delete(f'/api/files/{self.group_id}/delete/{first}', headers=self.headers)
+
+        page = self.changes(since=cursor, limit=2)
+        self.assertEqual([(c['change'], c['file_id']) for c in page['changes']],
+                         [('add', first), ('add', second)])
+        self.assertEqual(page['changes'][1]['file']['filename'], 'b.txt')
+        self.assertTrue(page['has_more'])
+
+        page = self.changes(since=page['cursor'])
+        self.assertEqual([(c['change'], c['file_id']) for c in page['changes']], [('delete', first)])
+        self.assertFalse(page['has_more'])
+        self.assertEqual(self.changes(since=page['cursor'])['changes'], [])
+
+        # Rebuilding the counters keeps the sequence going
+        with self.app.app_context():
+            reconcile_group_stats()
+        self.assertEqual(self.changes()['cursor'], page['cursor'])
+        self.upload('c.txt')
+        self.assertEqual(len(self.changes(since=page['cursor'])['changes']), 1)
+
+    def test_missing_log_rows_skip_to_latest(self):
+        """Test a counter ahead of the change log returns the counter as the cursor"""
+        cursor = self.changes()['cursor']
+        self.upload('a.txt')
+        with self.app.app_context():
+            FileChange.query.delete()
+            db.session.commit()
+        page = self.changes(since=cursor)
+        self.assertEqual((page['changes'], page['cursor']), ([], cursor + 1))
+
+    def test_invalid_cursor(self):
+        """Test a cursor past the group's latest change is rejected"""
+        response = self.client.get(self.url, query_string={'since': 5}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_sync_workers_do_not_long_poll(self):
+        """Test without gevent workers a wait is ignored and max_wait is 0"""
+        cursor = self.changes()['cursor']
+        with mock.patch('app.routes.files.time.sleep') as sleep:
+            page = self.changes(since=cursor, wait=25)
+        sleep.assert_not_called()
+        self.assertEqual((page['changes'], page['max_wait']), ([], 0))
+
+    def test_long_poll_returns_when_a_change_lands(self):
+        """Test a waiting request answers as soon as a file is added"""
+        self.app.config['CHANGES_MAX_WAIT'] = 25
+        self.app.config['CHANGES_POLL_INTERVAL'] = 0.01
+        cursor = self.changes()['cursor']
+        self.assertEqual(self.changes(since=cursor, wait=0.05)['changes'], [])
+
+        uploaded = []
+        with mock.patch('app.routes.files.time.sleep', side_effect=lambda _: uploaded or uploaded.append(
+                self.upload('late.txt'))):
+            page = self.changes(since=cursor, wait=10)
+        self.assertEqual([c['file_id'] for c in page['changes']], uploaded)
+
+
+class SearchTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+        self.other_group = self.create_group(self.headers, 'other')
+        self.names = {}
+        for group_id, name in [(self.group_id, 'Q3-Report.pdf'), (self.group_id, 'notes.txt'),
+                               (self.other_group, 'annual_report_final.docx'), (self.group_id, 'reporting.png')]:
+            response = self.client.post(f'/api/files/{group_id}/upload',
+                                        data={'file': (BytesIO(name.encode() * 10), name)}, headers=self.headers)
+            self.names[response.get_json()['file_id']] = name
+
+    def search(self, **params):
+        response = self.client.get('/api/files/search', query_string=params, headers=self.headers)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json()
+
+    def found(self, **params):
+        return sorted(file['filename'] for file in self.search(**params)['files'])
+
+    def test_match_modes(self):
+        """Test substring, prefix and token matching are case-insensitive and AND their terms"""
+        self.assertEqual(self.found(q='REPORT'),
+                         ['Q3-Report.pdf', 'annual_report_final.docx', 'reporting.png'])
+        self.assertEqual(self.found(q='port fin'), ['annual_report_final.docx'])
+        self.assertEqual(self.found(q='q3', match='substring'), ['Q3-Report.pdf'])
+        self.assertEqual(self.found(q='rep', match='prefix'), ['reporting.png'])
+        self.assertEqual(self.found(q='Annual_Rep', match='prefix'), ['annual_report_final.docx'])
+        self.assertEqual(self.found(q='report', match='token'),
+                         ['Q3-Report.pdf', 'annual_report_final.docx', 'reporting.png'])
+        self.assertEqual(self.found(q='port', match='token'), [])
+        self.assertEqual(self.found(q='100%'), [])
+
+    def test_filters(self):
+        """Test the MIME type, size, date and group filters"""
+        self.assertEqual(self.found(q='report', mime_type='image/'), ['reporting.png'])
+        self.assertEqual(self.found(q='report', mime_type='application/pdf'), ['Q3-Report.pdf'])
+        self.assertEqual(self.found(q='report', min_size=200), ['annual_report_final.docx'])
+        self.assertEqual(self.found(q='report', max_size=130), ['Q3-Report.pdf', 'reporting.png'])
+        self.assertEqual(self.found(q='report', group_id=self.other_group), ['annual_report_final.docx'])
+        self.assertEqual(self.found(q='report', uploaded_before='2000-01-01'), [])
+        self.assertEqual(len(self.found(q='report', uploaded_after='2000-01-01T00:00:00')), 3)
+
+    def test_only_callers_live_files(self):
+        """Test results exclude other users' groups and deleted or renamed files"""
+        bob = self.login('bob')
+        self.assertEqual(self.client.get('/api/files/search', query_string={'q': 'report'},
+                                         headers=bob).get_json()['files'], [])
+
+        file_id = next(i for i, name in self.names.items() if name == 'reporting.png')
+        self.client.delete(f'/api/files/{self.group_id}/delete/{file_id}', headers=self.headers)
+        with self.app.app_context():
+            file = db.session.get(File, next(i for i, name in self.names.items() if name == 'notes.txt'))
+            file.original_filename = 'report notes.txt'
+            db.session.commit()
+        self.assertEqual(self.found(q='report'),
+                         ['Q3-Report.pdf', 'annual_report_final.docx', 'report notes.txt'])
+        self.assertEqual(self.found(q='notes'), ['report notes.txt'])
+
+    def test_pagination(self):
+        """Test results page newest first with a cursor"""
+        first = self.search(q='report', limit=2)
+        second = self.search(q='report', limit=2, cursor=first['next_cursor'])
+        self.assertEqual([file['filename'] for file in first['files'] + second['files']],
+                         ['reporting.png', 'annual_report_final.docx', 'Q3-Report.pdf'])
+        self.assertEqual(first['files'][1]['group']['name'], 'other')
+        self.assertIsNone(second['next_cursor'])
+
+    def test_invalid_parameters(self):
+        """Test a missing query, unknown match mode, bad date and bad cursor are rejected"""
+        for params in [{}, {'q': '  '}, {'q': 'a', 'match': 'fuzzy'}, {'q': 'a', 'uploaded_after': 'yesterday'},
+                       {'q': 'a', 'cursor': 'nope'}]:
+            response = self.client.get('/api/files/search', query_string=params, headers=self.headers)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class PresignedTransferTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config['PRESIGNED_TRANSFERS'] = True
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+
+    def presign(self, headers=None):
+        return self.post_json(f'/api/files/{self.group_id}/presign-upload',
+                              {'filename': 'report.csv'}, headers=headers or self.headers)
+
+    def test_presign_finalize_and_download(self):
+        """Test the presigned upload round trip records the file"""
+        response = self.presign()
+        self.assertEqual(response.status_code, 200)
+        token = response.get_json()['upload_token']
+
+        # Simulate the client PUTting straight to MinIO
+        key = response.get_json()['upload_url'].split('/filevault/')[1].split('?')[0]
+        self.minio.put_object('filevault', key, BytesIO(b'a,b\n1,2\n'), 8)
+
+        response = self.post_json(f'/api/files/{self.group_id}/finalize',
+                                  {'upload_token': token}, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['file_size'], 8)
+        file_id = response.get_json()['file_id']
+
+        response = self.post_json(f'/api/files/{self.group_id}/finalize',
+                                  {'upload_token': token}, headers=self.headers)
+        self.assertEqual(response.status_code, 409)
+
+        response = self.client.get(f'/api/files/{self.group_id}/presign-download/{file_id}',
+                                   headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('download_url', response.get_json())
+
+    def test_concurrent_finalize_conflicts(self):
+        """Test a finalize that loses the race to another one with the same token gets 409"""
+        response = self.presign()
+        token = response.get_json()['upload_token']
+        key = response.get_json()['upload_url'].split('/filevault/')[1].split('?')[0]
+        self.minio.put_object('filevault', key, BytesIO(b'a,b\n1,2\n'), 8)
+
+        # The other finalize commits after this one has checked for the key
+        stat_object, finalized = self.minio.stat_object, []
+
+        def stat_after_other_finalize(bucket, name):
+            self.minio.stat_object = stat_object
+            finalized.append(self.post_json(f'/api/files/{self.group_id}/finalize',
+                                            {'upload_token': token}, headers=self.headers).status_code)
+            return stat_object(bucket, name)
+
+        self.minio.stat_object = stat_after_other_finalize
+        response = self.post_json(f'/api/files/{self.group_id}/finalize',
+                                  {'upload_token': token}, headers=self.headers)
+        self.assertEqual((finalized, response.status_code), ([201], 409))
+        with self.app.app_context():
+            self.assertEqual(File.query.filter_by(minio_key=key).count(), 1)
+
+    def test_finalize_requires_uploaded_object(self):
+        """Test finalize rejects tokens whose object was never uploaded"""
+        token = self.presign().get_json()['upload_token']
+        response = self.post_json(f'/api/files/{self.group_id}/finalize',
+                                  {'upload_token': token}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_finalize_rejects_other_users_token(self):
+        """Test a token issued to one member cannot be finalized by another"""
+        token = self.presign().get_json()['upload_token']
+        bob = self.login('bob')
+        self.add_member(self.headers, self.group_id, 'bob')
+        response = self.post_json(f'/api/files/{self.group_id}/finalize',
+                                  {'upload_token': token}, headers=bob)
+        self.assertEqual(response.status_code, 400)
+
+    def test_disabled_by_default(self):
+        """Test presigned endpoints are off unless enabled"""
+        self.app.config['PRESIGNED_TRANSFERS'] = False
+        self.assertEqual(self.presign().status_code, 404)
+
+
+class UploadSessionTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config['UPLOAD_PART_SIZE'] = 4
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+        response = self.post_json(f'/api/files/{self.group_id}/uploads',
+                                  {'filename': 'big.bin'}, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.session_url = f"/api/files/{self.group_id}/uploads/{response.get_json()['session_id']}"
+
+    def put_part(self, number, data):
+        return self.client.put(f'{self.session_url}/parts/{number}', data=data, headers=self.headers)
+
+    def test_out_of_order_and_retried_parts(self):
+        """Test parts can arrive in any order and be retried before completing"""
+        self.assertEqual(self.put_part(2, b'efgh').status_code, 200)
+        self.assertEqual(self.put_part(1, b'xxxx').status_code, 200)
+        self.assertEqual(self.put_part(1, b'abcd').status_code, 200)
+        self.assertEqual(self.put_part(3, b'ij').status_code, 200)
+
+        parts = self.client.get(self.session_url, headers=self.headers).get_json()['parts']
+        self.assertEqual([p['part_number'] for p in parts], [1, 2, 3])
+
+        response = self.client.post(f'{self.session_url}/complete', headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['file_size'], 10)
+        (stored,) = self.minio.objects.values()
+        self.assertEqual(stored.data, b'abcdefghij')
+
+        # A completed session no longer accepts parts
+        self.assertEqual(self.put_part(4, b'kl').status_code, 404)
+
+    def test_complete_reports_missing_parts(self):
+        """Test completing with a gap lists the missing part numbers"""
+        self.put_part(1, b'abcd')
+        self.put_part(3, b'ij')
+        response = self.client.post(f'{self.session_url}/complete', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['missing_parts'], [2])
+
+    def test_oversized_part_rejected(self):
+        """Test a part larger than the session part size is rejected"""
+        self.assertEqual(self.put_part(1, b'abcdef').status_code, 400)
+
+    def test_abort(self):
+        """Test aborting a session discards the multipart upload"""
+        self.put_part(1, b'abcd')
+        response = self.client.delete(self.session_url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.minio.uploads, {})
+        self.assertEqual(self.client.get(self.session_url, headers=self.headers).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
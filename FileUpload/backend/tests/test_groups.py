@@ -0,0 +1,89 @@
+import unittest
+
+from app.authz import MembershipCache, membership_cache
+from tests.helpers import FileVaultTestCase
+
+
+class MyGroupsTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+
+    def test_counts_and_member_preview(self):
+        """Test /my reports counts and at most 5 members per group"""
+        group_id = self.create_group(self.headers, 'big')
+        self.populate(self.headers, group_id, members=6, files=3)
+        self.client.delete(f'/api/files/{group_id}/delete/1', headers=self.headers)
+
+        (group,) = self.client.get('/api/groups/my', headers=self.headers).get_json()
+        self.assertEqual(group['member_count'], 7)
+        self.assertEqual(group['file_count'], 2)
+        self.assertEqual(group['role'], 'owner')
+        self.assertEqual(len(group['members']), 5)
+        self.assertEqual(group['members'][0]['username'], 'alice')
+
+    def test_query_count_is_independent_of_group_size(self):
+        """Test /my issues a fixed number of SQL statements however big the groups are"""
+        small = self.create_group(self.headers, 'small')
+        self.populate(self.headers, small, members=1, files=1)
+        _, baseline = self.count_queries('/api/groups/my', self.headers)
+
+        for name in ('large', 'larger'):
+            group_id = self.create_group(self.headers, name)
+            self.populate(self.headers, group_id, members=4, files=5)
+        response, queries = self.count_queries('/api/groups/my', self.headers)
+
+        self.assertEqual(len(response.get_json()), 3)
+        self.assertEqual(queries, baseline)
+        self.assertLessEqual(queries, 2)
+
+
+class MembershipCacheTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.login('alice')
+        self.member = self.login('bob')
+        self.group_id = self.create_group(self.owner)
+        self.add_member(self.owner, self.group_id, 'bob')
+        self.list_url = f'/api/files/{self.group_id}/list'
+
+    def test_repeat_checks_hit_the_cache(self):
+        """Test repeated membership checks are served from the cache"""
+        self.client.get(self.list_url, headers=self.member)
+        before = membership_cache.stats()
+        self.client.get(self.list_url, headers=self.member)
+        after = membership_cache.stats()
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['misses'], before['misses'])
+
+    def test_removed_member_loses_access_immediately(self):
+        """Test a cached member is refused as soon as they are removed"""
+        self.assertEqual(self.client.get(self.list_url, headers=self.member).status_code, 200)
+        response = self.post_json(f'/api/groups/{self.group_id}/remove_user',
+                                  {'username': 'bob'}, headers=self.owner)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.list_url, headers=self.member).status_code, 403)
+
+    def test_deleted_group_is_evicted(self):
+        """Test deleting a group drops every cached membership for it"""
+        self.client.get(self.list_url, headers=self.member)
+        self.client.delete(f'/api/groups/{self.group_id}', headers=self.owner)
+        self.assertEqual(self.client.get(self.list_url, headers=self.member).status_code, 403)
+        self.assertEqual(self.client.get(self.list_url, headers=self.owner).status_code, 403)
+
+    def test_lru_eviction_and_stale_writes(self):
+        """Test the cache is bounded and ignores lookups that raced an invalidation"""
+        cache = MembershipCache(max_entries=2, ttl=60)
+        for key in ((1, 1), (2, 1), (3, 1)):
+            cache.set(key, 'member', cache.generation)
+        self.assertIsNone(cache.get((1, 1)))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        generation = cache.generation
+        cache.invalidate(4, 1)
+        cache.set((4, 1), 'owner', generation)
+        self.assertIsNone(cache.get((4, 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
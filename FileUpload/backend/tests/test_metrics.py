@@ -0,0 +1,71 @@
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from app.metrics import InstrumentedStorage
+from tests.helpers import FileVaultTestCase
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('app.routes.files.storage', InstrumentedStorage(self.storage))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+
+    def upload(self, data):
+        return self.client.post(f'/api/files/{self.group_id}/upload',
+                                data={'file': (BytesIO(data), 'data.bin')},
+                                headers=self.headers).get_json()['file_id']
+
+    def test_request_and_sql_metrics(self):
+        """Test requests are timed and their SQL statements counted"""
+        endpoint = 'files.list_files'
+        before = sample('filevault_http_request_duration_seconds_count',
+                        method='GET', endpoint=endpoint, status='200')
+        statements = sample('filevault_sql_statements_per_request_sum', endpoint=endpoint)
+
+        # Latency is recorded when the server closes the response
+        self.client.get(f'/api/files/{self.group_id}/list', headers=self.headers).close()
+
+        self.assertEqual(sample('filevault_http_request_duration_seconds_count',
+                                method='GET', endpoint=endpoint, status='200'), before + 1)
+        self.assertGreater(sample('filevault_sql_statements_per_request_sum', endpoint=endpoint), statements)
+
+    def test_storage_and_streamed_bytes(self):
+        """Test storage calls and streamed response bodies are measured"""
+        payload = b'x' * 5000
+        put_bytes = sample('filevault_storage_bytes_total', operation='put')
+        file_id = self.upload(payload)
+        self.assertEqual(sample('filevault_storage_bytes_total', operation='put'), put_bytes + len(payload))
+
+        get_count = sample('filevault_storage_operation_duration_seconds_count', operation='get')
+        sent = sample('filevault_http_response_bytes_total', method='GET', endpoint='files.download_file')
+        response = self.client.get(f'/api/files/{self.group_id}/download/{file_id}', headers=self.headers)
+        body = response.get_data()
+        response.close()
+
+        self.assertEqual(sample('filevault_storage_operation_duration_seconds_count', operation='get'),
+                         get_count + 1)
+        self.assertEqual(sample('filevault_http_response_bytes_total', method='GET',
+                                endpoint='files.download_file'), sent + len(body))
+        self.assertEqual(body, payload)
+
+    def test_metrics_endpoint(self):
+        """Test /metrics serves the Prometheus text format"""
+        self.client.get(f'/api/files/{self.group_id}/list', headers=self.headers).close()
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'filevault_http_request_duration_seconds_bucket', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
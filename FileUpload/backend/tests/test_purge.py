@@ -0,0 +1,123 @@
+import unittest
+from datetime import datetime, timedelta
+from io import BytesIO
+from unittest import mock
+
+from app.compression import compression_policy
+from app.models import Activity, Blob, File
+from app.purge import PurgeError, purge_deleted_files, purge_temporary_objects
+from tests.helpers import FileVaultTestCase
+
+
+class PurgeTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.groups = [self.create_group(self.headers, name) for name in ('one', 'two')]
+
+    def upload(self, group_id, data=b'report contents'):
+        response = self.client.post(f'/api/files/{group_id}/upload',
+                                    data={'file': (BytesIO(data), 'report.txt')},
+                                    headers=self.headers)
+        return response.get_json()['file_id']
+
+    def delete(self, group_id, file_id):
+        self.client.delete(f'/api/files/{group_id}/delete/{file_id}', headers=self.headers)
+
+    def purge(self, days_ago=0, **kwargs):
+        with self.app.app_context():
+            return purge_deleted_files(datetime.utcnow() - timedelta(days=days_ago) + timedelta(seconds=1),
+                                       self.storage, **kwargs)
+
+    def test_grace_period(self):
+        """Test files are only purged once their grace period has passed"""
+        self.app.config['CONTENT_ADDRESSED_STORAGE'] = False
+        file_id = self.upload(self.groups[0])
+        self.delete(self.groups[0], file_id)
+
+        self.assertEqual(self.purge(days_ago=7), (0, 0))
+        self.assertEqual(len(self.minio.objects), 1)
+
+        self.assertEqual(self.purge(), (1, len(b'report contents')))
+        self.assertEqual(self.minio.objects, {})
+        with self.app.app_context():
+            self.assertIsNone(File.query.get(file_id))
+            self.assertEqual(Activity.query.filter_by(file_id=file_id).count(), 0)
+            self.assertEqual(Activity.query.filter_by(activity_type='delete').count(), 1)
+
+    def test_shared_blob_survives_until_last_reference(self):
+        """Test a deduplicated object is only removed with its last file"""
+        first = self.upload(self.groups[0])
+        second = self.upload(self.groups[1])
+
+        self.delete(self.groups[0], first)
+        self.assertEqual(self.purge(), (1, 0))
+        self.assertEqual(len(self.minio.objects), 1)
+        with self.app.app_context():
+            self.assertEqual(Blob.query.one().ref_count, 1)
+
+        self.delete(self.groups[1], second)
+        self.assertEqual(self.purge(), (1, len(b'report contents')))
+        self.assertEqual(self.minio.objects, {})
+        with self.app.app_context():
+            self.assertEqual(Blob.query.count(), 0)
+
+        # The same content can be uploaded again afterwards
+        self.upload(self.groups[0])
+        self.assertEqual(len(self.minio.objects), 1)
+
+    def test_deleted_group_files_are_purged_in_batches(self):
+        """Test deleting a group soft-deletes its files for the purge worker"""
+        for i in range(5):
+            self.upload(self.groups[0], f'file {i}'.encode())
+        self.client.delete(f'/api/groups/{self.groups[0]}', headers=self.headers)
+        with self.app.app_context():
+            self.assertEqual(File.query.filter_by(is_deleted=True, group_id=None).count(), 5)
+
+        self.assertEqual(self.purge(batch_size=2)[0], 5)
+        self.assertEqual(self.minio.objects, {})
+
+    def test_compressed_objects_report_their_stored_size(self):
+        """Test reclaimed bytes count what compressed objects took in storage"""
+        compression_policy.configure(enabled=True)
+        self.addCleanup(compression_policy.configure)
+        data = b'timestamp,level,message\n' * 1000
+        blob_file = self.upload(self.groups[0], data)
+        self.app.config['CONTENT_ADDRESSED_STORAGE'] = False
+        owned_file = self.upload(self.groups[1], data)
+        stored = sum(obj.size for obj in self.minio.objects.values())
+        self.assertLess(stored, len(data))
+
+        self.delete(self.groups[0], blob_file)
+        self.delete(self.groups[1], owned_file)
+        self.assertEqual(self.purge(), (2, stored))
+        self.assertEqual(self.minio.objects, {})
+
+    def test_failed_removal_keeps_rows(self):
+        """Test rows are kept for a retry when MinIO refuses a deletion"""
+        file_id = self.upload(self.groups[0])
+        self.delete(self.groups[0], file_id)
+        error = mock.Mock(message='Access Denied')
+        error.name = 'report.txt'
+        with mock.patch.object(self.minio, 'remove_objects', return_value=iter([error])):
+            with self.assertRaises(PurgeError):
+                self.purge()
+        with self.app.app_context():
+            self.assertIsNotNone(File.query.get(file_id))
+            self.assertEqual(Blob.query.one().ref_count, 1)
+
+    def test_stale_temporary_objects_are_removed(self):
+        """Test temporary upload objects are swept once they are old enough"""
+        file_id = self.upload(self.groups[0])
+        for key in ('tmp/abandoned', 'tmp/in-flight'):
+            self.storage.put(key, BytesIO(b'partial'))
+        self.minio.objects['tmp/abandoned'].last_modified -= timedelta(days=2)
+
+        with self.app.app_context():
+            self.assertEqual(purge_temporary_objects(datetime.utcnow() - timedelta(days=1), self.storage), 1)
+            key = File.query.get(file_id).minio_key
+        self.assertEqual(sorted(self.minio.objects), [key, 'tmp/in-flight'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from app.queries import QueryBudgetExceeded, budget_for
+from tests.helpers import FileVaultTestCase
+
+
+class QueryBudgetTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+
+    def test_every_route_declares_a_budget(self):
+        """Test every API view declares a query budget"""
+        with self.app.app_context():
+            for rule in self.app.url_map.iter_rules():
+                if rule.endpoint.split('.')[0] in ('auth', 'files', 'groups'):
+                    self.assertIsNotNone(budget_for(rule.endpoint), rule.endpoint)
+
+    def test_read_endpoints_do_not_scale_with_data(self):
+        """Test read endpoints issue the same number of statements as groups fill up"""
+        urls = [
+            f'/api/groups/{self.group_id}',
+            f'/api/files/{self.group_id}/list',
+            '/api/files/recent-activity',
+            '/api/files/stats',
+            '/api/groups/my'
+        ]
+        self.populate(self.headers, self.group_id, members=1, files=1)
+        baseline = {url: self.count_queries(url, self.headers)[1] for url in urls}
+
+        self.populate(self.headers, self.group_id, members=5, files=8)
+        self.populate(self.headers, self.create_group(self.headers, 'second'), members=3, files=4)
+        for url in urls:
+            response, queries = self.count_queries(url, self.headers)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(queries, baseline[url], url)
+
+    def test_debug_headers(self):
+        """Test the debug headers report the count, time and budget"""
+        response, queries = self.count_queries(f'/api/groups/{self.group_id}', self.headers)
+        self.assertLessEqual(queries, int(response.headers['X-Query-Budget']))
+        self.assertIn('X-Query-Time-Ms', response.headers)
+
+        self.app.config['SQL_DEBUG_HEADERS'] = False
+        response = self.client.get(f'/api/groups/{self.group_id}', headers=self.headers)
+        self.assertNotIn('X-Query-Count', response.headers)
+
+    def test_over_budget_requests(self):
+        """Test strict mode raises on an over-budget request and otherwise only logs"""
+        view = self.app.view_functions['files.get_file_stats']
+        view.query_budget = 0
+        self.addCleanup(setattr, view, 'query_budget', 1)
+
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/api/files/stats', headers=self.headers)
+
+        self.app.config['SQL_QUERY_BUDGET_STRICT'] = False
+        with self.assertLogs('app.queries', 'WARNING'):
+            response = self.client.get('/api/files/stats', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from io import BytesIO
+from unittest import mock
+
+from minio import Minio
+from minio.error import S3Error
+
+from app import db
+from app.models import UploadSession
+from app.purge import expire_upload_sessions, purge_deleted_files
+from app.storage import LocalStorage, MinioStorage, ObjectNotFound
+from tests.helpers import FileVaultTestCase
+
+
+class LocalStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.storage = LocalStorage(root, fsync_bytes=4)
+
+    def test_put_open_stat_delete(self):
+        """Test objects round-trip, including ranged reads"""
+        self.storage.put('group_1/a.txt', BytesIO(b'hello world, ignored'), length=11)
+        self.assertEqual(self.storage.stat('group_1/a.txt').size, 11)
+        self.assertEqual(self.storage.open('group_1/a.txt').read(), b'hello world')
+        self.assertEqual(b''.join(self.storage.open('group_1/a.txt', offset=6, length=3).stream(2)), b'wor')
+
+        self.assertEqual(self.storage.delete(['group_1/a.txt', 'group_1/missing']), [])
+        with self.assertRaises(ObjectNotFound):
+            self.storage.stat('group_1/a.txt')
+
+    def test_copy_shares_data(self):
+        """Test copy hard-links rather than duplicating bytes"""
+        self.storage.put('tmp/upload', BytesIO(b'data'))
+        self.storage.copy('tmp/upload', 'blobs/ab/abc')
+        self.storage.delete(['tmp/upload'])
+        self.assertEqual(self.storage.open('blobs/ab/abc').read(), b'data')
+        self.assertEqual(os.stat(self.storage.local_path('blobs/ab/abc')).st_nlink, 1)
+
+    def test_multipart(self):
+        """Test parts are assembled in order and the upload is cleaned up"""
+        upload_id = self.storage.create_multipart('group_1/big.bin', None)
+        etags = {n: self.storage.upload_part('group_1/big.bin', upload_id, n, data)
+                 for n, data in ((2, b'world'), (1, b'hello '))}
+        self.storage.complete_multipart('group_1/big.bin', upload_id, sorted(etags.items()))
+        self.assertEqual(self.storage.open('group_1/big.bin').read(), b'hello world')
+        self.assertEqual(os.listdir(os.path.join(self.storage.root, '.uploads')), [])
+
+    def test_list(self):
+        """Test listing a prefix yields its objects but no temporary files"""
+        for key in ('tmp/a', 'tmp/b/c', 'blobs/d'):
+            self.storage.put(key, BytesIO(b'x'))
+        open(os.path.join(self.storage.root, 'tmp', '.partial.tmp'), 'wb').close()
+        self.assertEqual(sorted(key for key, _ in self.storage.list('tmp/')), ['tmp/a', 'tmp/b/c'])
+
+    def test_keys_cannot_escape_root(self):
+        """Test keys outside the root or in reserved directories are rejected"""
+        for key in ('../outside', 'group_1/../../outside', '.uploads/x/1'):
+            with self.assertRaises(ValueError):
+                self.storage.put(key, BytesIO(b'x'))
+
+    def test_failed_write_leaves_nothing(self):
+        """Test an interrupted upload leaves neither the object nor a temp file"""
+        stream = mock.Mock()
+        stream.read.side_effect = [b'part', OSError('client went away')]
+        with self.assertRaises(OSError):
+            self.storage.put('group_1/a.txt', stream)
+        self.assertEqual(os.listdir(os.path.join(self.storage.root, 'group_1')), [])
+
+
+class MinioStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        # Autospec holds the calls to minio-py's real signatures, including
+        # the private multipart helpers it has no public equivalent for
+        self.client = mock.create_autospec(Minio, instance=True)
+        self.storage = MinioStorage(self.client, 'filevault')
+
+    def test_multipart_wrappers(self):
+        """Test the multipart wrappers call minio-py's helpers as they are defined"""
+        self.client._create_multipart_upload.return_value = 'upload-1'
+        self.client._upload_part.return_value = 'etag-1'
+        self.assertEqual(self.storage.create_multipart('group_1/big.bin', None), 'upload-1')
+        self.assertEqual(self.storage.upload_part('group_1/big.bin', 'upload-1', 1, b'data'), 'etag-1')
+        self.storage.complete_multipart('group_1/big.bin', 'upload-1', [(1, 'etag-1')])
+        self.storage.abort_multipart('group_1/big.bin', 'upload-1')
+
+        self.client._create_multipart_upload.assert_called_once_with(
+            'filevault', 'group_1/big.bin', {'Content-Type': 'application/octet-stream'})
+        self.client._upload_part.assert_called_once_with('filevault', 'group_1/big.bin', b'data', None, 'upload-1', 1)
+        (parts,) = self.client._complete_multipart_upload.call_args.args[3:]
+        self.assertEqual([(part.part_number, part.etag) for part in parts], [(1, 'etag-1')])
+
+    def test_abort_is_idempotent(self):
+        """Test aborting an upload MinIO no longer knows is not an error"""
+        self.client._abort_multipart_upload.side_effect = S3Error('NoSuchUpload', 'gone', None, None, None, None)
+        self.storage.abort_multipart('group_1/big.bin', 'upload-1')
+
+        self.client._abort_multipart_upload.side_effect = S3Error('AccessDenied', 'no', None, None, None, None)
+        with self.assertRaises(S3Error):
+            self.storage.abort_multipart('group_1/big.bin', 'upload-1')
+
+
+class LocalStorageRoutesTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.storage = LocalStorage(root)
+        patcher = mock.patch('app.routes.files.storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+        self.payload = bytes(range(256)) * 64
+
+    def test_upload_download_and_purge(self):
+        """Test the file lifecycle runs without MinIO"""
+        response = self.client.post(f'/api/files/{self.group_id}/upload',
+                                    data={'file': (BytesIO(self.payload), 'data.bin')},
+                                    headers=self.headers)
+        file_id = response.get_json()['file_id']
+        url = f'/api/files/{self.group_id}/download/{file_id}'
+
+        response = self.client.get(url, headers=self.headers)
+        self.assertEqual(response.data, self.payload)
+        self.assertIn('ETag', response.headers)
+
+        response = self.client.get(url, headers=dict(self.headers, Range='bytes=10-19'))
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.payload[10:20])
+
+        self.client.delete(f'/api/files/{self.group_id}/delete/{file_id}', headers=self.headers)
+        with self.app.app_context():
+            self.assertEqual(purge_deleted_files(datetime.utcnow() + timedelta(seconds=1), self.storage),
+                             (1, len(self.payload)))
+        self.assertEqual([names for _, _, names in os.walk(os.path.join(self.storage.root, 'blobs'))], [[], []])
+
+    def test_streamed_duplicate(self):
+        """Test streamed uploads land on the shared blob and leave no temp object"""
+        for _ in range(2):
+            response = self.client.put(f'/api/files/{self.group_id}/upload-stream', data=self.payload,
+                                       headers=dict(self.headers, **{'X-Filename': 'data.bin'}))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sum(len(names) for _, _, names in os.walk(os.path.join(self.storage.root, 'blobs'))), 1)
+        self.assertEqual(os.listdir(os.path.join(self.storage.root, 'tmp')), [])
+
+    def test_upload_session(self):
+        """Test resumable uploads assemble parts on disk"""
+        session_id = self.post_json(f'/api/files/{self.group_id}/uploads', {'filename': 'data.bin'},
+                                    headers=self.headers).get_json()['session_id']
+        base = f'/api/files/{self.group_id}/uploads/{session_id}'
+        self.client.put(f'{base}/parts/1', data=self.payload[:100], headers=self.headers)
+        self.client.put(f'{base}/parts/2', data=self.payload[100:], headers=self.headers)
+        file_id = self.client.post(f'{base}/complete', headers=self.headers).get_json()['file_id']
+
+        response = self.client.get(f'/api/files/{self.group_id}/download/{file_id}', headers=self.headers)
+        self.assertEqual(response.data, self.payload)
+
+    def test_abandoned_upload_session_expires(self):
+        """Test the purge aborts an upload session idle past the cutoff and removes its parts"""
+        session_id = self.post_json(f'/api/files/{self.group_id}/uploads', {'filename': 'data.bin'},
+                                    headers=self.headers).get_json()['session_id']
+        self.client.put(f'/api/files/{self.group_id}/uploads/{session_id}/parts/1', data=self.payload[:100],
+                        headers=self.headers)
+        uploads = os.path.join(self.storage.root, '.uploads')
+
+        with self.app.app_context():
+            self.assertEqual(expire_upload_sessions(datetime.utcnow() - timedelta(hours=1), self.storage), 0)
+            self.assertEqual(len(os.listdir(uploads)), 1)
+            self.assertEqual(expire_upload_sessions(datetime.utcnow() + timedelta(seconds=1), self.storage), 1)
+            self.assertEqual(db.session.get(UploadSession, session_id).status, 'aborted')
+        self.assertEqual(os.listdir(uploads), [])
+
+    def test_presign_unavailable(self):
+        """Test presigned transfers are refused by the local backend"""
+        self.app.config['PRESIGNED_TRANSFERS'] = True
+        response = self.post_json(f'/api/files/{self.group_id}/presign-upload', {'filename': 'a.txt'},
+                                  headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
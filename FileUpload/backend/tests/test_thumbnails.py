@@ -0,0 +1,158 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+
+from app import db
+from app.models import File, ThumbnailJob
+from app.purge import purge_deleted_files
+from app.thumbnails import generate_thumbnails
+from tests.helpers import FileVaultTestCase
+
+
+def image_bytes(size=(640, 480), fmt='PNG'):
+    out = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(out, fmt)
+    return out.getvalue()
+
+
+class RecordingPool:
+    """Executor that runs each task when its result is asked for, tracking
+    how many are submitted at once and what they were given."""
+
+    def __init__(self):
+        self.in_flight = self.peak = 0
+        self.sources = []
+
+    def submit(self, fn, path, *args):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        self.sources.append(path)
+        future = mock.Mock()
+
+        def result():
+            self.in_flight -= 1
+            return fn(path, *args)
+        future.result = result
+        return future
+
+
+class ThumbnailTestCase(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.headers = self.login('alice')
+        self.group_id = self.create_group(self.headers)
+
+    def upload(self, data, name, group_id=None):
+        group_id = group_id or self.group_id
+        response = self.client.post(f'/api/files/{group_id}/upload',
+                                    data={'file': (BytesIO(data), name)}, headers=self.headers)
+        return response.get_json()['file_id']
+
+    def generate(self, **kwargs):
+        with self.app.app_context():
+            return generate_thumbnails(self.storage, **kwargs)
+
+    def thumbnail(self, file_id, headers=None):
+        return self.client.get(f'/api/files/{self.group_id}/thumbnail/{file_id}',
+                               headers=dict(self.headers, **(headers or {})))
+
+    def test_generates_and_serves_thumbnails(self):
+        """Test images and PDFs get a cacheable thumbnail and other files no job"""
+        image_id = self.upload(image_bytes(), 'photo.png')
+        pdf_id = self.upload(image_bytes(fmt='PDF'), 'scan.pdf')
+        self.upload(b'plain text', 'notes.txt')
+        with self.app.app_context():
+            self.assertEqual(ThumbnailJob.query.count(), 2)
+        self.assertEqual(self.thumbnail(image_id).status_code, 404)
+
+        self.assertEqual(self.generate(), (2, 0, 0))
+        listing = self.client.get(f'/api/files/{self.group_id}/list', headers=self.headers).get_json()
+        self.assertEqual({f['filename']: f['thumbnail'] for f in listing['files']},
+                         {'photo.png': True, 'scan.pdf': True, 'notes.txt': False})
+
+        for file_id in (image_id, pdf_id):
+            response = self.thumbnail(file_id)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'image/webp')
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            self.assertLessEqual(max(Image.open(BytesIO(response.data)).size), 256)
+
+            revalidated = self.thumbnail(file_id, {'If-None-Match': response.headers['ETag']})
+            self.assertEqual(revalidated.status_code, 304)
+        with self.app.app_context():
+            self.assertEqual(ThumbnailJob.query.count(), 0)
+
+    def test_shared_blob_reuses_thumbnail(self):
+        """Test a second file with the same content reuses the stored thumbnail"""
+        self.upload(image_bytes(), 'photo.png')
+        self.generate()
+        puts = self.minio.puts
+
+        other_group = self.create_group(self.headers, 'other')
+        file_id = self.upload(image_bytes(), 'copy.png', other_group)
+        self.assertEqual(self.generate(), (1, 0, 0))
+        self.assertEqual(self.minio.puts, puts)
+        with self.app.app_context():
+            self.assertIsNotNone(db.session.get(File, file_id).thumbnail_key)
+
+    def test_pool_gets_spooled_sources_a_few_at_a_time(self):
+        """Test sources reach the pool as temporary files, bounded in number and removed after"""
+        for i in range(4):
+            self.upload(image_bytes((100 + i, 80)), f'photo{i}.png')
+        pool = RecordingPool()
+        self.assertEqual(self.generate(pool=pool, max_in_flight=2), (4, 0, 0))
+        self.assertEqual((len(pool.sources), pool.peak), (4, 2))
+        self.assertFalse(any(os.path.exists(path) for path in pool.sources))
+
+    def test_failed_renders_retry_then_give_up(self):
+        """Test a render error backs the job off and fails it after max_attempts"""
+        self.upload(b'not really a png', 'broken.png')
+
+        self.assertEqual(self.generate(max_attempts=2), (0, 1, 0))
+        self.assertEqual(self.generate(max_attempts=2), (0, 0, 0))  # backing off
+        with self.app.app_context():
+            job = ThumbnailJob.query.one()
+            self.assertEqual(job.status, 'queued')
+            job.run_after = datetime.utcnow()
+            db.session.commit()
+
+        self.assertEqual(self.generate(max_attempts=2), (0, 1, 0))
+        with self.app.app_context():
+            job = ThumbnailJob.query.one()
+            self.assertEqual((job.status, job.attempts), ('failed', 2))
+            self.assertIsNotNone(job.error)
+
+    def test_expired_lease_is_reclaimed(self):
+        """Test a job left running by a dead worker is picked up after its lease"""
+        self.upload(image_bytes(), 'photo.png')
+        with self.app.app_context():
+            job = ThumbnailJob.query.one()
+            job.status, job.run_after = 'running', datetime.utcnow() + timedelta(minutes=1)
+            db.session.commit()
+        self.assertEqual(self.generate(), (0, 0, 0))
+
+        with self.app.app_context():
+            ThumbnailJob.query.one().run_after = datetime.utcnow()
+            db.session.commit()
+        self.assertEqual(self.generate(), (1, 0, 0))
+
+    def test_purge_removes_thumbnails_and_jobs(self):
+        """Test purging a file removes its thumbnail and any pending job"""
+        rendered = self.upload(image_bytes(), 'photo.png')
+        self.generate()
+        pending = self.upload(image_bytes((10, 10)), 'small.png')
+        for file_id in (rendered, pending):
+            self.client.delete(f'/api/files/{self.group_id}/delete/{file_id}', headers=self.headers)
+
+        with self.app.app_context():
+            self.assertEqual(purge_deleted_files(datetime.utcnow() + timedelta(seconds=1), self.storage)[0], 2)
+            self.assertEqual(ThumbnailJob.query.count(), 0)
+        self.assertEqual(self.minio.objects, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
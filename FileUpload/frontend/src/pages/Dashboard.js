@@ -37,6 +37,8 @@ function Dashboard() {
     recentActivity: []
   });
   const [loading, setLoading] = useState(true);
+  const [activityCursor, setActivityCursor] = useState(null);
+  const [loadingActivity, setLoadingActivity] = useState(false);
 
   useEffect(() => {
     fetchDashboardData();
@@ -54,8 +56,9 @@ function Dashboard() {
         totalGroups: groupsRes.data.length,
         totalFiles: filesRes.data.total_files || 0,
         totalStorage: filesRes.data.total_size || 0,
-        recentActivity: activityRes.data || []
+        recentActivity: activityRes.data.activities || []
       });
+      setActivityCursor(activityRes.data.next_cursor);
     } catch (error) {
       console.error('Error fetching dashboard data:', error);
     } finally {
@@ -63,6 +66,25 @@ function Dashboard() {
     }
   };
 
+  const fetchOlderActivity = async () => {
+    if (!activityCursor || loadingActivity) return;
+    setLoadingActivity(true);
+    try {
+      const response = await axios.get(`${process.env.REACT_APP_API_URL}/api/files/recent-activity`, {
+        params: { cursor: activityCursor }
+      });
+      setStats(prev => ({
+        ...prev,
+        recentActivity: [...prev.recentActivity, ...response.data.activities]
+      }));
+      setActivityCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching activity:', error);
+    } finally {
+      setLoadingActivity(false);
+    }
+  };
+
   const formatFileSize = (bytes) => {
     if (bytes === 0) return '0 Bytes';
     const k = 1024;
@@ -228,8 +250,8 @@ function Dashboard() {
               </Typography>
               {stats.recentActivity.length > 0 ? (
                 <List>
-                  {stats.recentActivity.slice(0, 5).map((activity, index) => (
-                    <ListItem key={index} sx={{ px: 0 }}>
+                  {stats.recentActivity.map((activity) => (
+                    <ListItem key={activity.id} sx={{ px: 0 }}>
                       <ListItemAvatar>
                         <Avatar sx={{ bgcolor: 'grey.100' }}>
                           {getActivityIcon(activity.type)}
@@ -247,6 +269,13 @@ function Dashboard() {
                       />
                     </ListItem>
                   ))}
+                  {activityCursor && (
+                    <Box sx={{ textAlign: 'center', pt: 1 }}>
+                      <Button size="small" onClick={fetchOlderActivity} disabled={loadingActivity}>
+                        {loadingActivity ? 'Loading...' : 'Show older activity'}
+                      </Button>
+                    </Box>
+                  )}
                 </List>
               ) : (
                 <Box sx={{ textAlign: 'center', py: 4 }}>
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { useSearchParams } from 'react-router-dom';
 import {
   Box,
@@ -45,6 +45,69 @@ import {
 import { useDropzone } from 'react-dropzone';
 import axios from 'axios';
 
+// Dropped files go up in batches, a few batches at a time
+const UPLOAD_BATCH_FILES = 50;
+const UPLOAD_BATCH_BYTES = 32 * 1024 * 1024;
+const UPLOAD_CONCURRENCY = 3;
+
+// Seconds each change-feed request may wait for something to happen
+const CHANGES_WAIT_SECONDS = 25;
+// Seconds between change-feed requests when the server cannot hold them open
+const CHANGES_POLL_SECONDS = 10;
+
+const batchFiles = (files) => {
+  const batches = [];
+  let batch = [];
+  let bytes = 0;
+  files.forEach((file) => {
+    if (batch.length && (batch.length >= UPLOAD_BATCH_FILES || bytes + file.size > UPLOAD_BATCH_BYTES)) {
+      batches.push(batch);
+      batch = [];
+      bytes = 0;
+    }
+    batch.push(file);
+    bytes += file.size;
+  });
+  if (batch.length) batches.push(batch);
+  return batches;
+};
+
+// Thumbnails need the auth header, so they are fetched rather than linked;
+// the browser still caches them as the endpoint's Cache-Control allows
+function FileThumbnail({ groupId, file, fallback }) {
+  const [src, setSrc] = useState(null);
+
+  useEffect(() => {
+    if (!file.thumbnail) return undefined;
+    let url = null;
+    let cancelled = false;
+    axios
+      .get(`${process.env.REACT_APP_API_URL}/api/files/${groupId}/thumbnail/${file.id}`, {
+        responseType: 'blob',
+      })
+      .then((response) => {
+        if (cancelled) return;
+        url = window.URL.createObjectURL(response.data);
+        setSrc(url);
+      })
+      .catch(() => {});
+    return () => {
+      cancelled = true;
+      if (url) window.URL.revokeObjectURL(url);
+    };
+  }, [groupId, file.id, file.thumbnail]);
+
+  if (!src) return fallback;
+  return (
+    <Box
+      component="img"
+      src={src}
+      alt=""
+      sx={{ width: 40, height: 40, objectFit: 'cover', borderRadius: 1 }}
+    />
+  );
+}
+
 function Files() {
   const [searchParams] = useSearchParams();
   const [groups, setGroups] = useState([]);
@@ -55,6 +118,10 @@ function Files() {
   const [error, setError] = useState('');
   const [success, setSuccess] = useState('');
   const [uploadProgress, setUploadProgress] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const loadMoreRef = useRef(null);
+  const changeCursor = useRef(null);
 
   useEffect(() => {
     fetchGroups();
@@ -74,10 +141,31 @@ function Files() {
     }
   }, [groups, searchParams]);
 
+  // Load the group, then follow its change feed until the group changes
   useEffect(() => {
-    if (selectedGroup) {
-      fetchFiles();
-    }
+    if (!selectedGroup) return undefined;
+    const controller = new AbortController();
+
+    const follow = async () => {
+      while (!controller.signal.aborted) {
+        if (changeCursor.current === null) {
+          await fetchFiles();
+        }
+        try {
+          if (changeCursor.current === null) throw new Error('Not loaded');
+          const maxWait = await syncChanges(CHANGES_WAIT_SECONDS, controller.signal);
+          if (!maxWait) {
+            await new Promise((resolve) => setTimeout(resolve, CHANGES_POLL_SECONDS * 1000));
+          }
+        } catch (error) {
+          if (controller.signal.aborted) return;
+          await new Promise((resolve) => setTimeout(resolve, 5000));
+        }
+      }
+    };
+    changeCursor.current = null;
+    follow();
+    return () => controller.abort();
   }, [selectedGroup]);
 
   const fetchGroups = async () => {
@@ -95,13 +183,80 @@ function Files() {
     if (!selectedGroup) return;
     
     try {
+      // Take the change cursor first so nothing between it and the listing is missed
+      const changes = await axios.get(`${process.env.REACT_APP_API_URL}/api/files/${selectedGroup.id}/changes`);
       const response = await axios.get(`${process.env.REACT_APP_API_URL}/api/files/${selectedGroup.id}/list`);
-      setFiles(response.data);
+      setFiles(response.data.files);
+      setNextCursor(response.data.next_cursor);
+      changeCursor.current = changes.data.cursor;
     } catch (error) {
       setError('Failed to fetch files');
     }
   };
 
+  // Apply adds and deletes since the cursor instead of reloading the list;
+  // resolves to the longest wait the server allows
+  const syncChanges = async (wait = 0, signal = undefined) => {
+    let hasMore = true;
+    let maxWait = 0;
+    while (hasMore) {
+      const response = await axios.get(
+        `${process.env.REACT_APP_API_URL}/api/files/${selectedGroup.id}/changes`,
+        { params: { since: changeCursor.current, wait }, signal }
+      );
+      // Another sync may have applied some of these already
+      const changes = response.data.changes.filter((change) => change.seq > changeCursor.current);
+      setFiles((previous) => {
+        let updated = previous;
+        changes.forEach((change) => {
+          if (change.change === 'delete') {
+            updated = updated.filter((file) => file.id !== change.file_id);
+          } else if (change.file && !updated.some((file) => file.id === change.file_id)) {
+            updated = [change.file, ...updated];
+          }
+        });
+        return updated;
+      });
+      changeCursor.current = Math.max(changeCursor.current, response.data.cursor);
+      hasMore = response.data.has_more;
+      maxWait = response.data.max_wait;
+      wait = 0;
+    }
+    return maxWait;
+  };
+
+  const fetchMoreFiles = useCallback(async () => {
+    if (!selectedGroup || !nextCursor || loadingMore) return;
+
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(
+        `${process.env.REACT_APP_API_URL}/api/files/${selectedGroup.id}/list`,
+        { params: { cursor: nextCursor } }
+      );
+      setFiles((previous) => [...previous, ...response.data.files]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      setError('Failed to fetch files');
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [selectedGroup, nextCursor, loadingMore]);
+
+  // Load the next page when the end of the list scrolls into view
+  useEffect(() => {
+    const sentinel = loadMoreRef.current;
+    if (!sentinel || !nextCursor) return undefined;
+
+    const observer = new IntersectionObserver((entries) => {
+      if (entries[0].isIntersecting) {
+        fetchMoreFiles();
+      }
+    });
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [nextCursor, fetchMoreFiles]);
+
   const onDrop = async (acceptedFiles) => {
     if (!selectedGroup) {
       setError('Please select a group first');
@@ -113,32 +268,52 @@ function Files() {
     setError('');
 
     try {
-      for (let i = 0; i < acceptedFiles.length; i++) {
-        const file = acceptedFiles[i];
+      const batches = batchFiles(acceptedFiles);
+      const totalBytes = acceptedFiles.reduce((sum, file) => sum + file.size, 0) || 1;
+      const sent = new Array(batches.length).fill(0);
+      const failed = [];
+      let next = 0;
+
+      const uploadBatch = async (index) => {
         const formData = new FormData();
-        formData.append('file', file);
+        batches[index].forEach((file) => formData.append('files', file));
 
-        await axios.post(
-          `${process.env.REACT_APP_API_URL}/api/files/${selectedGroup.id}/upload`,
+        const response = await axios.post(
+          `${process.env.REACT_APP_API_URL}/api/files/${selectedGroup.id}/upload-batch`,
           formData,
           {
             headers: {
               'Content-Type': 'multipart/form-data',
             },
             onUploadProgress: (progressEvent) => {
-              const progress = Math.round(
-                (progressEvent.loaded * 100) / progressEvent.total
-              );
-              setUploadProgress(progress);
+              sent[index] = progressEvent.loaded;
+              const total = sent.reduce((sum, bytes) => sum + bytes, 0);
+              setUploadProgress(Math.min(100, Math.round((total * 100) / totalBytes)));
             },
           }
         );
+        response.data.files
+          .filter((result) => result.error)
+          .forEach((result) => failed.push(result.filename));
+      };
 
-        setUploadProgress(((i + 1) / acceptedFiles.length) * 100);
-      }
+      const uploadNext = async () => {
+        while (next < batches.length) {
+          await uploadBatch(next++);
+        }
+      };
+      await Promise.all(
+        Array.from({ length: Math.min(UPLOAD_CONCURRENCY, batches.length) }, uploadNext)
+      );
 
-      setSuccess(`${acceptedFiles.length} file(s) uploaded successfully!`);
-      fetchFiles();
+      if (failed.length) {
+        setError(`${failed.length} file(s) failed to upload: ${failed.join(', ')}`);
+      }
+      if (failed.length < acceptedFiles.length) {
+        setSuccess(`${acceptedFiles.length - failed.length} file(s) uploaded successfully!`);
+      }
+      // If this fails the change feed catches up on its next poll
+      syncChanges().catch(() => {});
     } catch (error) {
       setError(error.response?.data?.msg || 'Upload failed');
     } finally {
@@ -174,13 +349,27 @@ function Files() {
     }
   };
 
+  const handleDownloadAll = async () => {
+    try {
+      // A signed link lets the browser stream the ZIP to disk rather than
+      // holding the whole archive in memory
+      const response = await axios.post(
+        `${process.env.REACT_APP_API_URL}/api/files/${selectedGroup.id}/archive-link`,
+        {}
+      );
+      window.location.assign(`${process.env.REACT_APP_API_URL}${response.data.url}`);
+    } catch (error) {
+      setError('Download failed');
+    }
+  };
+
   const handleDelete = async (file) => {
     try {
       await axios.delete(
         `${process.env.REACT_APP_API_URL}/api/files/${selectedGroup.id}/delete/${file.id}`
       );
       setSuccess('File deleted successfully!');
-      fetchFiles();
+      syncChanges().catch(() => {});
     } catch (error) {
       setError('Failed to delete file');
     }
@@ -281,7 +470,7 @@ function Files() {
                     Group Info:
                   </Typography>
                   <Chip
-                    label={`${files.length} files`}
+                    label={`${selectedGroup.file_count ?? files.length} files`}
                     size="small"
                     variant="outlined"
                     sx={{ mr: 1 }}
@@ -344,9 +533,19 @@ function Files() {
               {/* Files List */}
               <Card elevation={2}>
                 <CardContent>
-                  <Typography variant="h6" gutterBottom>
-                    Files in {selectedGroup.name}
-                  </Typography>
+                  <Box sx={{ display: 'flex', alignItems: 'center', justifyContent: 'space-between' }}>
+                    <Typography variant="h6" gutterBottom>
+                      Files in {selectedGroup.name}
+                    </Typography>
+                    {files.length > 0 && (
+                      <Button
+                        startIcon={<DownloadIcon />}
+                        onClick={handleDownloadAll}
+                      >
+                        Download all
+                      </Button>
+                    )}
+                  </Box>
 
                   {files.length > 0 ? (
                     <List>
@@ -377,7 +576,11 @@ function Files() {
                             }
                           >
                             <ListItemIcon>
-                              {getFileIcon(file.filename)}
+                              <FileThumbnail
+                                groupId={selectedGroup.id}
+                                file={file}
+                                fallback={getFileIcon(file.filename)}
+                              />
                             </ListItemIcon>
                             <ListItemText
                               primary={file.filename}
@@ -398,6 +601,11 @@ function Files() {
                           {index < files.length - 1 && <Divider />}
                         </React.Fragment>
                       ))}
+                      {nextCursor && (
+                        <Box ref={loadMoreRef} sx={{ py: 2 }}>
+                          {loadingMore && <LinearProgress />}
+                        </Box>
+                      )}
                     </List>
                   ) : (
                     <Box sx={{ textAlign: 'center', py: 4 }}>